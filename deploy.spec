@@ -67,6 +67,7 @@ http://www.deployproject.org for more information.
 %config(noreplace) %{_sysconfdir}/logrotate.d/deploy
 %{python_sitelib}/*
 %{_bindir}/deploy
+%{_bindir}/deployd
 %{_datadir}/deploy
 %doc COPYING
 %doc AUTHORS
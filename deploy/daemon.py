@@ -0,0 +1,242 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+daemon.py
+
+Long-running build server
+
+DeployDaemon accepts build requests on a local UNIX socket and runs them in a
+single long-lived process, so that each build reuses the state warmed by the
+builds before it: imported deploy and yum modules, parsed configs and
+templates, compiled RelaxNG schemas, repository content keyed by metadata
+checksum and the CacheHandler index.
+
+Builds run one at a time in the main thread, since a Build changes the
+working directory and installs signal handlers.  Per-build locking is
+unchanged, so a daemon build and a command-line build of the same definition
+still exclude one another.
+
+Each request is a single line of JSON giving the working directory and the
+command-line arguments for the build:
+
+  {"cwd": "/path/to/dir", "args": ["--debug", "my.definition"]}
+
+The server responds with lines of JSON, one per chunk of console output,
+followed by the exit status of the build:
+
+  {"output": "..."}
+  {"exit": 0}
+"""
+
+import errno
+import json
+import os
+import socket
+import sys
+import traceback
+
+DEFAULT_SOCKET = '/var/run/deployd.sock'
+
+class DeployDaemon:
+  def __init__(self, socket_path=DEFAULT_SOCKET):
+    self.socket_path = socket_path
+    self.sock = None
+
+  def start(self):
+    "Warm up shared state and start listening on the socket"
+    # imported here, rather than at module level, so that clients need not
+    # load deploy.main
+    import deploy.main
+    from deploy.util import rxml
+
+    rxml.tree.enable_parse_cache()
+
+    if is_running(self.socket_path):
+      raise DaemonError("a daemon is already listening on '%s'"
+                        % self.socket_path)
+    try:
+      os.unlink(self.socket_path) # remove stale socket
+    except OSError, e:
+      if e.errno != errno.ENOENT: raise
+
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0077) # only the owner may submit builds
+    try:
+      self.sock.bind(self.socket_path)
+    finally:
+      os.umask(umask)
+    self.sock.listen(16)
+
+  def stop(self):
+    if self.sock is None: return
+    self.sock.close()
+    self.sock = None
+    try:
+      os.unlink(self.socket_path)
+    except OSError:
+      pass
+
+  def serve_forever(self):
+    if self.sock is None: self.start()
+    try:
+      while True:
+        try:
+          conn, _ = self.sock.accept()
+        except socket.error, e:
+          if e.args[0] == errno.EINTR: continue
+          raise
+        try:
+          self.handle(conn)
+        finally:
+          conn.close()
+    finally:
+      self.stop()
+
+  def handle(self, conn):
+    "Read a request from conn, run the build and send its exit status"
+    writer = MessageWriter(conn)
+    line = conn.makefile('r').readline()
+    if not line: return # connection closed without a request
+    try:
+      request = json.loads(line)
+      cwd = request.get('cwd', '/')
+      args = [ x.encode('utf-8') for x in request.get('args', []) ]
+    except (ValueError, AttributeError), e:
+      writer.write("Invalid request: %s\n" % e)
+      status = 2
+    else:
+      status = self.build(cwd, args, writer)
+
+    try:
+      writer.send(exit=status)
+    except socket.error:
+      pass # client went away
+
+  def build(self, cwd, args, out):
+    "Run a build as 'deploy <args>' in cwd, sending output to out"
+    from deploy.callback import DeployCliCallback
+    from deploy.main     import Build
+    from deploy.options  import DeployOptionParser
+
+    from deploy.util.pps.lib import clear_caches
+
+    savedcwd = os.getcwd()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = out
+    builder = None
+    try:
+      try:
+        os.chdir(cwd)
+        # remote files may have changed since the last build
+        clear_caches()
+        opts, args = DeployOptionParser().parse_args(args=args)
+        if len(args) != 1:
+          out.write("Invalid number of arguments (expecting 1, got %d)\n"
+                    % len(args))
+          return 1
+        builder = Build(opts, args, callback=DeployCliCallback())
+        builder.main()
+        return 0
+      except SystemExit, e:
+        return exit_status(e.code, out)
+      except KeyboardInterrupt:
+        raise
+      except BaseException:
+        out.write(traceback.format_exc())
+        return 1
+    finally:
+      # log files are opened per build; don't leak them
+      if builder is not None:
+        fo = getattr(builder.logger.logfile, 'file_object', None)
+        if fo is not None: fo.close()
+      sys.stdout, sys.stderr = stdout, stderr
+      os.chdir(savedcwd)
+
+
+class MessageWriter:
+  "File-like object that sends everything written to it as output messages"
+  def __init__(self, conn):
+    self.conn = conn
+
+  def write(self, s):
+    if isinstance(s, str): s = s.decode('utf-8', 'replace')
+    if s:
+      try:
+        self.send(output=s)
+      except socket.error:
+        pass # client went away; let the build finish regardless
+
+  def writelines(self, lines):
+    for line in lines: self.write(line)
+
+  def flush(self): pass
+  def isatty(self): return False
+
+  def send(self, **message):
+    self.conn.sendall(json.dumps(message) + '\n')
+
+
+def submit(args, socket_path=DEFAULT_SOCKET, cwd=None, out=None):
+  """
+  Send a build request to the daemon listening on socket_path, copying its
+  output to out (sys.stdout by default).  Returns the exit status of the
+  build.
+  """
+  out = out or sys.stdout
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      sock.connect(socket_path)
+    except socket.error, e:
+      raise DaemonError("unable to connect to '%s': %s" % (socket_path, e))
+    sock.sendall(json.dumps({'cwd': cwd or os.getcwd(),
+                             'args': list(args)}) + '\n')
+    for line in sock.makefile('r'):
+      message = json.loads(line)
+      if 'output' in message:
+        out.write(message['output'].encode('utf-8'))
+        out.flush()
+      if 'exit' in message:
+        return message['exit']
+  finally:
+    sock.close()
+
+  raise DaemonError("connection to '%s' closed before the build finished"
+                    % socket_path)
+
+def is_running(socket_path):
+  "Return True if a daemon is accepting connections on socket_path"
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    try:
+      sock.connect(socket_path)
+      return True
+    except socket.error:
+      return False
+  finally:
+    sock.close()
+
+def exit_status(code, out):
+  "Convert a SystemExit code into an exit status, as the interpreter would"
+  if code is None: return 0
+  if isinstance(code, int): return code
+  out.write('%s\n' % code)
+  return 1
+
+
+class DaemonError(StandardError): pass
@@ -31,7 +31,9 @@ from deploy.errors import DeployEventError
 
 from deploy.event.diff   import DiffMixin
 from deploy.event.fileio import IOMixin
+from deploy.event.journal import JournalMixin
 from deploy.event.locals import LocalsMixin
+from deploy.event.profiler import ProfileMixin
 from deploy.event.verify import VerifyMixin
 
 # Constant (re)definitions
@@ -50,7 +52,8 @@ STATUS_FORCE = True
 STATUS_SKIP  = False
 
 
-class Event(dispatch.Event, IOMixin, DiffMixin, LocalsMixin, VerifyMixin):
+class Event(dispatch.Event, IOMixin, DiffMixin, LocalsMixin, VerifyMixin,
+            JournalMixin, ProfileMixin):
   def __init__(self, id, ptr, version=0, suppress_run_message=False, 
                               parentid=None, config_base=None, *args, **kwargs):
     dispatch.Event.__init__(self, id, *args, **kwargs)
@@ -66,6 +69,7 @@ class Event(dispatch.Event, IOMixin, DiffMixin, LocalsMixin, VerifyMixin):
     DiffMixin.__init__(self)
     LocalsMixin.__init__(self)
     VerifyMixin.__init__(self)
+    ProfileMixin.__init__(self)
 
   status = property(lambda self: self._status,
                     lambda self, status: self._apply_status(status))
@@ -93,34 +97,56 @@ class Event(dispatch.Event, IOMixin, DiffMixin, LocalsMixin, VerifyMixin):
   def execute(self):
     self.log(5, L0('*** %s ***' % self.id))
     t_start = time.time()
+    if self.journal_restore():
+      self.log(5, L1("Event unchanged since the last build; skipping (%s)"
+                     % self.id))
+      self.tracer.complete(self.id, 'event', t_start, journaled=True)
+      return
+    cvars_log = self.journal_snapshot()
+    self.profile_start()
     try:
       if self.skipped:
-        self.setup()
+        self.profile(self.setup)
         t_setup = time.time()
         t_run = t_setup
       else:
         if self.forced:
           self.clean()
-        self.setup()
+        self.profile(self.setup)
         t_setup = time.time()
         if self.check():
           if not self.suppress_run_message:
             self.log(1, L0('%s' % self.id))
-          self.run()
+          self.scan.invalidate() # setup() may have written anywhere
+          self.profile(self.run)
+          self.scan.invalidate() # run() may have written anywhere
           t_run = time.time()
           self.postrun() 
         else:
           t_run = t_setup # we didn't run run()
       self.clean_eventcache()
       t_clean_eventcache = time.time()
-      self.apply()
+      self.profile(self.apply)
       t_apply = time.time()
       self.verify()
+      self.journal_record(cvars_log)
     except (DeployEventError, Exception, KeyboardInterrupt), e:
+      self.journal_forget()
+      self.profile_end()
       self.error(e)
       raise
+    self.profile_end()
     t_end = time.time()
 
+    # record event phases to the trace file, if enabled
+    self.tracer.complete(self.id, 'event', t_start, t_end)
+    self.tracer.complete('setup', self.id, t_start, t_setup)
+    if t_run > t_setup:
+      self.tracer.complete('run', self.id, t_setup, t_run)
+    self.tracer.complete('clean_eventcache', self.id, t_run, t_clean_eventcache)
+    self.tracer.complete('apply', self.id, t_clean_eventcache, t_apply)
+    self.tracer.complete('verify', self.id, t_apply, t_end)
+
     # log various event timing info to log level 5
     self.log(5, L1("Event timing (%s):" % self.id), newline=False)
     self.logger.write(5, "total: %s "  % timedelta(seconds=int(t_end   - t_start)))
@@ -135,6 +161,7 @@ class Event(dispatch.Event, IOMixin, DiffMixin, LocalsMixin, VerifyMixin):
     self.log(4, L0("cleaning %s" % self.id))
     IOMixin.clean(self)
     DiffMixin.clean(self)
+    self.scan.invalidate()
   #def check(self) defined in mixins
   def run(self): pass
   #def postrun(self) defined in DiffMixin
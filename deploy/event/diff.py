@@ -39,7 +39,9 @@ class DiffObject:
   "Dummy object to contain diff-related functions"
   def __init__(self, ptr):
     self.ptr = ptr
-    self.tester = difftest.DiffTest(self.ptr.mdfile)
+    self.tester = difftest.DiffTest(self.ptr.mdfile,
+                                    backend=self.ptr.metadata_format,
+                                    scan=self.ptr.scan)
     self.handlers = {}
 
     self.config = None
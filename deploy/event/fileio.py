@@ -18,9 +18,10 @@
 import errno
 
 from deploy.util import pps
-from deploy.util import rxml
 from deploy.util import shlib 
 
+from deploy.util.sync import transfer
+
 from deploy.util.pps.constants import *
 
 from deploy.errors   import DeployEventError
@@ -36,6 +37,7 @@ class IOMixin:
     self.io.clean_eventcache()
 
   def error(self, e):
+    self.scan.invalidate()
     debugdir = self.mddir + '.debug'
     debugdir.rm(recursive=True, force=True)
     self.mddir.rename(debugdir)
@@ -67,7 +69,8 @@ class IOObject(object):
       return int((mode or '').lstrip('0') or oct(0644), 8)
 
     else: #content == 'file'
-      return int((mode or '').lstrip('0') or oct((src.stat().st_mode & 07777) or 0644), 8)
+      return int((mode or '').lstrip('0') or
+                 oct((self.ptr.scan.stat(src).st_mode & 07777) or 0644), 8)
 
   def compute_dst(self, src, dst, content):
     if content == 'text':
@@ -75,8 +78,7 @@ class IOObject(object):
 
     else: # content == 'file'
       r = []
-      for s in src.findpaths():
-        if not s.isfile(): continue
+      for s in self.ptr.scan.findpaths(src, type=TYPE_FILE):
         r.append((s, (dst/s.relpathfrom(src)).normpath()))
       return r
 
@@ -202,7 +204,7 @@ class IOObject(object):
       self.add_fpath(fpath, *args, **kwargs)
 
   def process_files(self, callback=None, link=False, cache=False, what=None,
-                       text='downloading files', **kwargs):
+                       text='downloading files', jobs=1, **kwargs):
     """
     Sync input files to output locations.
 
@@ -211,6 +213,8 @@ class IOObject(object):
     @param cache    : cache files to cache directory before copying
     @param what     : list of ids to be copied (see add_item, above)
     @param text     : text to be passed to callback object as the 'header'
+    @param jobs     : number of files to sync at once; at most
+                      ptr.download_host_jobs of them from the same host
     @param kwargs   : extra arguments to be passed to sync
     """
     output = []
@@ -231,30 +235,46 @@ class IOObject(object):
                                                         self.ptr.mddir))) or
                   self.ptr.diff.input.difference(t.src) or
                   self.ptr.diff.output.difference(t.dst) or
+                  # outputs are checked on disk; run() may have removed
+                  # them since the scan was taken
                   not t.dst.exists() or
-                  ( t.dst.exists() and (t.dst.stat().st_mode & 07777) != t.mode)
+                  (t.dst.stat().st_mode & 07777) != t.mode
                   ],
                   key=lambda t: t.sort)
 
     if tx:
-      start_sync = False # only notify callback if have files to sync
+      span = self.ptr.tracer.span('process_files', self.ptr.id, text=text)
+      span.begin()
+
+      # create files from text
       for item in tx:
-        if item.content == 'text': # create files from text
+        if item.content == 'text':
           item.dst.dirname.mkdirs()
           item.dst.write_text((item.src + '\n').encode('utf8'))
           item.dst.chmod(item.mode)
-        else: # sync existing files
-          if start_sync == False:
-            cb.sync_start(text=text, count=len(tx))
-            start_sync = True
-          try:
-            syncfn(item.src, item.dst, link=link, mode=item.mode,
-                                       callback=cb, **kwargs)
-          except pps.Path.error.PathError, e:
-            raise InputFileError(message=e, file=item.src)
-        output.append(item.dst)
+
+      # sync existing files
+      def sync_item(item, callback):
+        try:
+          syncfn(item.src, item.dst, link=link, mode=item.mode,
+                                     callback=callback, **kwargs)
+        except pps.Path.error.PathError, e:
+          raise InputFileError(message=e, file=item.src)
+
+      files = [ item for item in tx if item.content != 'text' ]
+      if files: # only notify callback if have files to sync
+        cb.sync_start(text=text, count=len(tx))
+      transfer.run(files, sync_item, cb, jobs=jobs,
+                   host=lambda item: item.src.realm,
+                   host_jobs=self.ptr.download_host_jobs)
       cb.sync_end()
 
+      output = [ item.dst for item in tx ]
+      nbytes = 0
+      if self.ptr.tracer.enabled:
+        nbytes = sum([ f.stat().st_size for f in output ])
+      span.end(files=len(tx), bytes=nbytes)
+
     return output
 
   def clean_eventcache(self, all=False, callback=None):
@@ -270,16 +290,17 @@ class IOObject(object):
 
     if all:
       self.ptr.mddir.listdir(all=True).rm(recursive=True)
+      self.ptr.scan.invalidate(self.ptr.mddir)
     else:
       if self.ptr.mdfile.exists() and self.ptr.diff.output:
         self.ptr.diff.output.clear()
 
-        root = rxml.tree.parse(self.ptr.mdfile).getroot()
-        self.ptr.diff.output.mdread(root, self.ptr.mddir)
+        self.ptr.diff.tester.read_metadata(self.ptr.diff.output)
 
         expected = set(self.ptr.diff.output.oldoutput.keys())
         expected.add(self.ptr.mdfile)
-        existing = set(self.ptr.mddir.findpaths(mindepth=1, type=TYPE_NOT_DIR))
+        existing = set(self.ptr.scan.findpaths(self.ptr.mddir, mindepth=1,
+                                               type=TYPE_NOT_DIR))
 
         obsolete = existing.difference(expected)
         if obsolete:
@@ -287,15 +308,18 @@ class IOObject(object):
           for path in obsolete:
             cb.rm(path)
             path.rm(recursive=True)
+          self.ptr.scan.invalidate(self.ptr.mddir)
 
         dirs = [ d for d in
-                 self.ptr.mddir.findpaths(mindepth=1, type=TYPE_DIR)
+                 self.ptr.scan.findpaths(self.ptr.mddir, mindepth=1,
+                                         type=TYPE_DIR)
                  if not d.listdir(all=True) ]
         if dirs:
           cb.rmdir_start()
           for dir in dirs:
             cb.rmdir(dir)
             dir.removedirs()
+          self.ptr.scan.invalidate(self.ptr.mddir)
 
   def list_output(self, what=None):
     """
@@ -0,0 +1,312 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+journal.py
+
+Build-wide change journal
+
+The journal records a fingerprint for each event at the end of a build: the
+event version, a digest of its config, a digest of every control variable it
+consumes, and the size and modification time of its tracked input and output
+files.  It also records the control variables the event set or changed.  On
+the next build, an event whose fingerprint still matches has its control
+variables restored from the journal and does not call setup(), check() or
+run().
+
+Control variables are a TrackingDict, which logs the keys each event reads
+and writes from the thread executing it, so events running in parallel are
+told apart.  A variable the event read is recorded if its value changed
+in place; its value from before the event is what the fingerprint digests.
+
+Events that do not use difftest, that have remote inputs, or that set control
+variables which cannot be pickled are never journaled.
+"""
+
+import cPickle
+import hashlib
+import re
+import threading
+
+from deploy.util import pps
+
+from deploy.util.pps.constants import *
+
+from deploy.dlogging import L1
+
+CVARS_REGEX = re.compile('cvars\[[\'"]([^\'"]+)[\'"]\]')
+
+# difftest handlers whose state the journal knows how to fingerprint
+HANDLERS = set(['input', 'output', 'variables', 'config'])
+
+class JournalMixin:
+  def journal_restore(self):
+    "Restore cvars and return True if the event's fingerprint is unchanged"
+    if not self.journal or self.status is not None: return False
+    return self.journal.restore(self)
+
+  def journal_snapshot(self):
+    "Start logging the cvars this event reads and writes; returns the log"
+    if not self.journal: return None
+    return self.cvars.track()
+
+  def journal_record(self, log):
+    if not self.journal: return
+    self.cvars.untrack()
+    self.journal.record(self, log)
+
+  def journal_forget(self):
+    if not self.journal: return
+    self.cvars.untrack()
+    self.journal.forget(self)
+
+
+class CvarsLog(object):
+  "The cvars an event read and wrote while executing"
+  def __init__(self):
+    self.writes = set()
+    self.reads = {} # key: pickled value when first read, or None
+
+  def read(self, key, value):
+    if key in self.reads or key in self.writes: return
+    try:
+      self.reads[key] = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    except Exception:
+      self.reads[key] = None
+
+  def write(self, key):
+    self.writes.add(key)
+
+
+class TrackingDict(dict):
+  """
+  dict that logs the keys read and written by each thread that has called
+  track(), until it calls untrack()
+  """
+  def __init__(self, *args, **kwargs):
+    dict.__init__(self, *args, **kwargs)
+    self._logs = threading.local()
+
+  def track(self):
+    "Start a new CvarsLog for the current thread and return it"
+    self._logs.log = CvarsLog()
+    return self._logs.log
+
+  def untrack(self):
+    self._logs.log = None
+
+  def _read(self, key):
+    log = getattr(self._logs, 'log', None)
+    if log is not None and dict.__contains__(self, key):
+      log.read(key, dict.__getitem__(self, key))
+
+  def _write(self, key):
+    log = getattr(self._logs, 'log', None)
+    if log is not None:
+      log.write(key)
+
+  def __getitem__(self, key):
+    self._read(key)
+    return dict.__getitem__(self, key)
+
+  def get(self, key, default=None):
+    self._read(key)
+    return dict.get(self, key, default)
+
+  def setdefault(self, key, default=None):
+    if dict.__contains__(self, key): self._read(key)
+    else:                            self._write(key)
+    return dict.setdefault(self, key, default)
+
+  def __setitem__(self, key, value):
+    self._write(key)
+    dict.__setitem__(self, key, value)
+
+  def __delitem__(self, key):
+    self._write(key)
+    dict.__delitem__(self, key)
+
+  def pop(self, key, *default):
+    self._write(key)
+    return dict.pop(self, key, *default)
+
+  def update(self, *args, **kwargs):
+    items = dict(*args, **kwargs)
+    for key in items:
+      self._write(key)
+    dict.update(self, items)
+
+
+class Journal(object):
+  "Persistent, build-wide store of event fingerprints"
+  def __init__(self, file, logger=None):
+    self.file = pps.path(file)
+    self.logger = logger
+    self.entries = {}
+    self.read()
+
+  def read(self):
+    self.entries = {}
+    if not self.file.exists(): return
+    try:
+      fo = open(self.file, 'rb')
+      try:
+        self.entries = cPickle.load(fo)
+      finally:
+        fo.close()
+    except Exception:
+      # an unreadable journal just means every event runs normally
+      self.entries = {}
+
+  def write(self):
+    self.file.dirname.mkdirs()
+    tmp = self.file + '.tmp'
+    fo = open(tmp, 'wb')
+    try:
+      cPickle.dump(self.entries, fo, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      fo.close()
+    tmp.chmod(0600)
+    tmp.rename(self.file)
+
+  def forget(self, event):
+    self.entries.pop(event.id, None)
+
+  def restore(self, event):
+    entry = self.entries.get(event.id)
+    if entry is None: return False
+
+    if (entry['version'] != str(event.event_version) or
+        entry['config'] != config_digest(event, entry['config_paths']) or
+        entry['cvars'] != cvars_digest(event, entry['consumes']) or
+        entry['files'] != file_stats(entry['files'].keys())):
+      self.forget(event)
+      return False
+
+    for key, value in entry['provides'].items():
+      event.cvars[key] = cPickle.loads(value)
+
+    return True
+
+  def record(self, event, log):
+    self.forget(event)
+
+    if event.status is not None or not event.diff.handlers:
+      return
+    if set(event.diff.handlers.keys()) - HANDLERS:
+      return
+
+    files = set([event.mdfile])
+    if event.diff.input:
+      for f in event.diff.input.newinput.keys():
+        if not isinstance(f, pps.Path.local._LocalPath): return
+        files.add(f)
+      for datum in set(event.diff.input.idata):
+        datum = pps.path(datum)
+        if not isinstance(datum, pps.Path.local._LocalPath): return
+        # directory mtimes catch files added to or removed from a tree
+        if datum.isdir():
+          files.update(datum.findpaths(type=TYPE_DIR))
+    if event.diff.output:
+      for datum in set(event.diff.output.odata):
+        datum = pps.path(datum)
+        if not isinstance(datum, pps.Path.local._LocalPath): return
+        files.update(datum.findpaths())
+
+    consumes = set(event.requires) | set(event.conditionally_requires)
+    if event.diff.variables:
+      for var in event.diff.variables.vdata:
+        consumes.update(CVARS_REGEX.findall(var))
+
+    provides = {}
+    for key, value in event.cvars.items():
+      if (key not in log.writes and key not in event.provides and
+          log.reads.get(key) is None): # not read, or unpicklable when read
+        continue
+      try:
+        pickled = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+      except Exception:
+        if self.logger:
+          self.logger.log(5, L1("not journaling '%s': unable to store '%s'"
+                                % (event.id, key)))
+        return
+      if (key not in log.writes and key not in event.provides and
+          pickled == log.reads[key]):
+        continue # read, and unchanged
+      provides[key] = pickled
+
+    digest = cvars_digest(event, consumes, log.reads)
+    if digest is None: return
+
+    config_paths = set()
+    if event.diff.config:
+      config_paths.update(event.diff.config.cdata)
+
+    self.entries[event.id] = {
+      'version':  str(event.event_version),
+      'config':   config_digest(event, config_paths),
+      'config_paths': config_paths,
+      'consumes': consumes,
+      'cvars':    digest,
+      'files':    file_stats(files),
+      'provides': provides,
+    }
+
+
+def config_digest(event, paths):
+  """Digest of the definition's main section, the event's config section and
+  any other config paths tracked by the event"""
+  h = hashlib.sha1()
+  for xpath in ['/*/main', event.config_base]:
+    for elem in event._config.xpath(xpath, []):
+      h.update(str(elem))
+  for xpath in sorted(paths):
+    h.update(xpath)
+    for elem in event.config.xpath(xpath, []):
+      h.update(str(elem))
+  return h.hexdigest()
+
+def cvars_digest(event, keys, before=None):
+  """
+  Digest of the values of the given cvars; before, if given, maps keys to
+  the pickled values they had before the event changed them
+  """
+  h = hashlib.sha1()
+  for key in sorted(keys):
+    h.update(key)
+    if before and key in before:
+      if before[key] is None: return None # unpicklable
+      h.update(before[key])
+      continue
+    try:
+      h.update(cPickle.dumps(dict.get(event.cvars, key),
+                             cPickle.HIGHEST_PROTOCOL))
+    except Exception:
+      return None # unpicklable values never match
+  return h.hexdigest()
+
+def file_stats(files):
+  "Return a dict of path to (size, mtime); missing files map to None"
+  stats = {}
+  for f in files:
+    f = str(f)
+    try:
+      st = pps.path(f).stat()
+      stats[f] = (st.st_size, st.st_mtime)
+    except pps.Path.error.PathError:
+      stats[f] = None
+  return stats
@@ -41,10 +41,9 @@ class Loader(dispatch.Loader):
     for p in paths:
       self._process_path(p/prefix/'extensions', self.load_extensions)
 
-    for mod in self.modules.values():
-      self._process_module(mod, ptr = self.ptr, *args, **kwargs)
-
+    self._process_modules(*args, **kwargs)
     self._resolve_events()
+    self._update_registry()
     return self.top
 
   def _process_path(self, path, default):
@@ -63,6 +62,7 @@ class Loader(dispatch.Loader):
           skip = True; break
       if skip: continue
 
-      m = dispatch.load_modules(modname, path, err=False)
-      if hasattr(m, 'get_module_info'):
-        self.modules.setdefault(modid, m) # only load if not already loaded
+      if modid in self.modules: continue # only load if not already loaded
+      m = self._load_module(mod, modid, modname, path)
+      if m is not None:
+        self.modules[modid] = m
@@ -0,0 +1,63 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import cProfile
+import pstats
+
+from StringIO import StringIO
+
+from deploy.dlogging import L1, L2
+
+PROFILE_SUMMARY_COUNT = 20 # number of functions listed in the log summary
+
+class ProfileMixin:
+  def __init__(self):
+    self.profiler = None
+
+  def profile_start(self):
+    "Create a profiler if this event was selected with --profile-event"
+    if self.id in self.profile_events or 'all' in self.profile_events:
+      self.profiler = cProfile.Profile()
+    else:
+      self.profiler = None
+
+  def profile(self, fn, *args, **kwargs):
+    "Call fn(*args, **kwargs), profiling it if profiling is enabled"
+    if self.profiler is None:
+      return fn(*args, **kwargs)
+    self.profiler.enable()
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      self.profiler.disable()
+
+  def profile_end(self):
+    "Write collected stats to the metadata dir and a summary to the log"
+    if self.profiler is None: return
+
+    pstatsfile = self.mddir/'%s.pstats' % self.id
+    self.profiler.dump_stats(pstatsfile)
+    self.profiler = None
+
+    summary = StringIO()
+    stats = pstats.Stats(pstatsfile, stream=summary)
+    stats.sort_stats('cumulative').print_stats(PROFILE_SUMMARY_COUNT)
+
+    self.log(5, L1("Event profile (%s): %s" % (self.id, pstatsfile)))
+    for line in summary.getvalue().splitlines():
+      if line.strip():
+        self.log(5, L2(line))
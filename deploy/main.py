@@ -26,6 +26,7 @@ __version__ = '3.0'
 __date__    = 'June 26th, 2007'
 
 import errno
+import hashlib
 import imp
 import lxml 
 import os
@@ -41,14 +42,22 @@ from deploy.util import lock
 from deploy.util import rxml
 from deploy.util import shlib
 from deploy.util import si
+from deploy.util import trace
 
 from deploy.util import pps
+from deploy.util.pps              import cacheindex
+from deploy.util.pps              import hashcache
+from deploy.util.pps.lib          import mirror
+from deploy.util.pps.lib          import segmented
+from deploy.util.pps.lib          import validators
 from deploy.util.pps.Path.error   import OfflinePathError
 from deploy.util.pps.cache        import CacheHandler
 from deploy.util.pps.search_paths import SearchPathsHandler
 
 from deploy.util import sync
 
+from deploy.util.difftest.scan import StatScan
+
 from deploy.callback  import (DeployCliCallback, 
                               SyncCallback, CachedCopyCallback,
                               LinkCallback, SyncCallbackCompressed)
@@ -65,7 +74,8 @@ from deploy.event     import Event, CLASS_META
 from deploy.validate  import (DeployValidationHandler,
                                     InvalidEventError)
 
-from deploy.event.loader import Loader
+from deploy.event.journal import Journal, TrackingDict
+from deploy.event.loader  import Loader
 
 from rpmUtils.arch import getArchList
 
@@ -98,6 +108,13 @@ DIST_TAG = {
 # map our supported archs to the highest arch in that arch 'class'
 ARCH_MAP = {'i386': 'athlon', 'x86_64': 'x86_64'}
 
+# cache handlers by cache dir, shared by all builds run in this process
+CACHE_HANDLERS = {}
+
+# the search paths handler, shared by all builds run in this process; each
+# handler wraps pps.path and PathError, so only one is ever created
+SEARCH_PATHS_HANDLER = None
+
 
 class Build(DeployEventErrorHandler, DeployValidationHandler, object):
   """
@@ -218,10 +235,24 @@ class Build(DeployEventErrorHandler, DeployValidationHandler, object):
       # set up lists of enabled and disabled modules
       enabled, disabled = self._compute_modules(options)
 
+      # set up the module registry, used to speed module loading
+      registry = dispatch.ModuleRegistry(self.CACHE_DIR / 'modules.dat')
+      registry.scan([ pps.path(d) / 'deploy/modules' for d in import_dirs ])
+      context = self._compute_module_context(import_dirs, enabled, disabled)
+
+      # list events from the registry, if possible
+      if options.list_events:
+        events = registry.get_events(context)
+        if events is not None:
+          for depth, eventid in events:
+            dispatch.pprint_event(depth, eventid)
+          sys.exit()
+
       # load all enabled modules, register events, set up dispatcher
       loader = Loader(ptr=self, top=AllEvent(ptr = self), api_ver=API_VERSION,
                       enabled=enabled, disabled=disabled,
-                      load_extensions=False)
+                      load_extensions=False,
+                      registry=registry, context=context)
 
       try:
         self.dispatch = dispatch.Dispatch(
@@ -244,11 +275,26 @@ class Build(DeployEventErrorHandler, DeployValidationHandler, object):
       except InvalidEventError, e:
         raise DeployError("\n%s" % e)
 
+      registry.set_events(context, [ (e.depth, e.id) for e in self.dispatch
+                                     if e.enabled ])
+      try:
+        registry.write()
+      except (IOError, OSError, pps.Path.error.PathError), e:
+        self.logger.log(5, L0("unable to write module registry: %s" % e))
+
       # list events, if requested
       if options.list_events:
         self.dispatch.pprint()
         sys.exit()
 
+      # make sure events requested for profiling exist
+      for eventid in self.profile_events:
+        if eventid == 'all': continue
+        try:
+          self.dispatch.get(eventid)
+        except dispatch.UnregisteredEventError:
+          raise DeployError("Unregistered event '%s'" % eventid)
+
       # apply --force to modules/events
       for eventid in self._compute_events(options.force_modules,
                                           options.force_events):
@@ -280,10 +326,21 @@ class Build(DeployEventErrorHandler, DeployValidationHandler, object):
       if self._lock.acquire():
         self._log_header()
         try:
-          self.dispatch.execute(until=None)
+          self.dispatch.execute(until=None, jobs=self.jobs)
         except (DeployEventError, OfflinePathError), e:
           self._handle_Exception(e)
         finally:
+          if self.journal: self.journal.write()
+          self.tracer.write()
+          try:
+            self.hash_cache.write()
+          except (IOError, OSError), e:
+            self.logger.log(5, L0("unable to write checksum cache: %s" % e))
+          # also saved at exit, but builds forked by BatchBuild leave with
+          # os._exit(), which skips exit handlers
+          validators.save_validators()
+          mirror.save_scores()
+          cacheindex.flush_indexes()
           self._lock.release()
         self._log_footer()
       else:
@@ -325,11 +382,24 @@ class Build(DeployEventErrorHandler, DeployValidationHandler, object):
     if cache_max_size.isdigit():
       cache_max_size = '%sGB' % cache_max_size
 
-    self.cache_handler = CacheHandler(cache_dir = self.CACHE_DIR / '.cache',
-                               cache_max_size = si.parse(cache_max_size),
-                               offline = self.mainconfig.getxpath(
-                                         '/deploy/offline/text()', 
-                                          options.offline))
+    cache_dir = self.CACHE_DIR / '.cache'
+    offline = self.mainconfig.getxpath('/deploy/offline/text()', 
+                                       options.offline)
+
+    # reuse the cache handler, and its index, across builds in this process
+    if cache_dir in CACHE_HANDLERS:
+      self.cache_handler = CACHE_HANDLERS[cache_dir]
+      self.cache_handler.cache_max_size = si.parse(cache_max_size)
+      self.cache_handler.offline = offline
+      self.cache_handler.refresh()
+    else:
+      self.cache_handler = CacheHandler(cache_dir = cache_dir,
+                                 cache_max_size = si.parse(cache_max_size),
+                                 offline = offline)
+      CACHE_HANDLERS[cache_dir] = self.cache_handler
+
+    # digests of local files, reused until the files change
+    self.hash_cache = hashcache.enable(self.CACHE_DIR / 'checksums.dat')
 
   def _get_definition_path(self, arguments):
     self.definition_path = pps.path(arguments[0]).expand().abspath()
@@ -356,9 +426,13 @@ class Build(DeployEventErrorHandler, DeployValidationHandler, object):
     self.template_dirs = self._get_mainconfig_paths('templates-path') 
     self.template_dirs.extend(DEFAULT_TEMPLATE_DIRS)
 
-    self.search_paths_handler = SearchPathsHandler({
-                                '%{templates-dir}': self.template_dirs 
-                                })
+    global SEARCH_PATHS_HANDLER
+    search_paths = { '%{templates-dir}': self.template_dirs }
+    if SEARCH_PATHS_HANDLER is None:
+      SEARCH_PATHS_HANDLER = SearchPathsHandler(search_paths)
+    else:
+      SEARCH_PATHS_HANDLER.search_paths = search_paths
+    self.search_paths_handler = SEARCH_PATHS_HANDLER
 
   def _get_main_vars(self, options):
     # read definition one time without processing includes or script macros to
@@ -479,7 +553,10 @@ The definition file is located at %s.
       except KeyError:
         raise DeployError("Module '%s' does not exist or was not loaded"
                                 % moduleid)
-    r.update(events or [])
+    for eventid in events or []:
+      if self.dispatch.get(eventid, None) is None:
+        raise DeployError("Unregistered event '%s'" % eventid)
+      r.add(eventid)
     return r
 
   def _set_status(self, eventid, status, str):
@@ -518,6 +595,18 @@ The definition file is located at %s.
 
     return import_dirs
 
+  def _compute_module_context(self, import_dirs, enabled, disabled):
+    """
+    Compute a key identifying everything modules can see while loading, used
+    to look up cached module information in the module registry.
+    """
+    h = hashlib.sha1()
+    for item in [ API_VERSION, self.type, self.mainconfig, self.definition ]:
+      h.update(str(item))
+    for items in [ import_dirs, enabled, disabled ]:
+      h.update(repr(sorted([ str(x) for x in items ])))
+    return h.hexdigest()
+
   def _compute_modules(self, options):
     """
     Compute a list of modules deploy should not load. Order of precedence is
@@ -588,6 +677,25 @@ The definition file is located at %s.
         raise DeployError("ERROR: The specified share-path '%s' does not "
                           "exist." %d)
 
+    # set up the number of events to execute at once
+    if options.jobs is not None:
+      self.jobs = options.jobs
+    else:
+      self.jobs = int(self.mainconfig.getxpath('/deploy/jobs/text()', 1))
+    if self.jobs < 1:
+      raise InvalidOptionError(self.jobs, 'jobs', "The number of jobs must "
+                               "be greater than zero.")
+
+    # set up the number of files to download at once, in total and per host
+    self.download_jobs = int(self.mainconfig.getxpath(
+                             '/deploy/download-jobs/text()', 4))
+    self.download_host_jobs = int(self.mainconfig.getxpath(
+                                  '/deploy/download-host-jobs/text()', 4))
+
+    # set up the number of parts of a large file to download at once
+    segmented.segment_params['jobs'] = int(self.mainconfig.getxpath(
+                                       '/deploy/download-segments/text()', 1))
+
     # set up cache options
     self.METADATA_DIR = self.CACHE_DIR  / (self.type + 's') / self.build_id
     self.copy_callback  = SyncCallback(self.logger, self.METADATA_DIR)
@@ -596,6 +704,33 @@ The definition file is located at %s.
     self.copy_callback_compressed = SyncCallbackCompressed(
                                      self.logger, self.METADATA_DIR)
 
+    # set up the timing trace, if requested
+    if options.trace:
+      self.tracer = trace.Tracer(pps.path(options.trace).expand().abspath())
+    else:
+      self.tracer = trace.NullTracer()
+
+    # set up events to profile
+    self.profile_events = set(options.profile_events)
+
+    # set up the change journal, used to skip events that have not changed
+    # since the last build
+    if options.journal is not None:
+      journal = options.journal
+    else:
+      journal = self.mainconfig.getbool('/deploy/journal', False)
+    if journal:
+      self.journal = Journal(self.METADATA_DIR / 'journal.dat', self.logger)
+    else:
+      self.journal = None
+
+    # set up the stat snapshot shared by difftest handlers and IOObjects
+    self.scan = StatScan()
+
+    # set up the format for event metadata files
+    self.metadata_format = self.mainconfig.getxpath(
+                           '/deploy/metadata-format/text()', 'sqlite')
+
     selinux_enabled = False
     try:
       selinux_enabled = shlib.execute('/usr/sbin/getenforce')[0] != 'Disabled'
@@ -657,11 +792,27 @@ The definition file is located at %s.
 
     ptr.datfn         = self.datfn # dat filename
     ptr.cache_handler = self.cache_handler
-
-    ptr.copy_callback  = self.copy_callback
-    ptr.cache_callback = self.cache_callback
-    ptr.link_callback  = self.link_callback
-    ptr.copy_callback_compressed = self.copy_callback_compressed
+    ptr.journal       = self.journal
+    ptr.tracer        = self.tracer
+    ptr.profile_events = self.profile_events
+    ptr.metadata_format = self.metadata_format
+    ptr.scan          = self.scan
+    ptr.download_jobs = self.download_jobs
+    ptr.download_host_jobs = self.download_host_jobs
+
+    if self.jobs > 1:
+      # callbacks track per-transfer state; events executing at the same
+      # time need their own instances
+      ptr.copy_callback  = SyncCallback(self.logger, self.METADATA_DIR)
+      ptr.cache_callback = CachedCopyCallback(self.logger, self.METADATA_DIR)
+      ptr.link_callback  = LinkCallback(self.logger, self.METADATA_DIR)
+      ptr.copy_callback_compressed = SyncCallbackCompressed(
+                                      self.logger, self.METADATA_DIR)
+    else:
+      ptr.copy_callback  = self.copy_callback
+      ptr.cache_callback = self.cache_callback
+      ptr.link_callback  = self.link_callback
+      ptr.copy_callback_compressed = self.copy_callback_compressed
 
   def _get_mainconfig_paths(self, tag):
     paths = []
@@ -679,7 +830,7 @@ The definition file is located at %s.
     return paths
 
 ###### Classes ######
-class CvarsDict(dict):
+class CvarsDict(TrackingDict):
   def __getitem__(self, key):
     return self.get(key, None)
 
@@ -26,6 +26,8 @@ import time
 
 from deploy.util import FormattedFile as ffile
 
+from deploy.util.pps.util import checksum_many
+
 from deploy.event  import Event
 from deploy.locals import sort_keys
 
@@ -132,10 +134,12 @@ class TreeinfoEvent(Event):
     # compute checksums
     if 'treeinfo-checksums' in self.cvars:
       lines.append('[checksums]')
-      checksums = sorted(self.cvars['treeinfo-checksums'])
-      for software_store, file in checksums:
-        shasum = (software_store / file).checksum(type="sha1")
-        lines.append('%s = sha1:%s' % (file, shasum))
+      checksums = [ (file, software_store / file) for software_store, file in
+                    sorted(self.cvars['treeinfo-checksums']) ]
+      shasums = checksum_many([ path for file, path in checksums ],
+                              type="sha1")
+      for file, path in checksums:
+        lines.append('%s = sha1:%s' % (file, shasums[path]))
 
     # write .treeinfo
     self.tifile.dirname.mkdirs()
@@ -89,6 +89,7 @@ class DepsolveEvent(DepsolverMixin, ShelveMixin):
 
     self._clean_dsdir()
 
+    span = self.tracer.span('depsolve', self.id).begin()
     try:
       pkgs_by_repo = self.resolve() # in DepsolverMixin
     except (DepsolveError, yum.Errors.InstallError), e:
@@ -97,6 +98,7 @@ class DepsolveEvent(DepsolverMixin, ShelveMixin):
     count = 0
     for tups in pkgs_by_repo.itervalues():
       count = count + len(tups)
+    span.end(packages=count)
     self.log(1, L1("pkglist closure achieved in %d packages" % count))
 
     self.log(1, L1("writing pkglist"))
@@ -78,6 +78,8 @@ class DownloadEvent(ShelveMixin, Event):
             st_mtime = p.time,
             st_mode  = (stat.S_IFREG | 0644),
             st_atime = now)
+          # verify the download against the repodata checksum
+          if p.checksum: rpm.expect_checksum(p.checksum)
 
           # delete existing file if checksum has changed (handles
           # case where packages have been resigned but file size and 
@@ -97,7 +99,8 @@ class DownloadEvent(ShelveMixin, Event):
     self.rpms = {}
     for subrepo in self.cvars['pkglist']:
       self.io.process_files(link=True, cache=True, what=subrepo, 
-                            text=("downloading packages - '%s'" % subrepo))
+                            text=("downloading packages - '%s'" % subrepo),
+                            jobs=self.download_jobs)
       for f in self.io.list_output(what=subrepo):
         self.rpms[f] = subrepo
     self.shelve('rpms', self.rpms)
@@ -110,6 +113,7 @@ class DownloadEvent(ShelveMixin, Event):
   def error(self, e):
     # performing a subset of Event.error since sync handles partially 
     # downloaded files
+    self.scan.invalidate()
     if self.mdfile.exists():
       debugdir=(self.mddir + '.debug')
       debugdir.mkdir()
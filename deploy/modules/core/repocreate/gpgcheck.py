@@ -52,6 +52,9 @@ class GpgcheckEvent(Event, GPGKeysEventMixin):
 
   def setup(self):
     self.diff.setup(self.DATA)
+    # keep the rpm list as a digest and key list; _get_tochecks only needs
+    # the names of rpms added since the last run
+    self.diff.variables.use_digest("cvars['rpms']", keys=True)
 
     self.rpmdb_dir = self.mddir / 'rpmdb'
     if getattr(self, 'cvars[\'gpgcheck-enabled\']', True):
@@ -49,6 +49,7 @@ class RepomdEvent(RepomdMixin, Event):
 
   def setup(self):
     self.diff.setup(self.DATA)
+    self.diff.variables.use_digest("cvars['rpms']")
     self.publish_module = 'publish'
 
     RepomdMixin.setup(self)
@@ -15,7 +15,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
-import os
 
 from deploy.util import mkrpm
 from deploy.util import shlib
@@ -135,10 +134,7 @@ class RpmbuildRepoEvent(Event):
   #----- HELPER METHODS -----#
   def _createrepo(self, path):
     # createrepo
-    cwd = os.getcwd()
-    os.chdir(path)
-    shlib.execute('/usr/bin/createrepo --update -q .')
-    os.chdir(cwd)
+    shlib.execute('/usr/bin/createrepo --update -q .', cwd=path)
 
   def _setup_repos(self, type, updates=None):
 
@@ -271,10 +271,9 @@ class DeployEventMixin(InputEventMixin, ExecuteEventMixin):
   def _get_kickstart_csum(self):
     ksfile = self.cvars['%s-ksfile' % self.moduleid]
     if ksfile:
-      kstext = ksfile.read_text()
+      return ksfile.checksum(type='md5')
     else:
-      kstext = ''
-    return self._get_csum(kstext)
+      return self._get_csum('')
 
   def _get_treeinfo_csum(self):
     if not self.type == 'package':
@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
+import ConfigParser
 import time
 
 from deploy.util import img
@@ -89,6 +90,8 @@ class ImageModifyMixin:
         raise InvalidImageFormatError(self.image_locals['path'], expected, got)
     except (IOError, pps.Path.error.PathError): # file not found, usually
       pass
+    expect_treeinfo_checksum(self.cvars['base-treeinfo'], ip,
+      self.image_locals['path'] % self.cvars['distribution-info'])
     self.io.add_fpath(ip, self.path.dirname, id='ImageModifyMixin')
   def _create_image(self):
     self.DATA['output'].add(self.path)
@@ -132,9 +135,11 @@ class ImageModifyMixin:
 
     # modify image
     if self.imgcb: self.imgcb.start("modifying %s" % self.name)
+    t_start = time.time()
     self._open()
     self._generate()
     self._close()
+    self.tracer.complete('modify image', self.id, t_start, image=self.name)
     if self.imgcb: self.imgcb.end()
 
   def _generate(self):
@@ -174,8 +179,9 @@ class FileDownloadMixin:
     for data in self.file_locals.values():
       rinfix = data['path'] % self.cvars['base-info']
       linfix = data['path'] % self.cvars['distribution-info']
-      self.io.add_fpath(self.cvars['installer-repo'].url/rinfix,
-                        (self.OUTPUT_DIR/linfix).dirname,
+      src = self.cvars['installer-repo'].url/rinfix
+      expect_treeinfo_checksum(self.cvars['base-treeinfo'], src, rinfix)
+      self.io.add_fpath(src, (self.OUTPUT_DIR/linfix).dirname,
                         id='FileDownloadMixin')
 
     self.DATA.setdefault('variables', set()).update(
@@ -188,6 +194,19 @@ class FileDownloadMixin:
     self.io.process_files(what='FileDownloadMixin', cache=True, link=True)
 
 
+def expect_treeinfo_checksum(treeinfo, path, relpath):
+  """
+  Record the checksum the installer repo's .treeinfo lists for relpath, if
+  any, as the expected checksum of path, so that its download is verified
+  """
+  if treeinfo is None: return
+  try:
+    type, checksum = treeinfo.get('checksums', relpath).split(':', 1)
+  except (ConfigParser.Error, ValueError):
+    return
+  path.expect_checksum(checksum.strip(), type=type.strip())
+
+
 class InvalidImageFormatError(DeployEventError, StandardError):
   message = ( "Error reading image file '%(image)s': invalid format: expected "
               "%(expected)s, got %(got)s" )
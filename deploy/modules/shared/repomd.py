@@ -17,8 +17,8 @@
 #
 import errno
 import gzip
-import os
 import sys
+import time
 
 from deploy.util import magic
 from deploy.util import shlib
@@ -67,6 +67,7 @@ class RepomdMixin:
                  update=True, quiet=True, database=True, checksum=None):
     "Run createrepo on the path specified."
     if self.crcb: self.crcb.start("running createrepo")
+    t_start = time.time()
     repodata_dir = path / 'repodata'
 
     args = ['/usr/bin/createrepo']
@@ -90,13 +91,10 @@ class RepomdMixin:
       args.append('--checksum %s' % checksum)
     args.append('.')
 
-    cwd = os.getcwd()
-    os.chdir(path)
-
     count = 0
     while True:
       try:
-        shlib.execute(' '.join(args))
+        shlib.execute(' '.join(args), cwd=path)
       except shlib.ShExecError, e:
         if count >= CREATEREPO_ATTEMPTS or \
             e.errno not in [errno.EAGAIN, errno.EWOULDBLOCK]:
@@ -122,8 +120,8 @@ class RepomdMixin:
       shlib.execute('modifyrepo --mdtype=productid %s %s' % 
                    (pidfile, repodata_dir))
 
-    os.chdir(cwd)
     if self.crcb: self.crcb.end()
+    self.tracer.complete('createrepo', self.id, t_start, path=str(path))
 
     # add data files to output
     repo = IORepo()
@@ -507,8 +507,8 @@ class DeployRepoGroup(DeployRepo):
 class ReposDiffTuple(DiffTuple):
   attrib = DiffTuple.attrib + [('csum', str)]
 
-  def __init__(self, path=None):
-    DiffTuple.__init__(self, path)
+  def __init__(self, path=None, abspath=None, scan=None):
+    DiffTuple.__init__(self, path, abspath, scan)
 
     self.csum = None
 
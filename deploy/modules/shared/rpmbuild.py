@@ -195,6 +195,7 @@ class RpmBuildMixin(CompsSetupEventMixin, ShelveMixin, mkrpm.rpmsign.GpgMixin):
   def _sign_rpms(self):
     if self.rpms and 'gpg-signing-keys' in self.cvars:
       self.log(4, L1("signing rpm(s)"))
+      span = self.tracer.span('sign rpms', self.id).begin()
 
       # set up homedir - used for signing
       homedir = self.mddir / 'gnupg'
@@ -233,6 +234,8 @@ class RpmBuildMixin(CompsSetupEventMixin, ShelveMixin, mkrpm.rpmsign.GpgMixin):
                      % (rpm_path, child.before))
           raise RpmBuildError(message=message)
 
+      span.end(rpms=len(self.rpm_paths))
+
   def _cache_rpmdata(self):
     rpmbuild_data = {}
     if self.rpms:
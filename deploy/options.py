@@ -86,6 +86,11 @@ class DeployOptionParser(OptionParser):
       dest='logfile',
       default=None,
       help="specify a file in which to log output")
+    log_group.add_option('--trace', metavar='PATH',
+      dest='trace',
+      default=None,
+      help="write event timing information to a Chrome trace event file; "
+           "a PATH ending in '.jsonl' writes one JSON record per line")
     self.add_option_group(log_group)
   
     library_group = OptionGroup(self, "library options")
@@ -140,4 +145,24 @@ class DeployOptionParser(OptionParser):
       dest='skip_events',
       default=[],
       help="skip an individual event")
+    event_group.add_option('--profile-event', metavar='EVENT',
+      action='append',
+      dest='profile_events',
+      default=[],
+      help="profile an individual event, or 'all' events, writing "
+           "statistics to the event's metadata directory")
+    event_group.add_option('-j', '--jobs', metavar='N',
+      dest='jobs',
+      type='int',
+      default=None,
+      help="specify the number of independent events to execute at once")
+    event_group.add_option('--journal',
+      dest='journal',
+      action='store_true',
+      default=None,
+      help="skip events that have not changed since the last build")
+    event_group.add_option('--no-journal',
+      dest='journal',
+      action='store_false',
+      help="execute all events, ignoring the change journal")
     self.add_option_group(event_group)
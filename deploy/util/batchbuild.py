@@ -20,35 +20,121 @@
 batchbuild.py
 
 base class for building definitions in a batch process.
+
+Each entry in the build list is a ("definition", "command-line-options")
+tuple, optionally followed by a list of definitions that must be built
+successfully first (for example, a base repository before the definitions
+that derive from it):
+
+  ("derived.definition", "--debug", ["base.definition"])
+
+Definitions are built in dependency order rather than list order.  With
+jobs > 1, up to jobs definitions are built at once, each in its own process.
+Processes share the deploy cache; the CacheHandler's per-file locks ensure
+each file is downloaded only once.  If a build fails, the definitions that
+depend on it are skipped.
 """
 
-# list of definitions in ("definition", "command-line-options") format
+# list of definitions in ("definition", "command-line-options"[, [requires]])
+# format
 buildlist = [
 ("test.definition", "--debug --log-level=0"),
-("test2.definition", "--macro name:value")
+("test2.definition", "--macro name:value", ["test.definition"])
 ]
 
 import os
+import sys
+import traceback
 
 from deploy.main import Build
 
 class BatchBuild:
-  def __init__(self, buildlist=[]):
-    for file,opts in buildlist:
-      # setup
-      self.setup(opts, file)
+  def __init__(self, buildlist=[], jobs=1):
+    self.jobs = jobs
+    self.status = {} # map of definition to exit status; None if skipped
+
+    builds, requires = parse_buildlist(buildlist)
+    order = build_order([ entry[0] for entry in buildlist ], requires)
+    if jobs > 1:
+      self._build_parallel(order, builds, requires)
+    else:
+      for file in order:
+        self._build_one(file, builds[file])
+        self.status[file] = 0
+
+  @property
+  def failed(self):
+    return [ f for f,s in self.status.items() if s != 0 ]
+
+  def _build_one(self, file, opts):
+    # setup
+    self.setup(opts, file)
+
+    # build definition
+    self.build()
+
+    # get id
+    self.id = self.builder.build_id
+
+    # get datadir
+    self.datadir = self.builder.data_dir
+
+    # commit datafiles
+    self.commit()
 
-      # build definition
-      self.build()
+  def _build_parallel(self, order, builds, requires):
+    pending = order[:]
+    running = {} # map of pid to definition
 
-      # get id
-      self.id = self.builder.build_id
+    while pending or running:
+      # start builds whose requirements have completed
+      for file in pending[:]:
+        if len(running) >= self.jobs: break
+        if [ r for r in requires[file] if r not in self.status ]:
+          continue # requirement still pending or running
+        pending.remove(file)
+        if [ r for r in requires[file] if self.status[r] != 0 ]:
+          print "Skipping '%s': a required build failed" % file
+          self.status[file] = None
+          continue
+        running[self._fork(file, builds[file])] = file
 
-      # get datadir
-      self.datadir = self.builder.data_dir
+      if not running: continue
 
-      # commit datafiles
-      self.commit()
+      pid, status = os.wait()
+      if pid not in running: continue
+      file = running.pop(pid)
+      if os.WIFEXITED(status):
+        self.status[file] = os.WEXITSTATUS(status)
+      else:
+        self.status[file] = 1
+
+    if self.failed:
+      print # blank line
+      print "Failed or skipped builds: %s" % ', '.join(sorted(self.failed))
+
+  def _fork(self, file, opts):
+    "Build file in a child process, returning the child's pid"
+    sys.stdout.flush()
+    pid = os.fork()
+    if pid: return pid
+
+    status = 1
+    try:
+      try:
+        self._build_one(file, opts)
+        status = 0
+      except SystemExit, e:
+        if e.code is None or isinstance(e.code, int):
+          status = e.code or 0
+        else:
+          sys.stderr.write('%s\n' % e.code)
+      except BaseException:
+        traceback.print_exc()
+    finally:
+      sys.stdout.flush()
+      sys.stderr.flush()
+      os._exit(status)
 
   def setup(self, opts, file):
     print # blank line 
@@ -66,4 +152,43 @@ class BatchBuild:
     # use self.id in commit message
 
 
+def parse_buildlist(buildlist):
+  "Return dicts mapping each definition to its options and requirements"
+  builds = {}
+  requires = {}
+  for entry in buildlist:
+    file, opts = entry[:2]
+    if file in builds:
+      raise BatchBuildError("'%s' appears more than once in the build list"
+                            % file)
+    builds[file] = opts
+    requires[file] = list(entry[2:] and entry[2] or [])
+
+  for file, reqs in requires.items():
+    for req in reqs:
+      if req not in builds:
+        raise BatchBuildError("'%s' requires '%s', which is not in the "
+                              "build list" % (file, req))
+  return builds, requires
+
+def build_order(files, requires):
+  "Return files, reordered only as needed to follow their requirements"
+  order = []
+  done = set()
+  remaining = list(files)
+  while remaining:
+    ready = [ f for f in remaining if not set(requires[f]) - done ]
+    if not ready:
+      raise BatchBuildError("circular requirements among %s"
+                            % ', '.join(remaining))
+    for f in ready:
+      order.append(f)
+      done.add(f)
+      remaining.remove(f)
+  return order
+
+
+class BatchBuildError(StandardError): pass
+
+
 if __name__ == '__main__': BatchBuild(buildlist)
@@ -49,16 +49,28 @@ Handlers must implement the following interface:
     place between the initial execution and the current one.  Returning
     an object with len >= 1 will signify that a change has taken place,
     while returning a len 0 object means that no change has occurred.
+
+Handlers may also implement the following, which are used in place of
+mdread() and mdwrite() when metadata is kept in the sqlite format (see
+store.py):
+  mdload(store, mddir): reads the records the handler saved from the section
+    of the store named for the handler, using store.items() or store.get().
+  mdsave(store, mddir): replaces the records in the section of the store named
+    for the handler, using store.replace() or store.update().
 """
 
 __author__  = 'Daniel Musgrave <dmusgrave@deployproject.org>'
 __version__ = '1.0'
 __date__    = 'June 12th, 2007'
 
+import sqlite3
+
 from xml.sax import SAXParseException
 
 from deploy.util import rxml
 
+from deploy.util.difftest import store
+
 def expand(list):
   "Expands a list of lists into a list, in place."
   old = []
@@ -76,14 +88,19 @@ class DiffTest:
   """
   The main status manager class.  Contains a list of handlers, which are classes
   that actually perform the necessary checks.  Also capable of reading and writing
-  a metadata file, stored in xml format, which can store information between sessions.
+  a metadata file, stored in xml or sqlite format, which can store information
+  between sessions.
   """
-  def __init__(self, mdfile):
-    "mdfile is the location to use as the metadata file for storage between executions"
+  def __init__(self, mdfile, backend=store.DEFAULT_BACKEND, scan=None):
+    """mdfile is the location to use as the metadata file for storage between
+    executions; backend is the format it is written in, 'xml' or 'sqlite';
+    scan is an optional StatScan that handlers use to find and stat files"""
     self.mdfile = mdfile # the location of the file to store information
     self.mddir = self.mdfile.dirname # used for calculating relative paths
     self.handlers = [] # a list of registered handlers
     self.debug = False # enable to see very verbose printout of diffs
+    self.backend = store.BACKENDS[backend]
+    self.scan = scan
     self.metadata = None
 
     # create mdfile if it does not exist
@@ -98,45 +115,63 @@ class DiffTest:
     "Add a handler that implements the status interface (described above)"
     handler.debug  = self.debug
     handler.dprint = self.dprint
+    handler.scan   = self.scan
     self.handlers.append(handler)
 
   def clean_metadata(self):
     for handler in self.handlers:
       handler.clear()
+    self._close_metadata()
     self.mdfile.rm(force=True)
 
   def read_metadata(self, handlers=[]):
     """
-    Read the file stored at self.mdfile and pass it to each of the
-    handler's mdread() functions.
+    Open the file stored at self.mdfile and pass it to each of the
+    handler's mdload() or mdread() functions.
     """
     if self.metadata is None:
       try:
-        self.metadata = rxml.config.parse(self.mdfile).getroot()
-      except (ValueError, IOError, SAXParseException, rxml.errors.XmlSyntaxError), e:
+        self.metadata = store.open_store(self.mdfile)
+        self.metadata.load()
+      except (ValueError, IOError, SAXParseException, sqlite3.Error,
+              rxml.errors.XmlSyntaxError), e:
+        self._close_metadata()
         self.metadata = DummyMetadata(self.mdfile)
 
-    if isinstance(self.metadata, rxml.config.ConfigElement):
+    if not isinstance(self.metadata, DummyMetadata):
       handlers = handlers or self.handlers
       if not hasattr(handlers, '__iter__'):
         handlers = [handlers]
 
-      for handler in handlers:
-        handler.mdread(self.metadata, self.mddir)
+      try:
+        for handler in handlers:
+          self.metadata.read(handler, self.mddir)
+      finally:
+        self.metadata.close() # reopened as needed; don't hold a descriptor
 
   def write_metadata(self):
     """
-    Create an XmlTreeElement from self.mdfile, if it exists, or make a
-    new one and pass it to each of the handler's mdwrite() functions.
-    Due to the way rxml.config.XmlTreeElements work, mdwrite() doesn't
-    need to return any values; xmltree appends are destructive.
+    Pass a store for self.mdfile to each of the handler's mdsave() or
+    mdwrite() functions and save the result in the configured format,
+    converting the file from the other format if necessary.
     """
-    root = rxml.config.Element('metadata')
-    for handler in self.handlers:
-      handler.mdwrite(root, self.mddir)
-    self.mdfile.dirname.mkdirs()
-    root.write(self.mdfile)
+    if isinstance(self.metadata, self.backend):
+      mdstore = self.metadata
+    else:
+      self._close_metadata()
+      mdstore = self.backend(self.mdfile)
+    try:
+      mdstore.write(self.handlers, self.mddir)
+    finally:
+      mdstore.close()
     self.mdfile.chmod(0644)
+    self.metadata = None # reread on next access
+
+  def _close_metadata(self):
+    if self.metadata is not None and \
+       not isinstance(self.metadata, DummyMetadata):
+      self.metadata.close()
+    self.metadata = None
 
   def changed(self, debug=None):
     "Returns true if any handler returns a diff with length greater than 0"
@@ -19,6 +19,8 @@ from deploy.util import pps
 from deploy.util import rxml
 from deploy.util import statfmt
 
+from deploy.util.pps.util import checksum_many
+
 NEW = '-'
 NONE = '<not found>'
 
@@ -43,32 +45,26 @@ def diff(oldstats, newstats):
   """
   diffdict = FilesDiffDict()
 
-  # keep a list of already-processed elements so we don't add them in twice
-  processed = []
-
   # first check for presence/absence of files in each list
   for x in newstats:
     if x not in oldstats:
       diffdict[x] = (None, newstats[x])
-      processed.append(x)
 
-  for x in oldstats:
+  # then sizes, mtimes and modes of files in both
+  for x, old in oldstats.iteritems():
     if x not in newstats:
-      diffdict[x] = (oldstats[x], None)
-      processed.append(x)
-
-  # now check sizes, mtimes and modes
-  for file in oldstats:
-    if file in processed: continue
-    if oldstats[file] != newstats[file]:
-      diffdict[file] = (oldstats[file], newstats[file])
+      diffdict[x] = (old, None)
+    elif old != newstats[x]:
+      diffdict[x] = (old, newstats[x])
   return diffdict
 
 class DiffTuple:
 
   attrib = [('size', int), ('mtime', int), ('mode', int)]
 
-  def __init__(self, path=None, abspath=None):
+  def __init__(self, path=None, abspath=None, scan=None):
+    """scan, if given, is a StatScan used to look up the stat results for
+    abspath"""
     self.path = pps.path(path)
     if abspath: self.abspath = pps.path(abspath)
     else: self.abspath = self.path
@@ -79,28 +75,30 @@ class DiffTuple:
 
     if self.abspath:
       try:
-        st = self.abspath.stat()
-        self.size  = st.st_size
-        self.mtime = st.st_mtime
-        self.mode  = st.st_mode
+        if scan: st = scan.stat(self.abspath)
+        else:    st = self.abspath.stat()
+        self.size  = int(st.st_size)
+        self.mtime = int(st.st_mtime)
+        self.mode  = int(st.st_mode)
       except pps.Path.error.PathError:
         pass
     else:
       pass
 
+  @classmethod
+  def create(cls, paths, scan=None):
+    "Return a dict of tuples for each of paths, by path"
+    return dict([ (path, cls(path, scan=scan)) for path in paths ])
+
   # pretend to be a tuple
   def __repr__(self): return repr(tuple(self.values()))
   def __str__(self):  return str(tuple(self.values()))
 
   def __ne__(self, other): return not self.__eq__(other)
   def __eq__(self, other):
-    if self.keys() != other.keys(): return False
-
-    for k,v in self.items():
-      if getattr(self, k) != getattr(other, k):
-        return False
-
-    return True
+    # compare attribute names, then values, as flat tuples
+    return (self.attrib == other.attrib and
+            self.totuple() == other.totuple())
 
   def keys(self):
     return [ k for k,v in self.items() ]
@@ -127,6 +125,15 @@ class DiffTuple:
         setattr(self, key, None)
     return self
 
+  def totuple(self):
+    return tuple([ getattr(self, k, None) for k,_ in self.attrib ])
+
+  def fromtuple(self, values, path=None):
+    self.path = pps.path(path)
+    for (key,_), value in zip(self.attrib, values):
+      setattr(self, key, value)
+    return self
+
   def diff(self, other):
     D = []
 
@@ -157,15 +164,16 @@ class ChecksumDiffTuple(DiffTuple):
 
   attrib = DiffTuple.attrib + [('csum', str)]
 
-  def __init__(self, path=None, abspath=None):
-    DiffTuple.__init__(self, path, abspath)
+  def __init__(self, path=None, abspath=None, scan=None, csum=None):
+    """csum, if given, is the already computed checksum of a local abspath"""
+    DiffTuple.__init__(self, path, abspath, scan)
 
     self.csum = None
 
     if self.abspath:
       try:
         if isinstance(self.abspath, pps.Path.local._LocalPath):
-          self.csum = self.abspath.checksum()
+          self.csum = csum or self.abspath.checksum()
           self.size = None
           self.mtime = None
       except pps.Path.error.PathError:
@@ -173,6 +181,18 @@ class ChecksumDiffTuple(DiffTuple):
     else:
       pass
 
+  @classmethod
+  def create(cls, paths, scan=None):
+    "Like DiffTuple.create(), checksumming local paths in parallel"
+    local = [ path for path in paths
+              if isinstance(pps.path(path), pps.Path.local._LocalPath) ]
+    try:
+      csums = checksum_many(local)
+    except pps.Path.error.PathError:
+      csums = {} # fall back to checksumming (and failing) one at a time
+    return dict([ (path, cls(path, scan=scan, csum=csums.get(path)))
+                  for path in paths ])
+
 
 class FilesDiffDict(dict):
   def __repr__(self): return dict.__repr__(self)
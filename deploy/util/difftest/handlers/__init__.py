@@ -16,9 +16,18 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
 
+from deploy.util import pps
+
 class DiffHandler(object):
   def __init__(self):
     self.diffdict = {}
+    self.scan = None # StatScan, set by DiffTest.addHandler()
+
+  def findfiles(self, path):
+    "Return the non-directory files at and beneath path"
+    if self.scan:
+      return self.scan.findpaths(path, type=pps.constants.TYPE_NOT_DIR)
+    return pps.path(path).findpaths(type=pps.constants.TYPE_NOT_DIR)
 
   def difference(self, id=None):
     """Return whether self.diffdict exists (whether there was a difference
@@ -27,6 +27,7 @@ from deploy.util.rxml.tree import XML_NS
 
 from deploy.util.difftest          import expand, NoneEntry, NewEntry
 from deploy.util.difftest.handlers import DiffHandler
+from deploy.util.difftest.store    import fromstring, tostring
 
 class ConfigHandler(DiffHandler):
   def __init__(self, data, config):
@@ -60,6 +61,24 @@ class ConfigHandler(DiffHandler):
           elements = rxml.config.Element('elements', parent=value)
           elements.append(val)
 
+  def mdload(self, store, *args, **kwargs):
+    for path, values in store.items(self.name):
+      elements = [ fromstring(v) for t,v in values if t == 'elements' ]
+      self.cfg[path] = elements or [ v for t,v in values if t == 'text' ] or \
+                       NoneEntry(path)
+
+  def mdsave(self, store, *args, **kwargs):
+    items = []
+    for path in set(self.cdata):
+      values = []
+      for val in self._get_values(path, []):
+        if isinstance(val, str): # a string
+          values.append(('text', val))
+        else: # elements
+          values.append(('elements', tostring(val)))
+      items.append((path, values))
+    store.replace(self.name, items)
+
   def diff(self):
     self.diffdict = ConfigDiffDict()
     for path in set(self.cdata):
@@ -48,18 +48,30 @@ class InputHandler(DiffHandler):
 
   def mdwrite(self, root, *args, **kwargs):
     parent = rxml.config.Element('input', parent=root)
+    for ifile, tup in self._get_tuples():
+      parent.append(tup.toxml())
+
+  def mdload(self, store, *args, **kwargs):
+    for path, values in store.items(self.name):
+      self.oldinput[pps.path(path)] = self.tupcls().fromtuple(values, path)
+
+  def mdsave(self, store, *args, **kwargs):
+    store.replace(self.name, ( (ifile, tup.totuple())
+                               for ifile, tup in self._get_tuples() ))
+
+  def _get_tuples(self):
     for datum in set(self.idata):
-      for ifile in pps.path(datum).findpaths(type=pps.constants.TYPE_NOT_DIR):
-        parent.append((self.newinput.get(ifile) or
-                       self.tupcls(ifile)).toxml())
+      for ifile in self.findfiles(datum):
+        yield ifile, (self.newinput.get(ifile) or
+                      self.tupcls(ifile, scan=self.scan))
 
   def diff(self):
-    self.newinput = {}
+    ifiles = set()
     for datum in set(self.idata):
-      ifiles = pps.path(datum).findpaths(type=pps.constants.TYPE_NOT_DIR)
-      if not ifiles: raise ValueError('No file(s) found at %s' % datum)
-      for ifile in ifiles:
-        self.newinput[ifile] = self.tupcls(ifile)
+      found = self.findfiles(datum)
+      if not found: raise ValueError('No file(s) found at %s' % datum)
+      ifiles.update(found)
+    self.newinput = self.tupcls.create(ifiles, scan=self.scan)
     self.diffdict = diff(self.oldinput, self.newinput)
     if self.diffdict: self.dprint('input: %s' % self.diffdict)
     return self.diffdict
@@ -51,23 +51,38 @@ class OutputHandler(DiffHandler):
   def mdwrite(self, root, mddir, *args, **kwargs):
     parent = rxml.config.uElement('output', parent=root)
     # write to metadata file
+    for relpath, abspath in self._get_paths(mddir):
+      parent.append(self.tupcls(relpath, abspath, scan=self.scan).toxml())
+
+  def mdload(self, store, mddir, *args, **kwargs):
+    for relpath, values in store.items(self.name):
+      abspath = mddir / pps.path(relpath)
+      self.oldoutput[abspath] = self.tupcls().fromtuple(values, abspath)
+
+  def mdsave(self, store, mddir, *args, **kwargs):
+    store.replace(self.name,
+      ( (relpath, self.tupcls(relpath, abspath, scan=self.scan).totuple())
+        for relpath, abspath in self._get_paths(mddir) ))
+
+  def _get_paths(self, mddir):
+    "Return (relpath, abspath) tuples for each output file"
     paths = set()
     for file in [ pps.path(x) for x in set(self.odata) ]:
-      if not file.exists():
+      files = self.findfiles(file)
+      if not files and not file.exists():
         raise pps.Path.PathError(errno.ENOENT, file)
-      for f in file.findpaths(type=pps.constants.TYPE_NOT_DIR):
-        paths.add(f)
+      paths.update(files)
     for file in paths:
       abspath = file.normpath()
       if abspath.startswith(mddir):
         relpath = abspath[len(mddir + '/'):]
       else: relpath = abspath 
-      parent.append(self.tupcls(relpath, abspath).toxml())
+      yield relpath, abspath
 
   def diff(self):
     newitems = {}
     for item in self.oldoutput.keys():
-      newitems[item] = DiffTuple(item)
+      newitems[item] = DiffTuple(item, scan=self.scan)
 
     self.diffdict = diff(self.oldoutput, newitems)
     if self.diffdict: self.dprint('output: %s' % self.diffdict)
@@ -19,12 +19,14 @@ __author__  = 'Daniel Musgrave <dmusgrave@deployproject.org>'
 __version__ = '1.0'
 __date__    = 'June 12th, 2007'
 
+import hashlib
 import textwrap
 
 from deploy.util import rxml
 
 from deploy.util.difftest          import expand, NoneEntry, NewEntry
 from deploy.util.difftest.handlers import DiffHandler
+from deploy.util.difftest.store    import fromstring, tostring
 
 NEW = '-'
 NONE = '<not found>'
@@ -36,18 +38,32 @@ class VariablesHandler(DiffHandler):
     self.vdata = data
     self.obj = obj
     self.vars = {}
+    self.digests = {} # {var: keys}, for vars tracked by digest
+
 
     DiffHandler.__init__(self)
 
     expand(self.vdata)
 
+  def use_digest(self, var, keys=False):
+    """
+    Track var by a digest of its value rather than by the value itself, so
+    that large values need not be written to and compared against metadata
+    in full.  If keys is True, the sorted keys (or members) of the value are
+    also kept, so that differences() can report which were added and removed.
+    """
+    self.digests[var] = keys
+
   def clear(self):
     self.vars.clear()
 
   def mdread(self, metadata, *args, **kwargs):
     for node in metadata.xpath('/metadata/variables/value', []):
       item = node.getxpath('@variable')
-      if len(node.getchildren()) == 0:
+      if node.getxpath('@digest', None):
+        self.vars[item] = DigestEntry(node.getxpath('@digest'),
+                                      node.xpath('keys/key/text()', None))
+      elif len(node.getchildren()) == 0:
         self.vars[item] = NoneEntry(item)
       else:
         self.vars[item] = rxml.serialize.unserialize(node[0])
@@ -57,7 +73,28 @@ class VariablesHandler(DiffHandler):
     for var in set(self.vdata):
       parent = rxml.config.Element('value', parent=vars, attrib={'variable': var})
       val = eval('self.obj.%s' % var)
-      parent.append(rxml.serialize.serialize(val))
+      if var in self.digests:
+        self._get_digest(var, val).toxml(parent)
+      else:
+        parent.append(rxml.serialize.serialize(val))
+
+  def mdload(self, store, *args, **kwargs):
+    for item, value in store.items(self.name):
+      if isinstance(value, tuple): # (digest, keys)
+        self.vars[item] = DigestEntry(*value)
+      else:
+        self.vars[item] = rxml.serialize.unserialize(fromstring(value))
+
+  def mdsave(self, store, *args, **kwargs):
+    items = []
+    for var in set(self.vdata):
+      val = eval('self.obj.%s' % var)
+      if var in self.digests:
+        entry = self._get_digest(var, val)
+        items.append((var, (entry.digest, entry.keys)))
+      else:
+        items.append((var, tostring(rxml.serialize.serialize(val))))
+    store.replace(self.name, items)
 
   def diff(self):
     self.diffdict = VariablesDiffDict()
@@ -67,7 +104,11 @@ class VariablesHandler(DiffHandler):
       except AttributeError:
         val = NoneEntry(var)
       if self.vars.has_key(var):
-        if self.vars[var] != val:
+        if var in self.digests and not isinstance(val, NoneEntry):
+          changed = self._get_digest(var, val) != self.vars[var]
+        else:
+          changed = self.vars[var] != val
+        if changed:
           self.diffdict[var] = (self.vars[var], val)
       else:
         self.diffdict[var] = (NewEntry(), val)
@@ -80,6 +121,104 @@ class VariablesHandler(DiffHandler):
     if self.diffdict: self.dprint('variables: %s' % self.diffdict)
     return self.diffdict
 
+  def _get_digest(self, var, val):
+    return DigestEntry(digest(val), self.digests[var] and keylist(val) or None)
+
+
+class DigestEntry(object):
+  """
+  Stands in for the metadata value of a variable tracked by digest.  Compares
+  equal to values with the same digest.  If the sorted keys of the value were
+  kept, iterating over a DigestEntry yields them, so that callers can compute
+  which keys were added or removed as they would with the value itself.
+  """
+  def __init__(self, digest, keys=None):
+    self.digest = digest
+    self.keys = keys
+    self._keyset = None
+
+  def __eq__(self, other):
+    if isinstance(other, DigestEntry):
+      return self.digest == other.digest
+    if isinstance(other, (NoneEntry, NewEntry)):
+      return False
+    try:
+      return self.digest == digest(other)
+    except TypeError:
+      return False
+  def __ne__(self, other):
+    return not self == other
+
+  def __iter__(self):
+    return iter(self.keys or [])
+  def __contains__(self, key):
+    if self._keyset is None: self._keyset = set(self.keys or [])
+    return key in self._keyset
+  def __nonzero__(self):
+    return True
+
+  def __str__(self):
+    return self.__repr__()
+  def __repr__(self):
+    if self.keys is None:
+      return "DigestEntry(%s)" % self.digest
+    return "DigestEntry(%s, %d keys)" % (self.digest, len(self.keys))
+
+  def differences(self, value):
+    "Return the keys (added, removed) in value relative to this entry"
+    current = set([ _keystr(k) for k in value ])
+    return (sorted(current.difference(self)),
+            sorted(set(self).difference(current)))
+
+  def toxml(self, parent):
+    parent.set('digest', self.digest)
+    if self.keys is not None:
+      keys = rxml.config.Element('keys', parent=parent)
+      for key in self.keys:
+        rxml.config.Element('key', parent=keys, text=key)
+
+
+def digest(value):
+  """
+  Return a digest of value that is stable across runs; sets and dicts are
+  encoded in sorted order.  Supports the same types as rxml.serialize.
+  """
+  return hashlib.sha1(_encode(value)).hexdigest()
+
+def keylist(value):
+  "Return the sorted keys (or members) of value, as strings"
+  if isinstance(value, (dict, set, frozenset, list, tuple)):
+    return sorted(set([ _keystr(k) for k in value ]))
+  return None
+
+def _keystr(key):
+  if isinstance(key, basestring): return key
+  return str(key)
+
+def _encode(obj):
+  # length-prefixed, so that no encoding is a prefix of another
+  if obj is None:
+    return 'n'
+  if isinstance(obj, bool):
+    return 'b%d' % obj
+  if isinstance(obj, (int, long)):
+    return 'i%d;' % obj
+  if isinstance(obj, unicode):
+    obj = obj.encode('utf8')
+    return 'u%d:%s' % (len(obj), obj)
+  if isinstance(obj, str):
+    return 's%d:%s' % (len(obj), obj)
+  if isinstance(obj, tuple):
+    return 't%d:%s' % (len(obj), ''.join([ _encode(x) for x in obj ]))
+  if isinstance(obj, list):
+    return 'l%d:%s' % (len(obj), ''.join([ _encode(x) for x in obj ]))
+  if isinstance(obj, (set, frozenset)):
+    return 'S%d:%s' % (len(obj), ''.join(sorted([ _encode(x) for x in obj ])))
+  if isinstance(obj, dict):
+    return 'd%d:%s' % (len(obj), ''.join(sorted([ _encode(k) + _encode(v)
+                                                  for k,v in obj.items() ])))
+  raise TypeError("Unsupported digest type %s" % type(obj))
+
 
 class VariablesDiffDict(dict):
   width = 35 # max width of var returns (should be less than half term width)
@@ -0,0 +1,191 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+scan.py
+
+Shared stat snapshot for local file trees
+
+A StatScan walks each local root it is asked about once, calling lstat() on
+every entry (and stat() on symlinks), and keeps the results.  Later queries
+for paths beneath that root, whether from difftest handlers or from an event's
+IOObject, are answered from the snapshot instead of walking and stat()ing the
+tree again.  Remote paths are passed through to the path object.
+
+The snapshot is only valid until something writes to the trees it covers;
+call invalidate() after writing.  Events do this before and after run(),
+after clean() and on error.  Files that run() itself may remove, such as the
+outputs checked in IOObject.process_files(), are stat()ed directly instead.
+"""
+
+import errno
+import os
+import stat
+import threading
+
+from deploy.util import pps
+
+from deploy.util.pps.constants import *
+from deploy.util.pps.PathSet   import PathSet
+
+class StatScan(object):
+  "Per-build snapshot of the files beneath local roots"
+  def __init__(self):
+    self.trees = {} # root: [(path, depth, lstat mode, stat result), ...]
+    self.index = {} # path: stat result, for every entry in self.trees
+    self.stats = {} # path: stat result, or None, for paths outside of trees
+    self.lock = threading.Lock()
+
+  def findpaths(self, root, type=0111, mindepth=None):
+    "Like root.findpaths(type=type, mindepth=mindepth), from the snapshot"
+    root = pps.path(root)
+    if not _is_local(root):
+      return root.findpaths(type=type, mindepth=mindepth)
+
+    found = PathSet([ path for path, depth, lmode, st in self._get_tree(root)
+                      if depth >= (mindepth or 0) and
+                         _matches(type, lmode, st) ])
+    found.sort()
+    return found
+
+  def stat(self, path):
+    "Like path.stat(), from the snapshot"
+    path = pps.path(path)
+    if not _is_local(path):
+      return path.stat()
+
+    key = os.path.normpath(path)
+    self.lock.acquire()
+    try:
+      if key in self.index:
+        cached, st = True, self.index[key]
+      else:
+        cached, st = key in self.stats, self.stats.get(key)
+    finally:
+      self.lock.release()
+
+    if not cached:
+      try:
+        st = os.stat(key)
+      except OSError:
+        st = None
+      self.lock.acquire()
+      try:
+        self.stats[key] = st
+      finally:
+        self.lock.release()
+
+    if st is None:
+      raise pps.Path.error.PathError(errno.ENOENT, path)
+    return st
+
+  def exists(self, path):
+    try:
+      self.stat(path)
+      return True
+    except pps.Path.error.PathError:
+      return False
+
+  def invalidate(self, path=None):
+    """
+    Discard snapshot entries for path and everything beneath it, including
+    any root that contains it; if path is None, discard everything
+    """
+    self.lock.acquire()
+    try:
+      if path is None:
+        self.trees.clear()
+        self.index.clear()
+        self.stats.clear()
+        return
+
+      key = os.path.normpath(path)
+      for root in self.trees.keys():
+        if _overlaps(root, key) or _overlaps(key, root):
+          for entry in self.trees.pop(root):
+            self.index.pop(entry[0], None)
+      for p in self.stats.keys():
+        if _overlaps(key, p):
+          del self.stats[p]
+    finally:
+      self.lock.release()
+
+  def _get_tree(self, root):
+    key = os.path.normpath(root)
+    self.lock.acquire()
+    try:
+      entries = self.trees.get(key)
+    finally:
+      self.lock.release()
+    if entries is not None:
+      return entries
+
+    entries = []
+    self._scan(pps.path(key), entries)
+    self.lock.acquire()
+    try:
+      self.trees[key] = entries
+      for path, depth, lmode, st in entries:
+        self.index[path] = st
+    finally:
+      self.lock.release()
+    return entries
+
+  def _scan(self, root, entries):
+    # walks the same entries as Path.findpaths() with follow=False
+    try:
+      lst = os.lstat(root)
+    except OSError:
+      return
+    st = _follow(root, lst)
+    if st is None: return # broken link; root.exists() is False
+    entries.append((root, 0, lst.st_mode, st))
+    if stat.S_ISDIR(st.st_mode):
+      self._walk(root, 1, entries)
+
+  def _walk(self, dir, depth, entries):
+    for path in dir.listdir(all=True, sort=None):
+      try:
+        lst = os.lstat(path)
+      except OSError:
+        continue # removed since listdir()
+      entries.append((path, depth, lst.st_mode, _follow(path, lst)))
+      if stat.S_ISDIR(lst.st_mode):
+        self._walk(path, depth+1, entries)
+
+
+def _is_local(path):
+  return isinstance(path, pps.Path.local._LocalPath)
+
+def _follow(path, lst):
+  "Return the stat result for path given its lstat result; None if broken"
+  if not stat.S_ISLNK(lst.st_mode):
+    return lst
+  try:
+    return os.stat(path)
+  except OSError:
+    return None
+
+def _matches(type, lmode, st):
+  "Equivalent of path_walk._matches() for the type test"
+  return ( (type & TYPE_DIR)  and st is not None and stat.S_ISDIR(st.st_mode) or
+           (type & TYPE_FILE) and st is not None and stat.S_ISREG(st.st_mode) or
+           (type & TYPE_LINK) and stat.S_ISLNK(lmode) )
+
+def _overlaps(parent, path):
+  "True if path is parent or beneath it"
+  return path == parent or path.startswith(parent.rstrip('/') + '/')
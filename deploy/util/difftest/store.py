@@ -0,0 +1,217 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+store.py
+
+Metadata file formats for DiffTest
+
+XmlStore keeps all handler metadata in a single XML document, which is
+rewritten in full each time it is saved.
+
+SqliteStore keeps metadata as records in an sqlite database, grouped into
+sections by handler name.  Handlers that implement mdload()/mdsave() read
+and write their records directly, so that reading a large input list does not
+require parsing and walking an XML tree; records are streamed from the
+database as they are needed.  For handlers that only implement
+mdread()/mdwrite(), the XML they produce is kept in the 'xml' section, one
+record per handler.
+
+The format of an existing file is detected when it is opened, so metadata
+written in either format can always be read.  Writing converts the file to
+the format requested.
+"""
+
+import cPickle
+import sqlite3
+
+from lxml import etree
+
+from deploy.util import rxml
+
+SQLITE_MAGIC = 'SQLite format 3\x00'
+
+XML_SECTION = 'xml' # section for handlers without mdload()/mdsave()
+
+def open_store(file):
+  "Return a store for the metadata in file, whichever format it is in"
+  if is_sqlite(file):
+    return SqliteStore(file)
+  else:
+    return XmlStore(file)
+
+def is_sqlite(file):
+  try:
+    fo = open(file, 'rb')
+  except IOError:
+    return False
+  try:
+    return fo.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+  finally:
+    fo.close()
+
+def tostring(elem):
+  "Serialize elem, without its tail, to a UTF-8 encoded string"
+  return etree.tostring(elem, encoding='UTF-8', xml_declaration=False,
+                        with_tail=False)
+
+def fromstring(s):
+  return rxml.config.fromstring(s)
+
+
+class XmlStore:
+  "Metadata stored in a single XML document"
+  format = 'xml'
+
+  def __init__(self, file):
+    self.file = file
+    self.root = None
+
+  def load(self):
+    self.root = rxml.config.parse(self.file).getroot()
+
+  def read(self, handler, mddir):
+    handler.mdread(self.root, mddir)
+
+  def write(self, handlers, mddir):
+    root = rxml.config.Element('metadata')
+    for handler in handlers:
+      handler.mdwrite(root, mddir)
+    self.file.dirname.mkdirs()
+    root.write(self.file)
+    self.root = root
+
+  def close(self):
+    pass
+
+
+class SqliteStore:
+  "Metadata stored as pickled records in an sqlite database"
+  format = 'sqlite'
+
+  def __init__(self, file):
+    self.file = file
+    self.conn = None
+
+  def _connect(self):
+    if self.conn is None:
+      self.conn = sqlite3.connect(str(self.file))
+      self.conn.text_factory = str
+      self.conn.execute('CREATE TABLE IF NOT EXISTS records '
+                        '(section TEXT, key TEXT, value BLOB, '
+                        'PRIMARY KEY (section, key))')
+    return self.conn
+
+  def load(self):
+    # raises sqlite3.DatabaseError if the file is not a usable database
+    self._connect().execute('SELECT COUNT(*) FROM records').fetchone()
+
+  def read(self, handler, mddir):
+    if hasattr(handler, 'mdload'):
+      handler.mdload(self, mddir)
+    else:
+      xml = self.get(XML_SECTION, handler.name)
+      if xml is not None:
+        root = fromstring(xml)
+      else:
+        root = rxml.config.Element('metadata')
+      handler.mdread(root, mddir)
+
+  def write(self, handlers, mddir):
+    if self.file.exists() and not self._usable():
+      self.close()
+      self.file.rm(force=True) # XML or damaged metadata; replace it
+    self.file.dirname.mkdirs()
+
+    conn = self._connect()
+    try:
+      sections = [XML_SECTION]
+      xml = []
+      for handler in handlers:
+        if hasattr(handler, 'mdsave'):
+          handler.mdsave(self, mddir)
+          sections.append(handler.name)
+        else:
+          root = rxml.config.Element('metadata')
+          handler.mdwrite(root, mddir)
+          xml.append((handler.name, tostring(root)))
+      self.replace(XML_SECTION, xml)
+
+      # drop records for handlers that are no longer registered
+      conn.execute('DELETE FROM records WHERE section NOT IN (%s)'
+                   % ','.join(['?'] * len(sections)), sections)
+      conn.commit()
+    except:
+      conn.rollback()
+      raise
+
+  def _usable(self):
+    "Return True if file is an sqlite database that can be read"
+    if not is_sqlite(self.file):
+      return False
+    try:
+      self.load()
+    except sqlite3.DatabaseError:
+      return False # damaged
+    return True
+
+  def close(self):
+    if self.conn is not None:
+      self.conn.close()
+      self.conn = None
+
+  # record access, for use by handler mdload() and mdsave() methods
+  def get(self, section, key, fallback=None):
+    row = self._connect().execute(
+      'SELECT value FROM records WHERE section=? AND key=?',
+      (section, key)).fetchone()
+    if row is None: return fallback
+    return cPickle.loads(str(row[0]))
+
+  def items(self, section):
+    "Iterate over the (key, value) records in section"
+    cursor = self._connect().execute(
+      'SELECT key, value FROM records WHERE section=?', (section,))
+    for key, value in cursor:
+      yield key, cPickle.loads(str(value))
+
+  def update(self, section, items):
+    "Add or replace the (key, value) records in items"
+    self._connect().executemany(
+      'INSERT OR REPLACE INTO records VALUES (?, ?, ?)',
+      ( (section, str(key),
+         sqlite3.Binary(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)))
+        for key, value in items ))
+
+  def delete(self, section, keys=None):
+    "Delete the given keys from section, or the whole section if keys is None"
+    conn = self._connect()
+    if keys is None:
+      conn.execute('DELETE FROM records WHERE section=?', (section,))
+    else:
+      conn.executemany('DELETE FROM records WHERE section=? AND key=?',
+                       ( (section, str(key)) for key in keys ))
+
+  def replace(self, section, items):
+    "Replace all records in section with items"
+    self.delete(section)
+    self.update(section, items)
+
+
+BACKENDS = {'xml': XmlStore, 'sqlite': SqliteStore}
+
+DEFAULT_BACKEND = 'sqlite'
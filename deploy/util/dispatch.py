@@ -15,8 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
+import cPickle
 import imp
+import os
 import sys
+import threading
+import time
+import Queue
 
 from deploy.util import graph
 from deploy.util import pps
@@ -47,7 +52,12 @@ class Event(tree.NodeMixin, graph.DirectedNodeMixin, resolve.Item):
     self.enabled = enabled
     self.properties = properties
 
-    tree.NodeMixin.__init__(self, parent=parent)
+    # map of eventid to event for every event in this event's tree; only
+    # maintained on the root event, see get()
+    self._index = {id: self}
+
+    # attach to parent once id is set, below, so the event can be indexed
+    tree.NodeMixin.__init__(self, parent=None)
     graph.DirectedNodeMixin.__init__(self)
 
     resolve.Item.__init__(self, id,
@@ -60,6 +70,9 @@ class Event(tree.NodeMixin, graph.DirectedNodeMixin, resolve.Item):
                           conditionally_comes_after = conditionally_comes_after,
                           conditional = conditional)
 
+    if parent is not None:
+      parent.append_child(self)
+
   def __iter__(self): return tree.depthfirst(self)
   def __str__(self):  return self.id
   def __repr__(self): return '<dispatch.Event instance id=\'%s\'>' % self.id
@@ -80,6 +93,28 @@ class Event(tree.NodeMixin, graph.DirectedNodeMixin, resolve.Item):
 
   depth = property(_getdepth)
 
+  # tree modification; keeps the root's index up to date
+  def append_child(self, child):
+    tree.NodeMixin.append_child(self, child)
+    self._add_to_index(child)
+  def prepend_child(self, child):
+    tree.NodeMixin.prepend_child(self, child)
+    self._add_to_index(child)
+  def append_sibling(self, sibling):
+    tree.NodeMixin.append_sibling(self, sibling)
+    self._add_to_index(sibling)
+  def prepend_sibling(self, sibling):
+    tree.NodeMixin.prepend_sibling(self, sibling)
+    self._add_to_index(sibling)
+
+  def _add_to_index(self, event):
+    "Add event and its descendants to the index of this event's tree"
+    index = self._getroot()._index
+    index[event.id] = event
+    if event.firstchild is not None:
+      for e in tree.depthfirst(event.firstchild):
+        index[e.id] = e
+
   # property testing (via bitmasking)
   def test(self, property): return self.properties & property
 
@@ -98,19 +133,21 @@ class Event(tree.NodeMixin, graph.DirectedNodeMixin, resolve.Item):
 
   # event retrieval
   def get(self, eventid, fallback=NoneType()):
-    for e in self:
-      if e.id == eventid: return e
-    if isinstance(fallback, NoneType):
-      raise UnregisteredEventError(eventid)
-    return fallback
+    "Return the event in this event's tree with the given id"
+    root = self._getroot()
+    e = root._index.get(eventid)
+    if e is not None and e._getroot() is not root:
+      del root._index[eventid] # no longer part of this tree
+      e = None
+    if e is None:
+      if isinstance(fallback, NoneType):
+        raise UnregisteredEventError(eventid)
+      return fallback
+    return e
 
   # printing
   def pprint(self):
-    depth = self.depth
-    if depth < 1:
-      print self.__str__()
-    else:
-      print '|  ' * (depth-1) + '|- ' + self.__str__()
+    pprint_event(self.depth, self.__str__())
 
   # execution
   def execute(self): print 'running', self.id
@@ -156,8 +193,11 @@ class Dispatch:
     self._process('pprint', until=None)
 
   # execution
-  def execute(self, until=None):
-    self._process('execute', until=until)
+  def execute(self, until=None, jobs=1):
+    if jobs > 1 and until is None and not self.reversed:
+      self._process_parallel('execute', jobs)
+    else:
+      self._process('execute', until=until)
 
   def _process(self, fn, until, *args, **kwargs):
     "Call event.<fn>(*args, **kwargs) on each events until <until> is reached"
@@ -174,13 +214,121 @@ class Dispatch:
       except StopIteration:
         break
 
+  def _process_parallel(self, fn, jobs, *args, **kwargs):
+    "Call event.<fn>(*args, **kwargs) on all events using a pool of <jobs> "
+    "worker threads.  An event is started as soon as its parent and every "
+    "event it is ordered after by the resolver have completed."
+    waiting = self._compute_waits()
+    pending = list(self._order) # keep serial order as the tiebreaker
+    done = set()
+    running = 0
+    error = None
+    failed = None # the event that raised error
+
+    tasks   = Queue.Queue()
+    results = Queue.Queue()
+
+    def worker():
+      while True:
+        event = tasks.get()
+        if event is None: break
+        try:
+          getattr(event, fn)(*args, **kwargs)
+          results.put((event, None))
+        except BaseException:
+          results.put((event, sys.exc_info()))
+
+    workers = []
+    for i in range(jobs):
+      t = threading.Thread(target=worker, name='dispatch-%d' % i)
+      t.daemon = True
+      t.start()
+      workers.append(t)
+
+    try:
+      while pending or running:
+        # schedule every event whose dependencies are satisfied; disabled
+        # events complete immediately, which may free up others
+        scheduled = True
+        while scheduled and error is None:
+          scheduled = False
+          for event in pending[:]:
+            if running >= jobs and event.enabled: continue
+            if not waiting[event].issubset(done): continue
+            pending.remove(event)
+            if event.enabled:
+              self.currevent = event
+              tasks.put(event)
+              running += 1
+            else:
+              done.add(event)
+              scheduled = True
+
+        if not running:
+          break
+
+        # wait for an event to finish; poll so KeyboardInterrupt gets through
+        while True:
+          try:
+            event, exc_info = results.get(True, 0.5)
+            break
+          except Queue.Empty:
+            continue
+        running -= 1
+        done.add(event)
+        if exc_info is not None and error is None:
+          error = exc_info
+          failed = event
+    finally:
+      for t in workers:
+        tasks.put(None)
+
+    for t in workers:
+      t.join()
+
+    if error is not None:
+      # error handlers report the error against currevent
+      self.currevent = failed
+      raise error[0], error[1], error[2]
+
+    if pending:
+      raise DispatchDeadlockError([ e.id for e in pending ])
+
+  def _compute_waits(self):
+    "Return a dict of event to the set of events that must complete first"
+    # topological_sort() consumes the incoming edges of each node, but
+    # outgoing edges are left intact
+    predecessors = {}
+    for event in self._order:
+      for edge in event.outgoing:
+        predecessors.setdefault(edge.end, set()).add(edge.start)
+
+    def subtree(event):
+      r = [event]
+      for child in event.get_children():
+        r.extend(subtree(child))
+      return r
+
+    waiting = {}
+    for event in self._order:
+      waits = set()
+      if event.parent is not None:
+        waits.add(event.parent)
+      node = event
+      while node is not None:
+        for pred in predecessors.get(node, []):
+          waits.update(subtree(pred))
+        node = node.parent
+      waiting[event] = waits
+    return waiting
+
   def _remove_conditional(self, resolved):
     # removes events marked as conditional if their provides are not 
     # required by any other event
     for top in resolved:
-      all_requires = []
+      all_requires = set()
       for requires in [ event.requires for event in top ]:
-        all_requires.extend(requires)
+        all_requires.update(requires)
 
       for event in [ event for event in top if event.conditional ]:
         keep = False
@@ -195,8 +343,15 @@ class Dispatch:
   def get(self, eventid, fallback=NoneType()):
     return self._top.get(eventid, fallback)
 
+def pprint_event(depth, s):
+  if depth < 1:
+    print s
+  else:
+    print '|  ' * (depth-1) + '|- ' + s
+
 class Loader:
-  def __init__(self, ptr, top=None, api_ver=0, ignore=None):
+  def __init__(self, ptr, top=None, api_ver=0, ignore=None, registry=None,
+                     context=None):
     self.ptr = ptr
     self.module_map = {} # map of moduleid to events
     self.events  = []
@@ -209,6 +364,15 @@ class Loader:
     self.api_ver = api_ver
     self.ignore = ignore or [] # list of module names to ignore while loading
 
+    # optional ModuleRegistry used to avoid importing files that are not
+    # modules, or modules that provided no enabled events in the same
+    # context last time
+    self.registry = registry
+    self.context = context
+    self.module_files = {} # map of moduleid to module file
+    self.unused = {} # map of moduleid to files skipped using the registry
+    self.side_effects = set() # moduleids that set cvars while loading
+
   def load(self, dirs, prefix='', *args, **kwargs):
     "Find all python modules beneath dirs, load all events defined therein, "
     "and construct an appropriate event tree from them, if possible."
@@ -218,16 +382,57 @@ class Loader:
         modid   = str(mod.basename.splitext()[0])
         modname = mod.relpathfrom(dir).splitext()[0].replace('/', '.')
         if modid in self.ignore: continue
-        m = load_modules(modname, dir, err=False)
-        if hasattr(m, 'get_module_info'):
+        m = self._load_module(mod, modid, modname, dir)
+        if m is not None:
           self.modules[modid] = m
 
-    for mod in self.modules.values():
-      self._process_module(mod, ptr=self.ptr, *args, **kwargs)
-
+    self._process_modules(*args, **kwargs)
     self._resolve_events()
+    self._update_registry()
     return self.top
 
+  def _process_modules(self, *args, **kwargs):
+    "Process all loaded modules, noting those that modify ptr.cvars"
+    cvars = getattr(self.ptr, 'cvars', None)
+    for modid, mod in self.modules.items():
+      if cvars is not None:
+        before = dict([ (k, id(v)) for k,v in cvars.items() ])
+      self._process_module(mod, ptr=self.ptr, *args, **kwargs)
+      if cvars is not None:
+        if before != dict([ (k, id(v)) for k,v in cvars.items() ]):
+          self.side_effects.add(modid)
+
+  def _load_module(self, file, modid, modname, dir):
+    """Import the module at file, returning it if it defines get_module_info,
+    or None otherwise.  Files the registry knows are not modules, or are
+    unused in the current context, are not imported."""
+    if self.registry:
+      if self.registry.is_module(file) is False:
+        return None
+      if self.registry.is_unused(self.context, file) or modid in self.unused:
+        self.unused.setdefault(modid, file)
+        return None
+
+    m = load_modules(modname, dir, err=False)
+    is_module = hasattr(m, 'get_module_info')
+    if self.registry:
+      self.registry.update(file, is_module)
+    if not is_module: return None
+
+    self.module_files[modid] = file
+    return m
+
+  def _update_registry(self):
+    "Record modules that provided no enabled events in the registry"
+    if not self.registry: return
+    unused = set(self.unused.values())
+    for modid, file in self.module_files.items():
+      # modules that set cvars must still be loaded, even if unused, since
+      # other events may rely on them
+      if modid not in self.modules and modid not in self.side_effects:
+        unused.add(file)
+    self.registry.set_unused(self.context, unused)
+
   def _process_module(self, mod, ptr, *args, **kwargs):
     """Process a module and recursively process all submodules as well.
     Creates an instance of each event in EVENTS dictionary, adds event to
@@ -296,6 +501,127 @@ class Loader:
           self.module_map.pop(key)
           self.modules.pop(key)
 
+class ModuleRegistry(object):
+  """
+  Persistent cache of module metadata, used by Loader to speed startup.
+
+  For every file seen beneath the module directories, the registry records
+  its size and mtime and whether it defines get_module_info.  Because
+  get_module_info() and event constructors can depend on the runtime
+  configuration, the remaining data is kept per 'context', an opaque key
+  computed by the caller from everything modules can see (e.g. a digest of
+  the definition and enabled/disabled module lists).  For each context, the
+  registry stores the module files that provided no enabled events and the
+  resulting list of events.  Context data is only used while every file
+  beneath the module directories is unchanged since it was recorded.
+  """
+  max_contexts = 50
+
+  def __init__(self, file):
+    self.file = pps.path(file)
+    self.files = {} # {file: ((size, mtime), is_module)}
+    self.contexts = {} # {context: {'snapshot', 'unused', 'events', 'atime'}}
+    self.snapshot = {} # {file: (size, mtime)} for the current session
+    self.dirty = False
+    self.read()
+
+  def read(self):
+    if not self.file.exists(): return
+    try:
+      fo = open(self.file, 'rb')
+      try:
+        self.files, self.contexts = cPickle.load(fo)
+      finally:
+        fo.close()
+    except Exception:
+      # unreadable or outdated registry; start over
+      self.files, self.contexts = {}, {}
+
+  def write(self):
+    if not self.dirty: return
+    # drop least recently used contexts
+    for context in sorted(self.contexts.keys(),
+                          key=lambda c: self.contexts[c]['atime'],
+                          reverse=True)[self.max_contexts:]:
+      del self.contexts[context]
+    self.file.dirname.mkdirs()
+    tmp = self.file + '.%d' % os.getpid()
+    fo = open(tmp, 'wb')
+    try:
+      cPickle.dump((self.files, self.contexts), fo, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      fo.close()
+    tmp.rename(self.file)
+    self.dirty = False
+
+  def scan(self, dirs):
+    "Record the size and mtime of every file beneath dirs"
+    self.snapshot = {}
+    for dir in dirs:
+      dir = pps.path(dir)
+      if not dir.isdir(): continue
+      for f in dir.findpaths(nregex='.*/(\..*|.*\.pyc|.*\.pyo)', mindepth=1):
+        self.snapshot[str(f)] = self._stat(f)
+
+  def is_module(self, file):
+    """Return whether file defines get_module_info, or None if the file has
+    changed or has not been seen before"""
+    stat, is_module = self.files.get(str(file), (None, None))
+    if stat is None or stat != self._current(file):
+      return None
+    return is_module
+
+  def update(self, file, is_module):
+    self.files[str(file)] = (self._current(file), is_module)
+    self.dirty = True
+
+  def is_unused(self, context, file):
+    ctx = self._get_context(context)
+    return ctx is not None and str(file) in ctx['unused']
+
+  def set_unused(self, context, files):
+    self._set_context(context, 'unused', set([ str(f) for f in files ]))
+
+  def get_events(self, context):
+    "Return the cached list of (depth, eventid) tuples, if valid"
+    ctx = self._get_context(context)
+    if ctx is None: return None
+    return ctx['events']
+
+  def set_events(self, context, events):
+    self._set_context(context, 'events', list(events))
+
+  def _get_context(self, context):
+    if context is None: return None
+    ctx = self.contexts.get(context)
+    if ctx is None or ctx['snapshot'] != self.snapshot:
+      return None
+    return ctx
+
+  def _set_context(self, context, key, value):
+    if context is None: return
+    ctx = self.contexts.get(context)
+    if ctx is None or ctx['snapshot'] != self.snapshot:
+      ctx = self.contexts[context] = {'snapshot': self.snapshot,
+                                      'unused': set(), 'events': None}
+    ctx[key] = value
+    ctx['atime'] = time.time()
+    self.dirty = True
+
+  def _current(self, file):
+    return self.snapshot.get(str(file)) or self._stat(file)
+
+  def _stat(self, file):
+    file = pps.path(file)
+    # a package's code lives in its __init__.py, not in its directory
+    if file.isdir(): file = file / '__init__.py'
+    try:
+      st = file.stat()
+      return (st.st_size, st.st_mtime)
+    except pps.Path.error.PathError:
+      return None
+
+
 def load_modules(name, dir, err=True):
   "Recursively load the module with name name located underneath dir"
   # don't reload already-loaded modules
@@ -346,3 +672,6 @@ def check_api_version(module, modinfo, api_ver):
 #------ ERRORS ------#
 class EventProtectionError(StandardError): pass
 class UnregisteredEventError(StandardError): pass
+class DispatchDeadlockError(StandardError):
+  def __str__(self):
+    return 'Unable to schedule events: %s' % ', '.join(self.args[0])
@@ -15,7 +15,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
-import os
 
 from deploy.util import magic
 from deploy.util import pps
@@ -53,10 +52,8 @@ class CpioImageHandler:
     if not point:
       point = acquire_mount_point()
     if mode == MODE_WRITE:
-      oldcwd = os.getcwd()
-      os.chdir(point)
-      shlib.execute('/bin/cpio -i -d --quiet -m < "%s"' % self.base.imgloc)
-      os.chdir(oldcwd)
+      shlib.execute('/bin/cpio -i -d --quiet -m < "%s"' % self.base.imgloc,
+                    cwd=point)
     self._mount = point
 
   def close(self):
@@ -66,11 +63,8 @@ class CpioImageHandler:
 
   def flush(self):
     if self.base.mode == MODE_WRITE:
-      oldcwd = os.getcwd()
-      os.chdir(self._mount)
       shlib.execute('/usr/bin/find . | /bin/cpio --quiet -c -o -a > "%s"' % 
-                    self.base.imgloc)
-      os.chdir(oldcwd)
+                    self.base.imgloc, cwd=self._mount)
 
   def write(self, src, dest='/'):
     imgdir = self._mount//dest
@@ -96,11 +90,8 @@ class CpioImageHandler:
 
   def read(self, fn):
     if self.base.mode == MODE_READ:
-      oldcwd = os.getcwd()
-      os.chdir(self._mount)
       shlib.execute('/bin/cpio -i -d -m --quiet "%s" < "%s"' % 
-                   (fn, self.base.imgloc))
-      os.chdir(oldcwd)
+                   (fn, self.base.imgloc), cwd=self._mount)
 
     f = self._mount//fn
 
@@ -1,3 +1,5 @@
+import errno
+import fcntl
 import os
 import socket
 
@@ -76,6 +78,67 @@ class Lock:
     self.release()
 
 
+class FileLock:
+  """Blocking, advisory lock on a file, built on flock(2).  Serializes work
+  among processes (and threads, as each acquire opens the file anew) on the
+  same host.  The lock is released automatically if the process exits."""
+  def __init__(self, path):
+    self.path = pps.path(path)
+    self.fo = None
+
+  def acquire(self, blocking=True):
+    "Acquire the lock, returning self if successful, False if blocking is "
+    "False and another process holds it"
+    flags = fcntl.LOCK_EX
+    if not blocking: flags |= fcntl.LOCK_NB
+    while True:
+      self.path.dirname.mkdirs()
+      fo = open(self.path, 'a')
+      try:
+        fcntl.flock(fo.fileno(), flags)
+      except IOError, e:
+        fo.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES): return False
+        raise
+      # the holder we waited on may have removed the file; if so, our lock
+      # is on an orphan and we must lock whatever is at path now
+      if self._current(fo): break
+      fo.close()
+    self.fo = fo
+    return self
+
+  def _current(self, fo):
+    try:
+      st = os.stat(self.path)
+    except OSError:
+      return False
+    fst = os.fstat(fo.fileno())
+    return (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino)
+
+  def release(self):
+    "Release the lock, returning self"
+    if self.fo is not None:
+      fcntl.flock(self.fo.fileno(), fcntl.LOCK_UN)
+      self.fo.close()
+      self.fo = None
+    return self
+
+  def remove(self):
+    "Remove the lock file and release the lock; the lock must be held"
+    try:
+      os.unlink(self.path)
+    except OSError, e:
+      if e.errno != errno.ENOENT: raise
+    return self.release()
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, *exc_info):
+    self.release()
+    return False
+
+
 class LockError(OSError):
   def __init__(self, path, pid, hostname=None):
     self.path = path
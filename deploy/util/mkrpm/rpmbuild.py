@@ -114,26 +114,26 @@ class RpmBuilder:
 
   def _build(self):
     if self.quiet:
-      orig_in = os.dup(0)
-      orig_out = os.dup(1)
-      orig_err = os.dup(2)
-      for (fileno, mode) in [(0, os.O_RDONLY),
-                             (1, os.O_WRONLY)]:
-        fdno = os.open('/dev/null', mode)
-        if fdno != fileno:
-          os.dup2(fdno, fileno)
-          os.close(fdno)
-
       # have to special case stderr so that when an exception
       # is raised, we have something to print out
       tfdno,tfile = tempfile.mkstemp()
-      errin = os.open(tfile, os.O_RDWR|os.O_CREAT)
-      os.dup2(errin, 2)
 
     pid = os.fork()
 
     # child process
     if not pid:
+      if self.quiet:
+        # redirect only in the child; other threads of the parent, e.g. events
+        # running in parallel, keep writing to the real console and logs
+        for (fileno, mode) in [(0, os.O_RDONLY),
+                               (1, os.O_WRONLY)]:
+          fdno = os.open('/dev/null', mode)
+          if fdno != fileno:
+            os.dup2(fdno, fileno)
+            os.close(fdno)
+        os.dup2(tfdno, 2)
+        os.close(tfdno)
+
       argv = ['python', 'setup.py', 'bdist_rpm']
       if self.bdist_base:
         argv.extend(['--bdist-base', str(self.bdist_base)])
@@ -151,23 +151,15 @@ class RpmBuilder:
       os.execv(sys.executable, argv)
 
     # parent process
-    failed = False
     try:
       pid2, status = os.waitpid(pid, 0)
       assert pid2 == pid
       if not os.WIFEXITED(status) or os.WEXITSTATUS(status):
-        failed = True
         if self.quiet:
-          os.dup2(orig_in, 0)
-          os.dup2(orig_out, 1)
-          os.dup2(orig_err, 2)
-          elog = os.fdopen(errin, 'r')
+          elog = os.fdopen(os.dup(tfdno), 'r')
           elog.seek(0)
           msg = elog.read()
           elog.close()
-          os.close(orig_in)
-          os.close(orig_out)
-          os.close(orig_err)
           raise RpmBuilderException("rpm build failed:\n%s" % msg)
         else:
           raise RpmBuilderException("rpm build failed")
@@ -175,14 +167,6 @@ class RpmBuilder:
       if self.quiet:
         os.close(tfdno)
         pps.path(tfile).rm(force=True)
-        if not failed:
-          os.dup2(orig_in, 0)
-          os.dup2(orig_out, 1)
-          os.dup2(orig_err, 2)
-          os.close(orig_in)
-          os.close(orig_out)
-          os.close(orig_err)
-          os.close(errin)
 
     self.postbuild()
 
@@ -20,7 +20,8 @@ import errno
 
 import deploy.util
 
-from deploy.util.pps.lib import file_cache
+from deploy.util.pps.lib import CACHE, file_cache
+from deploy.util.pps.lib.digests import hashtype
 
 from deploy.util.pps.Path import Path_IO
 from deploy.util.pps.Path.error import PathError
@@ -29,6 +30,21 @@ class CachedPath_IO(Path_IO):
   def link(self, dst):
     self.cp(dst, link=True)
 
+  def expect_checksum(self, checksum, type=None):
+    """
+    Record checksum, such as one listed in repository metadata, as the
+    checksum of this file.  Downloads of the file into the cache are
+    verified against it.  If type is None, it is judged from the length of
+    checksum; checksums of unknown type are ignored.
+    """
+    type = type or hashtype(checksum)
+    if type:
+      CACHE.setdefault(str(self), {})['expected_checksum'] = (type, checksum)
+
+  def expected_checksum(self):
+    "Return the (type, checksum) recorded by expect_checksum(), or None"
+    return CACHE.get(str(self), {}).get('expected_checksum')
+
   def _copy(self, dst, force=False, **kwargs):
     if (not self.cache_handler or self.islink() 
                                or dst.dirname == self.cache_handler.cache_dir):
@@ -53,12 +53,17 @@ class HttpPath_IO(RemotePath_IO):
   def _symlink(self, new): raise HttpPostError
   def readlink(self): return self._new(self)
 
-  def _open(self, mode='r', seek=None, **kwargs):
+  def _open(self, mode='r', seek=None, headers=None, end=None, **kwargs):
+    """
+    headers, if given, is a list of additional (key, value) header tuples.
+    end, if given, is the offset at which to stop reading; with seek, it
+    requests just that byte range of the file.
+    """
     if mode.startswith('r'):
       foargs = copy.copy(self._foargs)
       foargs.update(kwargs)
-      fo = HttpFileObject(self, range=(seek, None), headers=self._headers,
-                          **foargs)
+      fo = HttpFileObject(self, range=(seek, end),
+                          headers=self._headers + (headers or []), **foargs)
       # cache stat results, since we're opening the url anyway
       stat = HttpPathStat(self)
       stat.stat(fo=fo)
@@ -23,6 +23,18 @@ from error import error_transform
 
 class HttpPath_Stat(RemotePath_Stat):
 
+  def mkstat(self, populate=False):
+    """
+    In offline mode, answer from stat results saved by an earlier run when
+    the file is not in the cache; see lib/validators.py
+    """
+    if self.cache_handler and self.cache_handler.offline and \
+       not self.cache_handler.cshfile(self).exists():
+      stat = HttpPathStat(self)
+      if stat.recall():
+        return stat
+    return RemotePath_Stat.mkstat(self, populate=populate)
+
   def _mkstat(self, populate=False):
     stat = HttpPathStat(self)
     if populate: stat.stat()
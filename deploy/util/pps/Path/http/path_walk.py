@@ -15,9 +15,34 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
+"""
+path_walk.py
+
+Directory listings of http locations, read from the server's index pages
+
+Index pages are parsed as they are downloaded, by IndexParser.  Listings are
+kept for the rest of the run, and saved in the cache dir so later runs
+request the page conditionally and reuse the saved listing if it has not
+changed; see lib/validators.py.  In offline mode, saved listings are used
+without contacting the server.
+
+Autoindex pages (apache, nginx, lighttpd) list the size and modified time of
+each file.  Sizes given in bytes fill in st_size of the listed paths.  Listed
+times are in the server's unspecified time zone and to the minute only, so
+they are not used as st_mtime directly.  Instead, the time and size listed
+for a file are saved with its stat fields when it is stat'd (see
+PathStat/http.py); when a later listing shows exactly the same time and size,
+the saved fields are used, and the file need not be stat'd again.  Fields
+saved less than RACY_WINDOW seconds after the file was modified are not
+reused this way, as the file may have been modified again within the same
+listed minute.
+"""
+
 import re
 import stat
 
+from HTMLParser import HTMLParser, HTMLParseError
+
 from deploy.util.pps.Path.remote import RemotePath_Walk
 
 from deploy.util.pps.constants import *
@@ -25,6 +50,12 @@ from deploy.util.pps.PathSet   import PathSet
 
 from deploy.util.pps.Path.error import PathError
 
+from deploy.util.pps.lib.http       import HttpFileObject, HttpFileObjectError
+from deploy.util.pps.lib.validators import get_validators, LISTING_FILE
+from deploy.util.pps.PathStat.http  import HttpPathStat, LISTED
+
+from error import error_transform
+
 # url REs to ignore
 BLACKLIST = [
   re.compile('^\?'),      # query
@@ -36,40 +67,40 @@ BLACKLIST = [
   re.compile('://'),      # full URLs
 ]
 
-HYPERLINK = re.compile('<a .*href=\"(?P<url>[^\"]*)\".*>')
+READSIZE = 64*1024 # bytes of an index page parsed at a time
 
-class HttpPath_Walk(RemotePath_Walk):
+# the modified time and size listed after a link on autoindex pages, e.g.
+# '2015-10-21 07:28  1.2K', '21-Oct-2015 07:28  1234' or '2015-Oct-21 07:28:00'
+INDEX_DATE = re.compile(
+  r'(?P<date>\d{4}-\d{2}-\d{2}|\d{1,2}-[A-Za-z]{3}-\d{4}|\d{4}-[A-Za-z]{3}-\d{2})'
+  r'\s+(?P<time>\d{1,2}:\d{2})(?::\d{2})?'
+  r'(?:\s+(?P<size>\d+(?:\.\d+)?[KMGTP]?|-))?')
 
-  def listdir(self, glob=None, nglob=None, all=False, sort='name'):
-    fo = self._open()
+# listed times are to the minute; stat fields taken less than this long
+# after a file's mtime may be out of date even though its listing is not
+RACY_WINDOW = 60
 
-    try:
-      if not self.isdir(): raise PathError(20, self)
+LISTINGS = {} # listings for the current run, by url
 
-      index = fo.read()
-    finally:
-      fo.close()
-
-    content = []
-    for link in HYPERLINK.findall(index):
-      link = HYPERLINK.sub('\g<url>', link)
-
-      try:
-        for item in BLACKLIST:
-          if item.findall(link): raise StopIteration
-      except StopIteration:
-        continue
+class HttpPath_Walk(RemotePath_Walk):
 
-      content.append(link)
+  def listdir(self, glob=None, nglob=None, all=False, sort='name'):
+    saved = get_validators(self.cache_handler)
 
     pathset = PathSet()
-    for item in content:
+    for item, size, listed in self._listing():
       if item.endswith(self._pypath.sep):
         mode = stat.S_IFDIR
       else:
         mode = stat.S_IFREG
       path = self/item
-      path.stat(populate=False).update(st_mode=mode)
+      known = saved.get(path)
+      if listed is not None: LISTED[str(path)] = listed
+      if (mode == stat.S_IFREG and listed is not None and known and
+          known.get('listed') == listed and _settled(known)):
+        path.stat(populate=False).update(*known['stat'])
+      else:
+        path.stat(populate=False).update(st_mode=mode, st_size=size)
       #path = Path(path.rstrip('/')) # remove directory indicator
       pathset.append(path)
 
@@ -78,3 +109,126 @@ class HttpPath_Walk(RemotePath_Walk):
     if sort:  pathset.sort(type=sort)
 
     return pathset
+
+  def _listing(self):
+    "Return the (link, size, listed) entries on this directory's index"
+    url = str(self)
+    if url in LISTINGS:
+      return LISTINGS[url]
+
+    listings = get_validators(self.cache_handler, LISTING_FILE)
+    saved = listings.get(url)
+    if saved and self.cache_handler and self.cache_handler.offline:
+      return saved['listing']
+
+    try:
+      fo = HttpFileObject(self, headers=self._headers + listings.headers(url),
+                          **self._foargs)
+    except HttpFileObjectError, e:
+      if not (e.errno == 14 and e.code == 304 and saved): raise
+      # not modified since the saved listing
+      listings.confirm(url)
+      LISTINGS[url] = saved['listing']
+      return saved['listing']
+
+    try:
+      stat = HttpPathStat(self)
+      stat.stat(fo=fo)
+      self._set_stat(stat)
+      if not self.isdir(): raise PathError(20, self)
+
+      parser = IndexParser()
+      try:
+        while True:
+          buf = fo.read(READSIZE)
+          if not buf: break
+          parser.feed(buf)
+        parser.close()
+      except HTMLParseError:
+        pass # keep the links found before the error
+    finally:
+      fo.close()
+
+    listing = []
+    index = {} # link: position in listing
+    for link, size, listed in parser.entries:
+      if [ item for item in BLACKLIST if item.search(link) ]:
+        continue
+      if link not in index:
+        index[link] = len(listing)
+        listing.append((link, size, listed))
+      elif listed is not None: # e.g. an icon linking to the file came first
+        listing[index[link]] = (link, size, listed)
+
+    LISTINGS[url] = listing
+    listings.record(url, fo.hdr, listing=listing)
+    return listing
+
+  _protect = ['_listing']
+
+for fn in HttpPath_Walk._protect:
+  setattr(HttpPath_Walk, fn, error_transform(getattr(HttpPath_Walk, fn)))
+
+
+class IndexParser(HTMLParser):
+  """
+  Streaming extractor of the links on an html index page.  After close(),
+  entries is a list of (link, size, listed) tuples.  listed is the time and
+  size listed after the link, as text with whitespace collapsed, or None if
+  none are listed; size is the listed size if it is given in bytes, or None.
+  """
+  def __init__(self):
+    HTMLParser.__init__(self)
+    self.entries = []
+    self._link = None   # link whose trailing text is being collected
+    self._inlink = False
+    self._text = []
+
+  def handle_starttag(self, tag, attrs):
+    if tag == 'a':
+      self._end()
+      self._inlink = True
+      self._link = dict(attrs).get('href')
+    elif tag == 'tr':
+      self._end()
+    else:
+      self._text.append(' ') # e.g. between table cells
+
+  def handle_endtag(self, tag):
+    if tag == 'a':
+      self._inlink = False
+    elif tag in ['tr', 'pre', 'table']:
+      self._end()
+    else:
+      self._text.append(' ')
+
+  def handle_data(self, data):
+    if self._link is not None and not self._inlink:
+      self._text.append(data)
+
+  def close(self):
+    HTMLParser.close(self)
+    self._end()
+
+  def _end(self):
+    "Add the current link and the size and time listed after it to entries"
+    if self._link is not None:
+      size = listed = None
+      match = INDEX_DATE.search(''.join(self._text))
+      if match:
+        listed = ' '.join(match.group(0).split())
+        if match.group('size') and match.group('size').isdigit():
+          size = int(match.group('size'))
+      self.entries.append((self._link, size, listed))
+    self._link = None
+    self._text = []
+
+
+def _settled(known):
+  """
+  Return True if the saved stat fields in known were taken long enough
+  after the file's mtime that a later change would change its listing
+  """
+  mtime = known['stat'][stat.ST_MTIME]
+  return (known.get('stat_time') is not None and mtime != -1 and
+          known['stat_time'] - mtime >= RACY_WINDOW)
@@ -15,12 +15,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
+import binascii
 import os
 import shutil
 
 from error import error_transform
 
-from deploy.util.pps.Path import Path_IO
+from deploy.util.pps           import hashcache
+from deploy.util.pps.Path      import Path_IO
 
 class LocalPath_IO(Path_IO):
 
@@ -41,6 +43,15 @@ class LocalPath_IO(Path_IO):
   def remove(self):           os.remove(self.normpath())
   def unlink(self):           os.unlink(self.normpath())
 
+  def checksums(self, types=['sha256'], hex=True):
+    "Like Path_IO.checksums(), using the digest cache if it is enabled"
+    if hashcache.CACHE is None:
+      return Path_IO.checksums(self, types=types, hex=hex)
+    csums = hashcache.CACHE.digests(self.normpath(), types)
+    if hex: return csums
+    return dict([ (type, binascii.unhexlify(csum))
+                  for type, csum in csums.items() ])
+
   def _open(self, mode='r', seek=None, **kwargs):
     if not seek:
       return open(self.normpath(), mode)
@@ -50,7 +61,7 @@ class LocalPath_IO(Path_IO):
       return fo
 
   _protect = ['utime', 'chmod', 'rename', 'mkdir', 'rmdir', 'mknod',
-              'touch', 'remove', 'unlink', '_open']
+              'touch', 'remove', 'unlink', 'checksums', '_open']
 
 for fn in LocalPath_IO._protect:
   setattr(LocalPath_IO, fn, error_transform(getattr(LocalPath_IO, fn)))
@@ -16,7 +16,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
 
+import deploy.util
+
+from deploy.util.pps.lib import expected_digests, verify_checksum
 from deploy.util.pps.lib.mirror import trymirrors
+from deploy.util.pps.lib.segmented import segmentable
 
 from deploy.util.pps.Path.remote import RemotePath_IO
 
@@ -64,11 +68,33 @@ class MirrorPath_IO(RemotePath_IO):
 
   # file reading, copying, writing
   @trymirrors
-  def _open(self, f, *a,**kw):        return f.open(*a,**kw)
-  @trymirrors
-  def copyfile(self, f, *a,**kw):    return f.copyfile(*a,**kw)
-  @trymirrors
-  def cp(self, f, dst, *a,**kw):     return f.cp(dst, *a,**kw)
+  def _open(self, f, *a,**kw):        return f._open(*a,**kw)
+  @trymirrors
+  def copyfile(self, f, *a,**kw):
+    if kw.get('digests') is not None:
+      kw['digests'].reset() # drop anything read from a failed mirror
+    return f.copyfile(*a,**kw)
+  def cp(self, dst, *a, **kw):
+    # copy large files through this path's cache, so that they can be
+    # downloaded in parts from several mirrors at once
+    if self.cache_handler and segmentable(self)[0] is not None:
+      return RemotePath_IO.cp(self, dst, *a, **kw)
+    return self._cp(dst, *a, **kw)
+  @trymirrors
+  def _cp(self, f, dst, *a,**kw):
+    # returns the bytes copied, which trymirrors records as a throughput
+    # sample; a copy that fails its expected checksum fails over to the next
+    # mirror, as the file is copied from the mirror directly and not verified
+    # by the cache
+    digests = expected_digests(self)
+    if digests is None:
+      return f.cp(dst, *a,**kw)
+    copied = f.cp(dst, digests=digests, *a,**kw)
+    if copied: # otherwise dst was up to date and not copied
+      dst = deploy.util.pps.path(dst)
+      if dst.isdir(): dst = dst / f.basename
+      verify_checksum(self, dst, digests)
+    return copied
   @trymirrors
   def read_text(self, f, *a,**kw):   return f.read_text(*a,**kw)
   @trymirrors
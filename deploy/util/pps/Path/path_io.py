@@ -16,13 +16,13 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
 import errno
-import hashlib
 import stat
 
 import deploy.util
 
-from deploy.util.pps.lib       import cached
-from deploy.util.pps.constants import *
+from deploy.util.pps.lib         import cached, kernelcopy
+from deploy.util.pps.lib.digests import Digests
+from deploy.util.pps.constants   import *
 
 from deploy.util.pps.Path.error import PathError
 
@@ -56,7 +56,11 @@ class Path_IO(object):
     for i in range(0, len(self.splitall())):
       dirstack = self.splitall()[0:i+1]
       if not dirstack.exists():
-        dirstack.mkdir(mode=mode)
+        try:
+          dirstack.mkdir(mode=mode)
+        except PathError, e:
+          # another thread or process may have created it in the meantime
+          if e.errno != errno.EEXIST or not dirstack.isdir(): raise
       elif dirstack.isfile():
         raise PathError(errno.EEXIST, "cannot create directory '%s'" % self)
   def rmdir(self):            raise NotImplementedError
@@ -107,11 +111,21 @@ class Path_IO(object):
   def _symlink(self, new): raise NotImplementedError
   def readlink(self):      raise NotImplementedError
 
+  # known checksums; only files downloaded into a cache are checked against
+  # them (see CachedPath_IO)
+  def expect_checksum(self, checksum, type=None): pass
+  def expected_checksum(self): return None
+
   # file reading, copying, writing
   def open(self, *args, **kwargs): return self._open(*args, **kwargs) # cached
   def _open(self, *args, **kwargs): raise NotImplementedError
 
-  def copyfile(self, dst, callback=None, preserve=False, **kwargs):
+  def copyfile(self, dst, callback=None, preserve=False, digests=None,
+                     **kwargs):
+    """
+    Copy the contents of this file to dst.  If digests is a Digests object,
+    it is updated with the contents of the file as it is copied.
+    """
     if self.isdir():
       raise PathError(errno.EISDIR, "cannot read file '%s'" % self)
 
@@ -123,7 +137,15 @@ class Path_IO(object):
     try:
       fsrc = self._open('rb')
       fdst = dst._open('wb')
-      read = copyfileobj(fsrc, fdst, callback=callback, **kwargs)
+      read = None
+      if isinstance(fsrc, file) and isinstance(fdst, file):
+        # both local; let the kernel copy the data if it can
+        read = kernelcopy.copy(fsrc, fdst, callback=callback)
+        if read is not None and digests is not None:
+          digests.updatefile(fsrc) # the data never passed through python
+      if read is None:
+        read = copyfileobj(fsrc, fdst, callback=callback, digests=digests,
+                           **kwargs)
     finally:
       if fsrc: fsrc.close()
       if fdst: fdst.close()
@@ -150,7 +172,8 @@ class Path_IO(object):
     modified time to the destionation. The keyword arguments link, force,
     and update control exactly how this copy is performed; link creates
     file links, force removes the destination before copying, and update
-    only copies if the source is newer than the destination.
+    only copies if the source is newer than the destination.  Returns the
+    number of bytes copied, as a float.
     """
     if mirror: preserve=True  # mirroring relies on preserved timestamps
 
@@ -160,6 +183,7 @@ class Path_IO(object):
     kwargs['callback'] = callback 
 
     dst = deploy.util.pps.path(dst)
+    copied = 0.0
     if self.isdir():
       if not recursive:
         raise PathError(errno.EISDIR, "cannot copy directory '%s' in non-recursive mode" % self)
@@ -178,7 +202,7 @@ class Path_IO(object):
           d = dst/self.basename/file.splitall()[-level:]
           if callback and hasattr(callback, '_start'):
             callback._start(self.stat().st_size, self.basename)
-          file._copy(d, **kwargs)
+          copied += file._copy(d, **kwargs) or 0
           if callback and hasattr(callback, '_end'):
             callback._end()
     elif self.isfile() or self.islink():
@@ -188,13 +212,14 @@ class Path_IO(object):
         d = dst
       if callback and hasattr(callback, '_start'):
         callback._start(self.stat().st_size, self.basename)
-      self._copy(d, **kwargs)
+      copied += self._copy(d, **kwargs) or 0
       if callback and hasattr(callback, '_end'):
         callback._end()
+    return copied
 
   def _copy(self, dst, link=False, update=False, mirror=False, force=False,
                        callback=None, **kwargs):
-    "copy() helper function"
+    "copy() helper function; returns the number of bytes copied, if any"
     size = self.stat().st_size
     if callback: callback._cp_start(size, self.basename)
 
@@ -207,7 +232,7 @@ class Path_IO(object):
       if mirror and self._mirrorfn(dst): dst.remove()
       if not dst.exists():
         if link: self._link(dst)
-        else:    self.copyfile(dst, **kwargs)
+        else:    return self.copyfile(dst, **kwargs)
     else:
       if self.islink():
         if dst.exists():
@@ -220,7 +245,7 @@ class Path_IO(object):
       else:
         if dst.exists():
           raise PathError(errno.EEXIST, "cannot copy to '%s'" % dst)
-        self.copyfile(dst, **kwargs)
+        return self.copyfile(dst, **kwargs)
     if callback: callback._cp_end(size)
   def _updatefn(self, dst):
     'return true if dst exists this file is newer than dst'
@@ -262,18 +287,35 @@ class Path_IO(object):
 
   def checksum(self, type='sha256', hex=True):
     "Compute a checksum using mod (sha or md5).  Return the (hex)digest"
-    if type == 'sha': type = 'sha1'
-    mod = eval("hashlib.%s" % type)
-    csum = mod(self.read_text())
-    if hex: return csum.hexdigest()
-    else:   return csum.digest()
-
-def copyfileobj(fsrc, fdst, callback=None, buflen=16*1024, **kwargs):
-  "Copy from open file object fsrc to open file object fdst"
-  read = 0.0
+    return self.checksums([type], hex=hex)[type]
+
+  def checksums(self, types=['sha256'], hex=True):
+    """
+    Compute checksums of each type in types in a single read of the file.
+    Return a dict of (hex)digests by type
+    """
+    digests = Digests(types)
+    fo = self.open('r')
+    try:
+      digests.updatefile(fo)
+    finally:
+      fo.close()
+    if hex: return digests.hexdigests()
+    else:   return digests.digests()
+
+def copyfileobj(fsrc, fdst, callback=None, buflen=256*1024, digests=None,
+                offset=0, **kwargs):
+  """
+  Copy from open file object fsrc to open file object fdst, updating digests,
+  if given, with each buffer copied.  offset is the position in the file at
+  which fsrc starts; progress and the returned count include it.
+  """
+  read = float(offset)
   while True:
     buf = fsrc.read(buflen)
     if not buf: break
     fdst.write(buf)
+    if digests is not None: digests.update(buf)
     read += len(buf)
     if callback: callback._cp_update(read)
+  return read
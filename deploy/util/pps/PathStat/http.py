@@ -22,12 +22,22 @@ import rfc822
 import stat
 import time
 
-from deploy.util.pps.lib.http import HttpFileObject
+from deploy.util.pps.lib.http       import HttpFileObject, HttpFileObjectError
+from deploy.util.pps.lib.validators import get_validators
 
 from __init__ import PathStat
 
 MODE = stat.S_IWUSR | stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH #0644
 
+# stat results for the current run, by url; either a list of stat fields or
+# the HttpFileObjectError raised for a location that does not exist
+STATS = {}
+
+# the time and size listed for urls on directory index pages this run, as
+# text; saved with the urls' stat fields, along with the server's time when
+# they were taken (stat_time), see Path/http/path_walk.py
+LISTED = {}
+
 class HttpPathStat(PathStat):
   """
   HttpPathStat fully implements the PathStat interface.  However, some of
@@ -55,23 +65,73 @@ class HttpPathStat(PathStat):
     argument, which can be an open file-like object on the file located at
     HttpPathStat.uri. This allows a slight bit of optimization by
     minimizing HTTP requests made on the server.  If fo is None,
-    HttpPathStat creates its own connection.
+    HttpPathStat makes a HEAD request, unless the url has already been
+    stat'd in this run.  The HEAD request is conditional if validators for
+    the url were saved by an earlier run; if the server answers 304 Not
+    Modified, the saved stat fields are used.
     """
-    if not fo:
-      stat_fo = HttpFileObject(self.uri, headers=self.uri._headers)
-    else:
-      stat_fo = fo
+    url = str(self.uri)
+    validators = get_validators(getattr(self.uri, 'cache_handler', None))
+
+    if fo:
+      self._set_fields(fo, validators)
+      return
 
-    self._hdr = stat_fo.hdr
+    result = STATS.get(url)
+    if isinstance(result, HttpFileObjectError):
+      raise result
+    if result is not None:
+      self._stat = list(result)
+      return
 
-    if self.uri.endswith('/') or (hasattr(stat_fo, 'isdir') and stat_fo.isdir):
+    headers = self.uri._headers + validators.headers(url)
+    try:
+      try:
+        stat_fo = HttpFileObject(self.uri, headers=headers, method='HEAD')
+      except HttpFileObjectError, e:
+        if e.errno != 14: raise # not an HTTPError
+        if e.code == 304 and validators.get(url):
+          # the listing may change while the file does not
+          data = { 'stat_time': server_time(getattr(e.exception, 'hdrs', None)) }
+          if url in LISTED: data['listed'] = LISTED[url]
+          validators.confirm(url, **data)
+          self._stat = list(validators.get(url)['stat'])
+          self._stat[stat.ST_ATIME] = int(time.time())
+          STATS[url] = tuple(self._stat)
+          return
+        if e.code not in [405, 501]: raise
+        # the server does not support HEAD requests
+        stat_fo = HttpFileObject(self.uri, headers=self.uri._headers)
+    except HttpFileObjectError, e:
+      if e.errno == 14 and e.code in [400, 401, 403, 404, 410]:
+        STATS[url] = e # the answer will not change this run
+      raise
+
+    try:
+      self._set_fields(stat_fo, validators)
+    finally:
+      stat_fo.close()
+
+  def recall(self):
+    """
+    Set stat fields from those saved by an earlier run, without contacting
+    the server, as in offline mode.  Returns False if none were saved.
+    """
+    entry = get_validators(getattr(self.uri, 'cache_handler', None)
+                           ).get(self.uri)
+    if not entry: return False
+    self._stat = list(entry['stat'])
+    return True
+
+  def _set_fields(self, fo, validators):
+    "Set stat fields from the response headers of fo and record them"
+    self._hdr = fo.hdr
+
+    if self.uri.endswith('/') or (hasattr(fo, 'isdir') and fo.isdir):
       mode = stat.S_IFDIR | MODE
     else:
       mode = stat.S_IFREG | MODE
 
-    # if we weren't passed a file object, close the one we created
-    if not fo: stat_fo.close()
-
     # set atime
     atime = int(time.time())
 
@@ -83,8 +143,11 @@ class HttpPathStat(PathStat):
     else:
       mtime = -1
 
-    # set size
-    if self._hdr.has_key('content-length'):
+    # set size; a ranged response gives the full size in content-range
+    crange = self._hdr.getheader('content-range') or ''
+    if '/' in crange and not crange.endswith('*') and not mode & stat.S_IFDIR:
+      size = int(crange.split('/')[-1])
+    elif self._hdr.has_key('content-length'):
       if not mode & stat.S_IFDIR:
         size = int(self._hdr.getheader('content-length'))
       else:
@@ -93,3 +156,16 @@ class HttpPathStat(PathStat):
       size = -1
 
     self._stat = list((mode, -1, -1, -1, -1, -1, size, atime, mtime, -1))
+    STATS[str(self.uri)] = tuple(self._stat)
+    validators.record(self.uri, self._hdr, stat=tuple(self._stat),
+                      stat_time=server_time(self._hdr),
+                      listed=LISTED.get(str(self.uri)))
+
+
+def server_time(hdr):
+  "Return the time in the Date header of hdr, or the local time if none"
+  date = hdr is not None and hdr.getheader('date')
+  parsed = date and rfc822.parsedate_tz(date)
+  if parsed:
+    return int(rfc822.mktime_tz(parsed))
+  return int(time.time())
@@ -21,23 +21,29 @@ CopyCallback for caching files during copy operations.
 """
 
 import hashlib
-import time
+import threading
 import cPickle as pickle
 
 from functools import wraps
 
 import deploy.util
 
+from deploy.util.lock          import FileLock
 from deploy.util.progressbar   import ProgressBar
 
 from deploy.util.sync.callback import SyncCallbackMetered
 
 from deploy.util.pps import path as _orig_path
 
+from deploy.util.pps.cacheindex import open_index
+
 from deploy.util.pps.constants import *
 
+from deploy.util.pps.Path.error import PathError
+
 DEFAULT_CACHE_DIR = '/tmp/.pps-cache'
 DEFAULT_CACHE_SIZE = 500 * 1024**2 # 500 MB
+EVICT_BATCH = 100 # files read from the index at a time when evicting
 
 MODE_COPY_ONLY  = 'copy-only'
 MODE_COPY       = 'copy'
@@ -62,7 +68,9 @@ class CacheHandler(object):
                          gets above this size, files will be deleted, starting
                          with the least recently accessed file and continuing
                          until the self.cache_size < self.cache_max_size
-   * cache_files:        dictionary of file => atime pairs
+   * index:              a CacheIndex recording the size, last access time
+                         and source url of each cached file; see
+                         cacheindex.py
    * cache_size:         the current size of the cache
    * force:              if enabled, the handler deletes and recopies files to
                          the cache; this can be used, for example, to clear a
@@ -85,24 +93,47 @@ class CacheHandler(object):
     self.cache_max_size = cache_max_size
     self.force = force
     self.offline=offline
+    self._quota_lock = threading.Lock() # files may be cached concurrently
 
     self.cache_dir.mkdirs()
-    self.cache_files = {}
-    for f in self.cache_dir.findpaths(type=TYPE_FILE):
-      self.cache_files[f] = f.stat().st_atime
-
-    self.cache_size = 0
-    for f in self.cache_files:
-      self.cache_size += f.stat().st_size
+    self.index = open_index(self.cache_dir)
 
     self.wrap_path()
 
+  cache_size = property(lambda self: self.index.size())
+
+  def refresh(self):
+    """
+    Reopen the index if the cache has been removed since it was opened.
+    Long-lived handlers should call this before reuse.
+    """
+    self.cache_dir.mkdirs()
+    self.index.refresh()
+
   def cshfile(self, file):
     return self.cache_dir / gen_hash(deploy.util.pps.path(file).normpath())
 
-  def _touch(self, hash):
-    "Touch a file in the cache list to update its atime"
-    self.cache_files.setdefault(hash, time.time())
+  def lock(self, cshfile):
+    """
+    Return a FileLock for serializing writes to cshfile.  Processes sharing
+    the cache hold the lock while downloading a file, so a file is
+    downloaded once no matter how many processes request it.  The lock
+    file is removed along with cshfile when the quota evicts it.
+    """
+    return FileLock(self.cache_dir / '.locks' / cshfile.basename)
+
+  def add(self, cshfile, url=None):
+    "Record cshfile, newly added to the cache from url, in the index"
+    try:
+      size = cshfile.stat().st_size
+    except PathError:
+      return # removed meanwhile
+    self.index.add(cshfile.basename, size, url=url and str(url))
+
+  def touch(self, cshfile, url=None):
+    "Record an access to cshfile in the index, adding it if necessary"
+    if not self.index.touch(cshfile.basename):
+      self.add(cshfile, url=url)
 
   def pkl_dump(self, data, key):
     """
@@ -113,6 +144,7 @@ class CacheHandler(object):
     """
     with open(self.cshfile(key), 'wb') as fo:
       pickle.dump(data, fo)
+    self.add(self.cshfile(key))
 
   def pkl_load(self, key):
     """
@@ -121,6 +153,7 @@ class CacheHandler(object):
     """
     fn = self.cshfile(key)
     if fn.exists():
+      self.touch(fn)
       with open(self.cshfile(key), 'rb') as fo:
         return pickle.load(fo)
     else:
@@ -129,27 +162,40 @@ class CacheHandler(object):
   def _enforce_quota(self, callback=None):
     """
     Enforce that self.cache_size must be less than self.cache_max_size
-    by deleting files one at a time, based on their access time.  Older
-    files are deleted first. Currently, no preference is given to files
-    that are small or large, though a future improvement may also consider
-    size in this metric.  This algorithm is somewhat vulnerable to other
-    processes that may affect the access time; ideally, the cache handler
-    itself would keep track of the access time separately from the OS's
-    version.  This is relegated to a future improvement.
+    by deleting files one at a time, based on their access time as recorded
+    in the index.  Older files are deleted first. Currently, no preference
+    is given to files that are small or large, though a future improvement
+    may also consider size in this metric.
     """
 
-    if self.cache_size > self.cache_max_size:
-      sorted = [ (atime, f) for f, atime in self.cache_files.items() ]
-      sorted.sort()
-      # shrink the cache until we're below quota
-      while self.cache_size > self.cache_max_size:
-        _,cshfile = sorted.pop()
-        fsize = cshfile.stat().st_size
-        if hasattr(callback, '_cache_quota_rm'):
-          callback._cache_quota_rm(cshfile, fsize, self.cache_size)
-        cshfile.rm()
-        self.cache_size -= fsize
-        del self.cache_files[cshfile]
+    with self._quota_lock:
+      self._enforce_quota_locked(callback=callback)
+
+  def _enforce_quota_locked(self, callback=None):
+    # shrink the cache until we're below quota; skip files whose lock is
+    # held, as another thread or process is downloading them
+    busy = set()
+    while self.cache_size > self.cache_max_size:
+      oldest = [ (hash, size) for hash, size
+                 in self.index.oldest(EVICT_BATCH + len(busy))
+                 if hash not in busy ]
+      if not oldest: break
+      for hash, _ in oldest:
+        cshfile = self.cache_dir / hash
+        lock = self.lock(cshfile).acquire(blocking=False)
+        if not lock:
+          busy.add(hash)
+          continue
+        try:
+          self.index.remove(hash)
+          if cshfile.exists(): # else removed by another process
+            fsize = cshfile.stat().st_size
+            if hasattr(callback, '_cache_quota_rm'):
+              callback._cache_quota_rm(cshfile, fsize, self.cache_size)
+            cshfile.rm(force=True)
+        finally:
+          lock.remove()
+        if self.cache_size <= self.cache_max_size: break
 
   def wrap_path(self):
     "wrap deploy.util.pps.path function to set this instance as the cache "
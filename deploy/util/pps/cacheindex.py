@@ -0,0 +1,231 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+cacheindex.py
+
+Persistent index of the files in a pps cache
+
+The index is an sqlite database in the cache dir recording the size, last
+access time and source url of each cached file, by hash (file name).  The
+total size of the files is kept up to date by triggers, so opening the index
+and reading the size of the cache take constant time however many files are
+cached.  Processes sharing the cache share the index.
+
+CacheHandler updates the index as files are added, accessed and evicted.
+The index is repaired lazily where it disagrees with the cache dir: files
+that have been removed from the cache dir are dropped when they come up for
+eviction, and files that are not in the index are added when next accessed.
+A new or unreadable index is rebuilt by scanning the cache dir once.
+
+Access times change on every cache hit, so they are kept in memory and
+written in batches, at most FLUSH_INTERVAL seconds apart and before files
+are chosen for eviction.
+"""
+
+import atexit
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+INDEX_FILE = '.index.sqlite'
+FLUSH_INTERVAL = 30 # seconds between writes of access times
+TIMEOUT = 60 # seconds to wait for other processes writing to the index
+
+SCHEMA = [
+  '''CREATE TABLE IF NOT EXISTS files (
+       hash  TEXT PRIMARY KEY,
+       size  INTEGER NOT NULL,
+       atime REAL NOT NULL,
+       url   TEXT)''',
+  'CREATE INDEX IF NOT EXISTS files_atime ON files (atime)',
+  '''CREATE TABLE IF NOT EXISTS totals (
+       id   INTEGER PRIMARY KEY CHECK (id = 0),
+       size INTEGER NOT NULL)''',
+  'INSERT OR IGNORE INTO totals VALUES (0, 0)',
+  '''CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+       UPDATE totals SET size = size + NEW.size;
+     END''',
+  '''CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+       UPDATE totals SET size = size - OLD.size;
+     END''',
+  '''CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files
+     BEGIN
+       UPDATE totals SET size = size + NEW.size - OLD.size;
+     END''',
+]
+
+class CacheIndex(object):
+  "Sizes, access times and source urls of the files in a cache dir"
+  def __init__(self, dir):
+    self.dir = dir
+    self.file = dir / INDEX_FILE
+    self.lock = threading.Lock() # the connection is shared by threads
+    self.pending = {} # hash: access time not yet written
+    self.flushed = time.time()
+    self.db = None
+    self.open()
+
+  def open(self):
+    "Open the index, building it if it does not exist or cannot be read"
+    self.lock.acquire()
+    try:
+      if self.db is not None:
+        self.db.close()
+      new = not self.file.exists()
+      try:
+        self.db = self._connect()
+      except sqlite3.DatabaseError:
+        self.file.rm(force=True)
+        new = True
+        self.db = self._connect()
+      if new:
+        self._rebuild()
+    finally:
+      self.lock.release()
+
+  def _connect(self):
+    db = sqlite3.connect(str(self.file), timeout=TIMEOUT,
+                         check_same_thread=False)
+    try:
+      # the index can be rebuilt, so it need not survive a system crash
+      db.execute('PRAGMA synchronous = OFF')
+      with db:
+        for statement in SCHEMA:
+          db.execute(statement)
+    except sqlite3.DatabaseError:
+      db.close()
+      raise
+    return db
+
+  def refresh(self):
+    "Reopen the index if it has been removed, e.g. along with the cache"
+    if not self.file.exists():
+      self.open()
+
+  def _rebuild(self):
+    "Replace the contents of the index with the files in the cache dir"
+    rows = []
+    for name in os.listdir(str(self.dir)):
+      if name.startswith('.'): continue # partial downloads, the index, ...
+      try:
+        st = os.stat(os.path.join(str(self.dir), name))
+      except OSError:
+        continue
+      if not stat.S_ISREG(st.st_mode): continue
+      rows.append((name, st.st_size, st.st_atime))
+    with self.db:
+      self.db.execute('DELETE FROM files')
+      self.db.executemany(
+        'INSERT INTO files (hash, size, atime) VALUES (?, ?, ?)', rows)
+
+  def size(self):
+    "Return the total size of the files in the index"
+    self.lock.acquire()
+    try:
+      return self.db.execute('SELECT size FROM totals').fetchone()[0]
+    finally:
+      self.lock.release()
+
+  def add(self, hash, size, url=None):
+    "Add or update the file hash, accessed now"
+    self.lock.acquire()
+    try:
+      self.pending.pop(hash, None)
+      with self.db:
+        if not self.db.execute(
+             'UPDATE files SET size = ?, atime = ?, url = coalesce(?, url) '
+             'WHERE hash = ?', (size, time.time(), url, hash)).rowcount:
+          self.db.execute(
+            'INSERT INTO files (hash, size, atime, url) VALUES (?, ?, ?, ?)',
+            (hash, size, time.time(), url))
+    finally:
+      self.lock.release()
+
+  def touch(self, hash):
+    """
+    Note an access to the file hash.  Returns False if it is not in the
+    index; the caller should add() it.
+    """
+    self.lock.acquire()
+    try:
+      if hash not in self.pending and not self.db.execute(
+           'SELECT 1 FROM files WHERE hash = ?', (hash,)).fetchone():
+        return False
+      self.pending[hash] = time.time()
+      if time.time() - self.flushed >= FLUSH_INTERVAL:
+        self._flush()
+      return True
+    finally:
+      self.lock.release()
+
+  def remove(self, hash):
+    self.lock.acquire()
+    try:
+      self.pending.pop(hash, None)
+      with self.db:
+        self.db.execute('DELETE FROM files WHERE hash = ?', (hash,))
+    finally:
+      self.lock.release()
+
+  def oldest(self, count):
+    "Return (hash, size) of up to count files, least recently accessed first"
+    self.lock.acquire()
+    try:
+      self._flush()
+      return self.db.execute(
+        'SELECT hash, size FROM files ORDER BY atime LIMIT ?',
+        (count,)).fetchall()
+    finally:
+      self.lock.release()
+
+  def flush(self):
+    "Write access times kept in memory to the index"
+    self.lock.acquire()
+    try:
+      self._flush()
+    finally:
+      self.lock.release()
+
+  def _flush(self):
+    self.flushed = time.time()
+    if not self.pending: return
+    pending, self.pending = self.pending, {}
+    try:
+      with self.db:
+        self.db.executemany(
+          'UPDATE files SET atime = ? WHERE hash = ? AND atime < ?',
+          [ (atime, hash, atime) for hash, atime in pending.items() ])
+    except sqlite3.Error:
+      pass # access times are advisory; don't fail a run over them
+
+
+INDEXES = [] # open CacheIndexes, flushed at exit
+
+def open_index(dir):
+  "Return a CacheIndex for the cache in dir"
+  index = CacheIndex(dir)
+  INDEXES.append(index)
+  return index
+
+def flush_indexes():
+  for index in INDEXES:
+    index.flush()
+
+atexit.register(flush_indexes)
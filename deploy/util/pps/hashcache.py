@@ -0,0 +1,161 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+hashcache.py
+
+Persistent cache of local file digests
+
+Digests are stored by file name along with the file's device, inode, size,
+modification time and change time.  As long as all of these are unchanged,
+checksum() on a local path returns the stored digest without reading the
+file.  Digests of different types (sha1, sha256, md5, ...) are stored
+side by side.
+
+The cache is disabled until enable() is called; main.py enables it for each
+build and writes it out at the end.
+"""
+
+import cPickle
+import os
+import threading
+import time
+
+from deploy.util.pps.lib.digests import file_hexdigests, hashname
+
+CACHE = None # the enabled HashCache, if any
+
+MAX_AGE = 10 # writes after which entries that have not been used are dropped
+
+# files modified this recently (in seconds) may be modified again without
+# their mtime changing; their digests are not stored
+RACY_WINDOW = 2
+
+def enable(file):
+  "Enable the cache stored in file, reading it if necessary"
+  global CACHE
+  if CACHE is None or CACHE.file != file:
+    CACHE = HashCache(file)
+  return CACHE
+
+def disable():
+  global CACHE
+  CACHE = None
+
+def stat_key(st):
+  return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+
+
+class HashCache(object):
+  "Digests of local files, keyed by path and validated by stat results"
+  def __init__(self, file):
+    self.file = file
+    self.entries = {} # path: [stat key, {type: hexdigest}, generation]
+    self.generation = 0
+    self.dirty = False
+    self.lock = threading.Lock()
+    self.read()
+
+  def read(self):
+    self.entries = {}
+    self.generation = 0
+    try:
+      fo = open(self.file, 'rb')
+      try:
+        self.generation, self.entries = cPickle.load(fo)
+      finally:
+        fo.close()
+    except Exception:
+      # a missing or unreadable cache just means files are hashed again
+      self.entries = {}
+      self.generation = 0
+
+  def write(self):
+    if not self.dirty: return
+    self.lock.acquire()
+    try:
+      self.generation += 1
+      for path, entry in self.entries.items():
+        if entry[2] < self.generation - MAX_AGE:
+          del self.entries[path]
+      data = (self.generation, self.entries)
+      self.dirty = False
+    finally:
+      self.lock.release()
+
+    dirname = os.path.dirname(self.file)
+    if not os.path.isdir(dirname): os.makedirs(dirname)
+    tmp = '%s.%d.tmp' % (self.file, os.getpid())
+    fo = open(tmp, 'wb')
+    try:
+      cPickle.dump(data, fo, cPickle.HIGHEST_PROTOCOL)
+    finally:
+      fo.close()
+    os.chmod(tmp, 0600)
+    os.rename(tmp, self.file)
+
+  def digest(self, path, type):
+    "Return the hex digest of the file at path, reading it only if necessary"
+    return self.digests(path, [type])[type]
+
+  def digests(self, path, types):
+    """
+    Return a dict of hex digests of the file at path by type.  Digests not in
+    the cache are computed together in a single read of the file.
+    """
+    path = os.path.abspath(path)
+    start = time.time()
+    key = stat_key(os.stat(path))
+    names = dict([ (type, hashname(type)) for type in types ])
+
+    self.lock.acquire()
+    try:
+      entry = self.entries.get(path)
+      if entry and entry[0] == key:
+        known = entry[1]
+        entry[2] = self.generation
+        self.dirty = True
+      else:
+        known = {}
+      missing = [ name for name in set(names.values()) if name not in known ]
+      if not missing:
+        return dict([ (type, known[name]) for type, name in names.items() ])
+      known = known.copy()
+    finally:
+      self.lock.release()
+
+    computed = file_hexdigests(path, missing)
+    known.update(computed)
+    csums = dict([ (type, known[name]) for type, name in names.items() ])
+
+    # don't store digests of files that changed while they were read, or that
+    # could change again without changing their stat results
+    if stat_key(os.stat(path)) != key or key[3] > start - RACY_WINDOW:
+      return csums
+
+    self.lock.acquire()
+    try:
+      entry = self.entries.get(path)
+      if entry and entry[0] == key:
+        entry[1].update(computed)
+        entry[2] = self.generation
+      else:
+        self.entries[path] = [key, computed, self.generation]
+      self.dirty = True
+    finally:
+      self.lock.release()
+    return csums
@@ -101,6 +101,103 @@ def cached(name=None, set=False, globally=False):
 
   return new
 
+def clear_caches():
+  """
+  Forget the state of remote locations gathered in this process: cached
+  stat results, http stat and listing memos, and mirror groups (including
+  mirrors disabled after errors).  Processes that run several builds, such
+  as deploy/daemon.py, call this before each one so that changes to remote
+  files are seen.
+  """
+  from deploy.util.pps.Path          import mirror
+  from deploy.util.pps.Path.http     import path_walk
+  from deploy.util.pps.PathStat.http import LISTED, STATS
+
+  CACHE.clear()
+  STATS.clear()
+  LISTED.clear()
+  path_walk.LISTINGS.clear()
+  mirror.mgcache.clear()
+
+def _fill_cache(path, csh, io_obj, callback, kwargs):
+  "Copy path to the cached file csh, via a partial file"
+  from deploy.util.pps.lib import partial, segmented
+
+  csh.dirname.mkdirs()
+  if callback and hasattr(callback, '_notify_cache'):
+    callback._notify_cache()
+
+  # readers never see a partial file, as it appears only when complete;
+  # http downloads resume from an interrupted partial file, see partial.py
+  part = partial.partfile(csh)
+
+  # the file is hashed as it is downloaded if a checksum is expected
+  digests = expected_digests(path)
+
+  try:
+    # large files may be downloaded in parts, unless a download of the whole
+    # file can be resumed
+    if (not partial.resumable(path, part) and
+        segmented.fill(path, part, callback=callback)):
+      path.copystat(part)
+      if digests is not None: # parts arrive out of order; hash the result
+        fo = open(part, 'rb')
+        try:
+          digests.updatefile(fo)
+        finally:
+          fo.close()
+    elif partial.fill(path, part, callback=callback, digests=digests):
+      path.copystat(part)
+    else:
+      partial.clear(part)
+      csh_kwargs = kwargs.copy()
+      csh_kwargs['dst'] = part
+      csh_kwargs['link'] = False
+      csh_kwargs['mirror'] = True
+      csh_kwargs['preserve'] = True
+      csh_kwargs['digests'] = digests
+      io_obj._copy(path, **csh_kwargs)
+    verify_checksum(path, part, digests)
+    part.rename(csh)
+    partial.infofile(part).rm(force=True)
+  except Exception as e:
+    if isinstance(e, PathError):
+      if (path.cache_handler.offline and  
+          e.errno == errno.ENOENT): # file not found
+        e = OfflinePathError(path, strerror="unable to copy file in "
+                                            "offline mode")
+    # keep a partial download that can be resumed, unless the file is gone
+    if (not partial.resumable(path, part) or
+        (isinstance(e, PathError) and e.errno == errno.ENOENT)):
+      partial.clear(part)
+    raise e
+
+def expected_digests(path):
+  """
+  Return a Digests object to hash a copy of path with, if a checksum is
+  expected for it, or None
+  """
+  from deploy.util.pps.lib.digests import Digests
+
+  expected = path.expected_checksum()
+  if expected is None: return None
+  return Digests([expected[0]])
+
+def verify_checksum(path, copy, digests):
+  """
+  Check copy, a file whose contents digests was updated with while copying
+  path, against the checksum expected for path.  digests is None if there
+  is no expected checksum.  On a mismatch, copy is removed.
+  """
+  if digests is None: return
+  type, checksum = path.expected_checksum()
+  got = digests.hexdigests()[type]
+  if got != checksum:
+    copy.rm(force=True)
+    raise PathError(errno.EIO, path,
+          strerror="checksum mismatch: expected %s %s, got %s" %
+                   (type, checksum, got))
+
 def file_cache():
   @decorator
   def new(meth, self, *args, **kwargs):
@@ -116,29 +213,24 @@ def file_cache():
     try: callback = kwargs['callback']
     except KeyError: callback = None
 
-    if self.cache_handler.force: csh.rm(force=True)
-    if self._mirrorfn(csh): csh.remove()
-
-    if not csh.exists():
-      csh.dirname.mkdirs()
-      if callback and hasattr(callback, '_notify_cache'):
-        callback._notify_cache()
-        
-      csh_kwargs = kwargs.copy()
-      csh_kwargs['dst'] = csh
-      csh_kwargs['link'] = False
-      csh_kwargs['mirror'] = True
-      csh_kwargs['preserve'] = True
+    stale = self.cache_handler.force or self._mirrorfn(csh)
+    filled = False
+    if stale or not csh.exists():
+      # other processes may share the cache; hold the file's lock while
+      # updating it, so that concurrent requests wait for a single download
+      lock = self.cache_handler.lock(csh).acquire()
       try:
-        io_obj._copy(self, **csh_kwargs)
-      except Exception as e:
-        if isinstance(e, PathError):
-          if (self.cache_handler.offline and  
-              e.errno == errno.ENOENT): # file not found
-            e = OfflinePathError(self, strerror="unable to copy file in "
-                                                "offline mode")
-        csh.rm(force=True)
-        raise e
+        # check again, another process may have updated the file meanwhile
+        if stale and (self.cache_handler.force or self._mirrorfn(csh)):
+          csh.rm(force=True)
+        if not csh.exists():
+          _fill_cache(self, csh, io_obj, callback, kwargs)
+          filled = True
+      finally:
+        lock.release()
+
+    if filled: self.cache_handler.add(csh, url=self)
+    else:      self.cache_handler.touch(csh, url=self)
 
     result = meth(self, *args, **kwargs)
 
@@ -0,0 +1,102 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+digests.py
+
+Computes digests of several types in a single pass over the data
+
+  d = Digests(['sha1', 'sha256'])
+  d.updatefile(fo)   # or d.update(buf) as data arrives
+  d.hexdigests()     # {'sha1': '...', 'sha256': '...'}
+
+A Digests object can be passed to Path.copyfile() as digests= to hash a file
+while it is being copied.
+"""
+
+import hashlib
+import mmap
+
+BUFSIZE = 1024*1024 # bytes hashed at a time
+
+def hashname(type):
+  "Return the hashlib name for a checksum type; 'sha' means sha1"
+  if type == 'sha': return 'sha1'
+  return type
+
+HASHTYPES = { 32: 'md5', 40: 'sha1', 56: 'sha224', 64: 'sha256',
+              96: 'sha384', 128: 'sha512' } # by length of hex digest
+
+def hashtype(hexdigest):
+  "Return the checksum type of hexdigest, judged by its length, or None"
+  return HASHTYPES.get(len(hexdigest))
+
+class Digests(object):
+  def __init__(self, types):
+    self.types = list(types)
+    self.reset()
+
+  def reset(self):
+    "Discard the data seen so far, e.g. before retrying a failed copy"
+    self.hashes = {}
+    for type in self.types:
+      self.hashes[type] = hashlib.new(hashname(type))
+
+  def update(self, buf):
+    for h in self.hashes.values():
+      h.update(buf)
+
+  def updatefile(self, fo, bufsize=BUFSIZE):
+    """
+    Update with the contents of the open file object fo.  Local files are
+    mapped into memory and hashed in place, regardless of the current
+    position of fo; other file objects are read from their current position.
+    """
+    if isinstance(fo, file):
+      try:
+        m = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+      except (mmap.error, ValueError, EnvironmentError):
+        m = None # empty or unmappable file
+      if m is not None:
+        try:
+          for offset in xrange(0, len(m), bufsize):
+            self.update(buffer(m, offset, bufsize))
+        finally:
+          m.close()
+        return
+      fo.seek(0)
+
+    while True:
+      buf = fo.read(bufsize)
+      if not buf: break
+      self.update(buf)
+
+  def digests(self):
+    return dict([ (type, h.digest()) for type, h in self.hashes.items() ])
+
+  def hexdigests(self):
+    return dict([ (type, h.hexdigest()) for type, h in self.hashes.items() ])
+
+def file_hexdigests(file, types):
+  "Return a dict of hex digests of the local file at file, by type"
+  d = Digests(types)
+  fo = open(file, 'rb')
+  try:
+    d.updatefile(fo)
+  finally:
+    fo.close()
+  return d.hexdigests()
@@ -24,20 +24,13 @@
 import copy
 import httplib
 import socket
-import string
 import ssl
 import time
 import urllib2
 import urlparse
 
 from __init__ import raw_throttle
-
-try:
-  from urlgrabber.keepalive import HTTPHandler, HTTPSHandler
-except ImportError, msg:
-  keepalive_handlers = ()
-else:
-  keepalive_handlers = (HTTPHandler(), HTTPSHandler())
+from httppool import PooledHandlerMixin, PooledHTTPHandler, PooledHTTPSHandler
 
 try:
   # add in range support conditionally too
@@ -51,6 +44,12 @@ except ImportError, msg:
 else:
   range_handlers = (HTTPRangeHandler(), HTTPSRangeHandler())
 
+READSIZE = 256*1024 # bytes requested from the server per read
+
+# unread data is moved to the front of the read buffer once at least this
+# much has been consumed and it makes up more than half the buffer
+COMPACT_SIZE = 1024*1024
+
 # global settings for pps
 httpfo_params = dict(
   retries     = 5,
@@ -69,20 +68,25 @@ auth_handler = urllib2.HTTPBasicAuthHandler(
                  urllib2.HTTPPasswordMgrWithDefaultRealm()
                )
 
-class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
+class HTTPSClientAuthHandler(PooledHandlerMixin, urllib2.HTTPSHandler):
   def __init__(self, key=None, cert=None, ca_certs=None, ssl_version=None, 
-               ciphers=None):
+               ciphers=None, pooled=False):
     urllib2.HTTPSHandler.__init__(self)
     self.key = key
     self.cert = cert
     self.ca_certs = ca_certs
     self.ssl_version = ssl_version
     self.ciphers = ciphers
+    self.pooled = pooled
 
   def https_open(self, req):
     # Rather than pass in a reference to a connection class, we pass in
     # a reference to a function which, for all intents and purposes,
     # will behave as a constructor
+    if self.pooled:
+      return self.pooled_open(self.getConnection,
+                              ('https', self.key, self.cert, self.ca_certs),
+                              req)
     return self.do_open(self.getConnection, req)
 
   def getConnection(self, host, timeout=300):
@@ -152,11 +156,38 @@ class HttpSyncRedirectHandler(urllib2.HTTPRedirectHandler):
 
   http_error_302 = http_error_301
 
+  def redirect_request(self, req, fp, code, msg, headers, newurl):
+    "keep the request method when following redirects of HEAD requests"
+    new = urllib2.HTTPRedirectHandler.redirect_request(
+      self, req, fp, code, msg, headers, newurl)
+    if new is not None and req.get_method() == 'HEAD':
+      new = HttpRequest(new.get_full_url(), method='HEAD',
+                        headers=new.headers,
+                        origin_req_host=new.get_origin_req_host(),
+                        unverifiable=True)
+    return new
+
+
+class HttpRequest(urllib2.Request):
+  "urllib2 Request that can use methods other than GET and POST, e.g. HEAD"
+  def __init__(self, url, method=None, **kwargs):
+    urllib2.Request.__init__(self, url, **kwargs)
+    self.method = method
+
+  def get_method(self):
+    return self.method or urllib2.Request.get_method(self)
+
 
 class HttpFileObject:
-  def __init__(self, url, opener=None, range=None, headers=None, **kwargs):
+  def __init__(self, url, opener=None, range=None, headers=None, method=None,
+                     **kwargs):
+    """
+    method, if given, is the request method to use instead of GET; for
+    example, a HEAD request gets the headers of url without its content.
+    """
     self._url = url
     self.url,_ = _urlparse(url)
+    self.method = method
 
     foargs = copy.copy(httpfo_params)
     foargs.update(kwargs)
@@ -173,8 +204,9 @@ class HttpFileObject:
 
     self.fo = None
     self._pos = None
-    self._rbuf = ''
-    self._rbufsize = 1024*8
+    self._rbuf = bytearray() # data read from the server but not yet returned
+    self._rstart = 0         # offset of the first unreturned byte in _rbuf
+    self._rbufsize = READSIZE
     self._ttime = time.time()
     self._tsize = 0
     self._opener = opener
@@ -191,28 +223,32 @@ class HttpFileObject:
 
   def read(self, amt=None):
     if amt and amt < 0: amt = None
+    if amt is not None and not self._buffered():
+      # nothing buffered; return data from the server without copying it
+      return self._retry(self._retry_read, amt)
+
     self._retry(self._retry_fill_buffer, amt)
+    return self._consume(amt)
 
-    if amt is None:
-      s, self._rbuf = self._rbuf, ''
-    else:
-      s, self._rbuf = self._rbuf[:amt], self._rbuf[amt:]
-    return s
+  def readinto(self, b):
+    "Read up to len(b) bytes into the writable buffer b; return the count"
+    data = self.read(len(b))
+    memoryview(b)[:len(data)] = data
+    return len(data)
 
   def readline(self, limit=-1):
-    i = string.find(self._rbuf, '\n')
-    while i < 0 and not (0 < limit <= len(self._rbuf)):
+    i = self._rbuf.find('\n', self._rstart)
+    while i < 0 and not (0 < limit <= self._buffered()):
       L = len(self._rbuf)
-      self._retry(self._retry_fill_buffer, L + self._rbufsize)
+      self._retry(self._retry_fill_buffer, self._buffered() + self._rbufsize)
       if not len(self._rbuf) > L: break
-      i = string.find(self._rbuf, '\n', L)
+      i = self._rbuf.find('\n', L)
 
-    if i < 0: i = len(self._rbuf)
-    else: i = i+1
-    if 0 <= limit < len(self._rbuf): i = limit
+    if i < 0: i = self._buffered()
+    else: i = i+1 - self._rstart
+    if 0 <= limit < self._buffered(): i = min(i, limit)
 
-    s, self._rbuf = self._rbuf[:i], self._rbuf[i:]
-    return s
+    return self._consume(i)
 
   def tell(self):
     return self._pos
@@ -248,30 +284,14 @@ class HttpFileObject:
       # break 2a (unexcepted error)
 
   def _get_opener(self):
-    "Build a urllib2 OpenerDirector based on request options."
+    "Get a urllib2 OpenerDirector based on request options."
     if self._opener is None:
-      handlers = []
-
-      if keepalive_handlers and self.keepalive:
-         handlers.extend(keepalive_handlers)
-      if range_handlers and self._range:
-         handlers.extend(range_handlers)
-
-      handlers.append(HttpSyncRedirectHandler())
-
-      if (getattr(self._url, 'ssl_client_key', None) or 
-          getattr(self._url, 'ssl_client_cert', None) or 
-          getattr(self._url, 'ssl_ca_certs', None)):
-        handlers.append( HTTPSClientAuthHandler(
-                         key = self._url.ssl_client_key,
-                         cert = self._url.ssl_client_cert,
-                         ca_certs = self._url.ssl_ca_certs,
-                         ssl_version = ssl.PROTOCOL_TLSv1,
-                          ) )
-      else:
-        handlers.append(auth_handler)
-
-      self._opener = urllib2.build_opener(*handlers)
+      self._opener = get_opener(
+        keepalive = self.keepalive,
+        ranges    = bool(self._range),
+        key       = getattr(self._url, 'ssl_client_key', None),
+        cert      = getattr(self._url, 'ssl_client_cert', None),
+        ca_certs  = getattr(self._url, 'ssl_ca_certs', None))
     return self._opener
 
   def _do_open(self, seek=None):
@@ -279,7 +299,7 @@ class HttpFileObject:
     object represents"""
     opener = self._get_opener()
 
-    req = urllib2.Request(self.url.__str__()) # build request object
+    req = HttpRequest(self.url.__str__(), method=self.method) # build request
     self._build_range(req, seek) # take care of byterange stuff
     for k,v in self.http_headers:
       req.add_header(k,v)
@@ -336,62 +356,81 @@ class HttpFileObject:
     else:
       return (fo, hdr)
 
+  def _buffered(self):
+    "number of bytes in the buffer that have not been returned yet"
+    return len(self._rbuf) - self._rstart
+
+  def _consume(self, amt=None):
+    "return and remove up to 'amt' bytes from the front of the buffer"
+    if amt is None or amt >= self._buffered():
+      s = str(buffer(self._rbuf, self._rstart))
+      del self._rbuf[:]
+      self._rstart = 0
+      return s
+
+    s = str(buffer(self._rbuf, self._rstart, amt))
+    self._rstart += amt
+    if self._rstart >= COMPACT_SIZE and self._rstart*2 > len(self._rbuf):
+      del self._rbuf[:self._rstart]
+      self._rstart = 0
+    return s
+
   def _fill_buffer(self, amt=None):
     """fill the buffer to contain at least 'amt' bytes by reading
     from the underlying file object.  If amt is None, then it will
     read until it gets nothing more."""
-    # the _rbuf test is only in this first 'if' for speed.  It's not
-    # logically necessary
-    if self._rbuf and amt is not None:
-      L = len(self._rbuf)
-      if amt > L:
-        amt = amt - L
-      else:
-        return
+    if amt is not None:
+      amt = amt - self._buffered()
+      if amt <= 0: return
 
     # if we've made it here, then we don't have enough in the buffer
     # and we need to read more.
-
-    buf = [self._rbuf]
-    bufsize = len(self._rbuf)
-    while amt is None or amt:
-      # first, delay if necessary for throttling reasons
-      t = raw_throttle(self.throttle, self.bandwidth)
-      if t:
-        diff = self._tsize/t - (time.time() - self._ttime)
-        if diff > 0: time.sleep(diff)
-        self._ttime = time.time()
-
-      # now read some data, up to self._rbufsize
+    while amt is None or amt > 0:
+      # read some data, up to self._rbufsize
       if amt is None: readamount = self._rbufsize
       else:           readamount = min(amt, self._rbufsize)
 
-      try:
-        new = self.fo.read(readamount)
-      except socket.timeout, e:
-        raise HttpFileObjectError(12, 'Timeout: %s' % e)
-      except socket.error, e:
-        raise HttpFileObjectError(4, 'Socket Error: %s' % e)
-      except IOError, e:
-        raise HttpFileObjectError(4, 'IOError: %s' % e)
-      newsize = len(new)
-      if not newsize: break # no more to read
+      new = self._read(readamount)
+      if not new: break # no more to read
 
-      self._pos += newsize
-      if amt: amt = amt - newsize
-      buf.append(new)
-      bufsize = bufsize + newsize
-      self._tsize = newsize
+      if amt: amt = amt - len(new)
+      self._rbuf.extend(new)
+
+  def _read(self, amt):
+    "read up to 'amt' bytes from the underlying file object"
+    # first, delay if necessary for throttling reasons
+    t = raw_throttle(self.throttle, self.bandwidth)
+    if t:
+      diff = self._tsize/t - (time.time() - self._ttime)
+      if diff > 0: time.sleep(diff)
+      self._ttime = time.time()
+
+    try:
+      new = self.fo.read(amt)
+    except socket.timeout, e:
+      raise HttpFileObjectError(12, 'Timeout: %s' % e)
+    except socket.error, e:
+      raise HttpFileObjectError(4, 'Socket Error: %s' % e)
+    except IOError, e:
+      raise HttpFileObjectError(4, 'IOError: %s' % e)
 
-    self._rbuf = string.join(buf, '')
+    self._pos += len(new)
+    self._tsize = len(new)
+    return new
 
   def _retry_fill_buffer(self, amt=None):
+    return self._reopen_on_timeout(self._fill_buffer, amt)
+
+  def _retry_read(self, amt):
+    return self._reopen_on_timeout(self._read, amt)
+
+  def _reopen_on_timeout(self, func, *args):
     old_to = socket.getdefaulttimeout()
     if self.timeout:
       socket.setdefaulttimeout(self.timeout)
     try:
       try:
-        self._fill_buffer(amt)
+        return func(*args)
       except HttpFileObjectError, e:
         if e.errno == 12: # timeout
           self.close()
@@ -401,6 +440,42 @@ class HttpFileObject:
       socket.setdefaulttimeout(old_to)
 
 
+_openers = {} # (keepalive, ranges, key, cert, ca_certs): OpenerDirector
+
+def get_opener(keepalive=True, ranges=False, key=None, cert=None,
+               ca_certs=None):
+  """
+  Return a urllib2 OpenerDirector for the given request options.  Openers
+  are shared by all file objects with the same options; with keepalive, they
+  send requests over the persistent connections in httppool.
+  """
+  options = (bool(keepalive), bool(ranges and range_handlers), key, cert,
+             ca_certs)
+  if options not in _openers:
+    handlers = []
+
+    if range_handlers and ranges:
+       handlers.extend(range_handlers)
+
+    handlers.append(HttpSyncRedirectHandler())
+
+    if key or cert or ca_certs:
+      handlers.append( HTTPSClientAuthHandler(
+                       key = key,
+                       cert = cert,
+                       ca_certs = ca_certs,
+                       ssl_version = ssl.PROTOCOL_TLSv1,
+                       pooled = keepalive,
+                        ) )
+      if keepalive: handlers.append(PooledHTTPHandler())
+    else:
+      if keepalive: handlers.extend([PooledHTTPHandler(), PooledHTTPSHandler()])
+      handlers.append(auth_handler)
+
+    _openers.setdefault(options, urllib2.build_opener(*handlers))
+  return _openers[options]
+
+
 class HttpFileObjectError(IOError):
   """
   HttpFileObjectError error codes:
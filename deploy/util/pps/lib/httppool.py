@@ -0,0 +1,263 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+httppool.py
+
+Process-wide pool of persistent HTTP and HTTPS connections
+
+Connections are pooled by (scheme, host, port, tunnel host, client key,
+client cert, ca certs).  When a response has been read to the end (or
+closed with only a little data left unread), its connection goes back to the
+pool and the next request to the same server reuses it, skipping the TCP
+connect and, for https, the TLS handshake.  Idle connections are closed
+after pool_params['idle_timeout'] seconds, and at most
+pool_params['maxsize'] idle connections are kept per server.
+
+The handlers below plug the pool into urllib2; lib/http.py uses them for all
+pps http and https paths.
+"""
+
+import httplib
+import socket
+import threading
+import time
+import urllib2
+
+# global settings for the pool
+pool_params = dict(
+  maxsize      = 8,    # idle connections kept per server
+  idle_timeout = 30.0, # seconds an idle connection is kept
+  drain_limit  = 64*1024, # max unread bytes read off a closed response so
+                          # its connection can be reused
+)
+
+class ConnectionPool(object):
+  "Idle connections to a single server"
+  def __init__(self, key):
+    self.key = key
+    self.idle = [] # [(connection, time released), ...], oldest first
+    self.lock = threading.Lock()
+
+  def get(self):
+    "Return the most recently released idle connection, or None"
+    cutoff = time.time() - pool_params['idle_timeout']
+    self.lock.acquire()
+    try:
+      stale = [ c for c, released in self.idle if released < cutoff ]
+      self.idle = [ (c, r) for c, r in self.idle if r >= cutoff ]
+      conn = None
+      if self.idle: conn = self.idle.pop()[0]
+    finally:
+      self.lock.release()
+    for c in stale:
+      c.close()
+    return conn
+
+  def put(self, conn):
+    self.lock.acquire()
+    try:
+      if len(self.idle) < pool_params['maxsize']:
+        self.idle.append((conn, time.time()))
+        return
+    finally:
+      self.lock.release()
+    conn.close()
+
+  def clear(self):
+    self.lock.acquire()
+    try:
+      idle, self.idle = self.idle, []
+    finally:
+      self.lock.release()
+    for c, released in idle:
+      c.close()
+
+
+POOLS = {} # key: ConnectionPool
+_pools_lock = threading.Lock()
+
+def get_pool(key):
+  _pools_lock.acquire()
+  try:
+    if key not in POOLS:
+      POOLS[key] = ConnectionPool(key)
+    return POOLS[key]
+  finally:
+    _pools_lock.release()
+
+def clear():
+  "Close all idle connections"
+  _pools_lock.acquire()
+  try:
+    pools = POOLS.values()
+  finally:
+    _pools_lock.release()
+  for pool in pools:
+    pool.clear()
+
+
+class PooledResponse(object):
+  """
+  File-like response for urllib2, in the manner of urllib2.addinfourl, that
+  returns its connection to the pool once the response has been read
+  """
+  def __init__(self, response, conn, pool, url):
+    self._response = response
+    self._conn = conn
+    self._pool = pool
+    self.url = url
+    self.headers = response.msg
+    self.code = response.status
+    self.msg = response.reason
+    if response.length == 0: response.close() # nothing to read
+    self._check_done()
+
+  def info(self):    return self.headers
+  def geturl(self):  return self.url
+  def getcode(self): return self.code
+  def fileno(self):  return self._conn.sock.fileno()
+
+  def read(self, amt=None):
+    if self._response is None: return ''
+    data = self._response.read(amt)
+    self._check_done()
+    return data
+
+  def readline(self, limit=-1):
+    """
+    Read a line.  Only error responses, which urllib2.HTTPError expects to
+    have this method, are read by line; it need not be fast.
+    """
+    line = []
+    while limit < 0 or len(line) < limit:
+      c = self.read(1)
+      if not c: break
+      line.append(c)
+      if c == '\n': break
+    return ''.join(line)
+
+  def close(self):
+    "Close the response, keeping the connection if it can be reused"
+    if self._response is None: return
+    length = self._response.length
+    if not self._response.isclosed() and length is not None and \
+       length <= pool_params['drain_limit'] and not self._response.will_close:
+      try:
+        self._response.read()
+      except (socket.error, httplib.HTTPException):
+        pass
+    if self._response.isclosed():
+      self._check_done()
+    else:
+      self.close_connection()
+
+  def close_connection(self):
+    "Close the response and its connection"
+    if self._response is not None:
+      self._response.close()
+      self._response = None
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def _check_done(self):
+    if self._response is None or not self._response.isclosed(): return
+    if self._response.will_close:
+      self._conn.close()
+    else:
+      self._pool.put(self._conn)
+    self._response = None
+    self._conn = None
+
+  def __del__(self):
+    if getattr(self, '_conn', None) is not None:
+      self.close_connection()
+
+
+class PooledHandlerMixin:
+  "Mixin for urllib2 handlers that open requests on pooled connections"
+  def pooled_open(self, factory, key, req):
+    """
+    Open req on a pooled connection to the server in key, creating one with
+    factory(host, timeout=timeout) if none are idle
+    """
+    host = req.get_host()
+    if not host:
+      raise urllib2.URLError('no host given')
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict((k, v) for k, v in req.headers.items()
+                        if k not in headers))
+    headers = dict((name.title(), val) for name, val in headers.items())
+    tunnel_headers = {}
+    if req._tunnel_host and 'Proxy-Authorization' in headers:
+      tunnel_headers['Proxy-Authorization'] = headers.pop('Proxy-Authorization')
+
+    timeout = req.timeout
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+      timeout = socket.getdefaulttimeout()
+
+    pool = get_pool((host, req._tunnel_host) + key)
+    conn = pool.get()
+    if conn is not None:
+      conn.timeout = timeout
+      if conn.sock: conn.sock.settimeout(timeout)
+      try:
+        return PooledResponse(self._send(conn, req, headers), conn, pool,
+                              req.get_full_url())
+      except socket.timeout, e:
+        conn.close()
+        raise urllib2.URLError(e)
+      except (socket.error, httplib.HTTPException):
+        # the server has closed the idle connection; use a new one
+        conn.close()
+
+    conn = factory(host, timeout=timeout)
+    if req._tunnel_host:
+      conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+    try:
+      response = self._send(conn, req, headers)
+    except socket.error, e:
+      conn.close()
+      raise urllib2.URLError(e)
+    except httplib.HTTPException:
+      conn.close()
+      raise
+    return PooledResponse(response, conn, pool, req.get_full_url())
+
+  def _send(self, conn, req, headers):
+    conn.request(req.get_method(), req.get_selector(), req.data, headers)
+    try:
+      return conn.getresponse(buffering=True)
+    except TypeError: # buffering kw not supported
+      return conn.getresponse()
+
+
+class PooledHTTPHandler(PooledHandlerMixin, urllib2.HTTPHandler):
+  def http_open(self, req):
+    return self.pooled_open(httplib.HTTPConnection, ('http',), req)
+
+class PooledHTTPSHandler(PooledHandlerMixin, urllib2.HTTPSHandler):
+  def https_open(self, req):
+    context = getattr(self, '_context', None)
+    if context is None:
+      factory = httplib.HTTPSConnection
+    else:
+      factory = lambda host, **kwargs: \
+        httplib.HTTPSConnection(host, context=context, **kwargs)
+    return self.pooled_open(factory, ('https',), req)
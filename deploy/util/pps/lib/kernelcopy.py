@@ -0,0 +1,127 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+kernelcopy.py
+
+Copy data between local files without passing it through python
+
+copy() tries, in order, a FICLONE reflink (shares extents on filesystems
+such as btrfs and XFS, so nothing is copied at all), copy_file_range(2) and
+sendfile(2).  Methods the kernel or filesystem does not support are skipped;
+if none are supported, copy() returns None and the caller should fall back to
+reading and writing the data itself.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import stat
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int)
+
+CHUNKSIZE = 8*1024*1024 # bytes per copy_file_range/sendfile call
+
+# errors meaning a method is not available for this pair of files
+UNSUPPORTED = set([errno.ENOSYS, errno.EINVAL, errno.EXDEV, errno.EOPNOTSUPP,
+                   errno.ENOTTY, errno.EPERM])
+
+def _load_libc():
+  try:
+    return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+  except OSError:
+    return None
+
+def _libc_function(libc, name, restype, argtypes):
+  fn = getattr(libc, name, None) # None if libc is too old
+  if fn is not None:
+    fn.restype = restype
+    fn.argtypes = argtypes
+  return fn
+
+_libc = _load_libc()
+if _libc is not None:
+  _copy_file_range = _libc_function(_libc, 'copy_file_range', ctypes.c_ssize_t,
+    [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+     ctypes.c_size_t, ctypes.c_uint])
+  _sendfile = _libc_function(_libc, 'sendfile', ctypes.c_ssize_t,
+    [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t])
+else:
+  _copy_file_range = _sendfile = None
+
+def copy(fsrc, fdst, callback=None):
+  """
+  Copy the contents of open file fsrc to open file fdst, both of which must
+  be positioned at the start of the file.  Returns the number of bytes
+  copied, or None if no kernel copy method is available, in which case both
+  files are left as they were.  Reports progress to callback._cp_update().
+  """
+  st = os.fstat(fsrc.fileno())
+  if not stat.S_ISREG(st.st_mode):
+    return None
+  size = st.st_size
+  fdst.flush()
+
+  for method in [_clone, _copy_file_range_loop, _sendfile_loop]:
+    try:
+      read = method(fsrc.fileno(), fdst.fileno(), size, callback)
+    except OSError, e:
+      if e.errno not in UNSUPPORTED: raise
+      read = None
+    if read is not None:
+      return float(read)
+    _rewind(fsrc, fdst) # discard any partial copy before the next method
+
+  return None
+
+def _rewind(fsrc, fdst):
+  fsrc.seek(0)
+  os.lseek(fsrc.fileno(), 0, os.SEEK_SET)
+  fdst.seek(0)
+  fdst.truncate()
+  os.lseek(fdst.fileno(), 0, os.SEEK_SET)
+
+def _clone(src, dst, size, callback):
+  try:
+    fcntl.ioctl(dst, FICLONE, src)
+  except IOError, e:
+    raise OSError(e.errno, e.strerror)
+  if callback: callback._cp_update(float(size))
+  return size
+
+def _copy_file_range_loop(src, dst, size, callback):
+  if _copy_file_range is None: return None
+  return _loop(lambda n: _copy_file_range(src, None, dst, None, n, 0),
+               size, callback)
+
+def _sendfile_loop(src, dst, size, callback):
+  if _sendfile is None: return None
+  return _loop(lambda n: _sendfile(dst, src, None, n), size, callback)
+
+def _loop(fn, size, callback):
+  read = 0
+  while True:
+    n = fn(CHUNKSIZE)
+    if n < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    if n == 0: break # end of file
+    read += n
+    if callback: callback._cp_update(float(read))
+  return read
@@ -15,8 +15,27 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
-
+"""
+mirror.py
+
+Mirror groups and the trymirrors decorator used by pps mirror paths
+
+A MirrorGroup ranks its mirrors by how quickly they are expected to serve a
+file, using the latency of opening files on each mirror and the throughput of
+reading them.  Scores are kept per mirror url in a MirrorScores object shared
+by all groups using the same cache dir, and saved to a file in the cache dir
+so later runs start from them.  Scores lose half their weight every
+mirror_params['halflife'] seconds, so mirrors that were slow or failing are
+tried again eventually.  If mirror_params['probe'] is set, groups measure the
+latency of all their mirrors in parallel when they are created.
+"""
+
+import atexit
+import cPickle
 import errno
+import Queue
+import threading
+import time
 
 from math import ceil, log
 
@@ -34,6 +53,28 @@ from deploy.util.pps.Path.remote import RemotePath #!
 HOSTUNAVAIL = [ errno.ETIMEDOUT, errno.ECONNREFUSED,  # 110, 111
                 errno.EHOSTDOWN, errno.EHOSTUNREACH ] # 112, 113
 
+# error codes that count against a mirror's score: the above, plus dropped
+# connections, timeouts and 5xx responses.  Other errors, such as a file not
+# being found, say nothing about the health of the mirror.
+MIRRORFAILURES = HOSTUNAVAIL + [ errno.ECONNRESET, errno.ETIME,
+                                 errno.ECONNABORTED ] # 5xx responses
+
+# global settings for mirror ranking
+mirror_params = dict(
+  probe         = False, # probe all mirrors' latency when a group is created
+  probe_jobs    = 8,     # number of mirrors probed at once
+  halflife      = 7*24*60*60, # seconds for scores to lose half their weight
+  ranksize      = 1024*1024,  # size, in bytes, of the transfer mirrors are
+                              # ranked for; larger sizes favor throughput
+                              # over latency
+  failure_cost  = 10.0,  # seconds added to a mirror's cost per failure
+  min_sample    = 64*1024, # fewest bytes read that give a throughput sample
+  save_interval = 60,      # minimum seconds between saves of the score file
+)
+
+SCORE_FILE = '.mirror-scores' # in the cache dir
+ALPHA = 0.3 # weight of a new sample against a current score
+
 # decorator for mirroring
 def trymirrors(meth):
   # meth should raise ContinueIteration to try the next mirror or
@@ -49,8 +90,12 @@ def trymirrors(meth):
         mi = self.mirrorgroup.next()
         try:
           try:
-            return meth(self, mi//self.path, *args, **kwargs)
+            start = time.time()
+            result = meth(self, mi//self.path, *args, **kwargs)
+            return self.mirrorgroup.record(mi, start, result)
           except PathError, e:
+            if is_failure(e):
+              self.mirrorgroup.scores.record(mi, failure=True)
             if e.errno in HOSTUNAVAIL and len(self.mirrorgroup) > 1:
               self.mirrorgroup.disable_mirror() # disable failed mirror
               continue
@@ -63,6 +108,7 @@ def trymirrors(meth):
               continue
         except ContinueIteration, e:
           if e.err:
+            self.mirrorgroup.scores.record(mi, failure=True)
             self.mirrorgroup.disable_mirror() # disable failed mirror
           continue
         except StopIteration:
@@ -75,8 +121,16 @@ def trymirrors(meth):
 
   return new
 
+def is_failure(e):
+  """
+  Return True if the exception e, raised getting a file from a mirror,
+  should count against the mirror's score.  Errors other than PathErrors are
+  raised by the connection itself, and always count.
+  """
+  return not isinstance(e, PathError) or e.errno in MIRRORFAILURES
+
 class MirrorGroup(list):
-  def __init__(self, iterable):
+  def __init__(self, iterable, cache_handler=None):
     # create list, filtering out unsupported items
     list.__init__(self, [ [deploy.util.pps.path(x), True] for x in 
                            filter(self._filter, iterable) ])
@@ -86,7 +140,16 @@ class MirrorGroup(list):
       if isinstance(mi, RemotePath): #!
         mi._foargs.update(dict(retries=1, timeout=5)) #!
 
-    self._current = -1 # index of current mirror
+    # mirrors may be tried from several threads at once; each iterates over
+    # the group separately
+    self._state = threading.local()
+
+    self.scores = get_scores(cache_handler)
+    self._order = range(len(self)) # indexes of mirrors, best first
+    self._ranked = None # scores generation _order was computed from
+
+    if mirror_params['probe'] and len(self) > 1:
+      self.probe()
 
   @classmethod
   def _filter(cls, item):
@@ -101,18 +164,103 @@ class MirrorGroup(list):
 
   def next(self):
     # subclass and override this method if different behavior is desired
-    self._current += 1
+    order = getattr(self._state, 'order', self._order)
+    self._pos += 1
 
-    while self._current < len(self):
-      mi, enabled = self[self._current]
+    while self._pos < len(order):
+      mi, enabled = self[order[self._pos]]
       if enabled:
+        self._current = order[self._pos]
         return mi
-      self._current += 1
+      self._pos += 1
 
     raise NoMoreMirrors()
 
   def reset(self):
-   self._current = -1
+    self._current = -1
+    self._pos = -1
+    self.rank()
+    self._state.order = self._order
+
+  # the current mirror and position in the ranked order, per thread
+  def _get_current(self): return getattr(self._state, 'current', -1)
+  def _set_current(self, i): self._state.current = i
+  _current = property(_get_current, _set_current)
+
+  def _get_pos(self): return getattr(self._state, 'pos', -1)
+  def _set_pos(self, i): self._state.pos = i
+  _pos = property(_get_pos, _set_pos)
+
+  def rank(self):
+    "Order mirrors by their expected time to serve a file, fastest first"
+    generation = self.scores.generation
+    if self._ranked == generation: return
+    costs = self.scores.costs([ mi for mi, _ in self ])
+    # sort is stable; mirrors with equal costs keep mirrorlist order
+    self._order = sorted(range(len(self)), key=lambda i: costs[i])
+    self._ranked = generation
+
+  def ranked(self):
+    "Return the enabled mirrors, best first"
+    self.rank()
+    return [ self[i][0] for i in self._order if self[i][1] ]
+
+  def record(self, mi, start, result):
+    """
+    Record the speed of a successful call on mirror mi that started at
+    start, and return its result.  Opening a file gives a latency sample;
+    the file object is wrapped so that reading it gives a throughput sample.
+    Calls that read or copy data (read_text, read_lines, copyfile, cp) give
+    a throughput sample, or a latency sample if they moved little data.
+    Other calls may not have contacted the mirror at all, and are not
+    recorded.
+    """
+    elapsed = time.time() - start
+    if hasattr(result, 'read') and hasattr(result, 'close'):
+      self.scores.record(mi, latency=elapsed)
+      return MeteredFile(result, self.scores, mi)
+
+    if type(result) == str:     size = len(result)
+    elif type(result) == list:  size = sum([ len(l) for l in result ])
+    elif type(result) == float: size = result # bytes copied
+    else: return result
+    if size >= mirror_params['min_sample'] and elapsed > 0:
+      self.scores.record(mi, throughput=size/elapsed)
+    else:
+      self.scores.record(mi, latency=elapsed)
+    return result
+
+  def probe(self, jobs=None):
+    "Measure the latency of all mirrors, several at a time"
+    tasks = Queue.Queue()
+    for mi, _ in self:
+      tasks.put(mi)
+
+    def worker():
+      while True:
+        try:
+          mi = tasks.get_nowait()
+        except Queue.Empty:
+          return
+        start = time.time()
+        try:
+          mi.stat()
+        except Exception, e:
+          if is_failure(e):
+            self.scores.record(mi, failure=True)
+          else: # e.g. the mirror does not allow directory listings
+            self.scores.record(mi, latency=time.time()-start)
+        else:
+          self.scores.record(mi, latency=time.time()-start)
+
+    workers = []
+    for n in range(min(jobs or mirror_params['probe_jobs'], len(self))):
+      t = threading.Thread(target=worker, name='mirror-probe-%d' % n)
+      t.daemon = True
+      t.start()
+      workers.append(t)
+    for t in workers:
+      while t.isAlive(): t.join(0.5)
 
   def get_mirror(self, i=None):
     "Get the mirror at index i, or the current mirror if i is None"
@@ -134,6 +282,185 @@ class MirrorGroup(list):
     else:       self[i][1] = status
 
 
+class MeteredFile(object):
+  "File object wrapper that records the throughput of reads from a mirror"
+  def __init__(self, fo, scores, mirror):
+    self._fo = fo
+    self._scores = scores
+    self._mirror = mirror
+    self._read = 0
+    self._elapsed = 0.0
+
+  def __getattr__(self, name):
+    return getattr(self._fo, name)
+
+  def _metered(self, fn, *args):
+    start = time.time()
+    data = fn(*args)
+    self._elapsed += time.time() - start
+    self._read += len(data)
+    return data
+
+  def read(self, *args):     return self._metered(self._fo.read, *args)
+  def readline(self, *args): return self._metered(self._fo.readline, *args)
+
+  def close(self):
+    self._fo.close()
+    if self._read >= mirror_params['min_sample'] and self._elapsed > 0:
+      self._scores.record(self._mirror, throughput=self._read/self._elapsed)
+    self._read = 0
+
+
+class MirrorScores(object):
+  """
+  Latency, throughput and failure scores of mirrors, by url.  If file is
+  given, scores are loaded from it and saved back to it, merging with those
+  saved by other processes; filelock, a FileLock, serializes access to file.
+  """
+  def __init__(self, file=None, filelock=None):
+    self.file = file
+    self.filelock = filelock
+    self.scores = {} # url: {'latency', 'throughput', 'failures', 'time'}
+    self.generation = 0 # changes whenever scores change
+    self.lock = threading.Lock()
+    self.saved = time.time()
+    self.dirty = False
+    if self.file:
+      self.scores.update(self._load())
+
+  def weight(self, score, now=None):
+    "Return the weight, between 0 and 1, left to score after decay"
+    age = max((now or time.time()) - score['time'], 0)
+    return 0.5 ** (age / float(mirror_params['halflife']))
+
+  def record(self, url, latency=None, throughput=None, failure=False):
+    "Update the scores of url with a new sample"
+    now = time.time()
+    self.lock.acquire()
+    try:
+      score = self.scores.get(str(url))
+      if score is None:
+        score = dict(latency=None, throughput=None, failures=0.0, time=now)
+      w = self.weight(score, now)
+      # a new sample counts for more the older the current score is
+      alpha = 1 - (1 - ALPHA) * w
+      score = dict(score, failures=score['failures'] * w, time=now)
+      for key, value in [('latency', latency), ('throughput', throughput)]:
+        if value is None: continue
+        if score[key] is None: score[key] = value
+        else: score[key] += alpha * (value - score[key])
+      if failure:
+        score['failures'] += 1
+      elif score['failures']:
+        score['failures'] /= 2 # recovering
+      self.scores[str(url)] = score
+      self.generation += 1
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+    if now - self.saved >= mirror_params['save_interval']:
+      self.save()
+
+  def costs(self, urls):
+    """
+    Return the expected time, in seconds, each of urls takes to serve a
+    file of mirror_params['ranksize'] bytes, plus mirror_params['failure_cost']
+    for each recent failure.  Where a url's scores are missing or decayed,
+    the median of urls is used in their place; urls that have never been
+    measured cost nothing, so that each is tried.
+    """
+    now = time.time()
+    self.lock.acquire()
+    try:
+      scores = [ self.scores.get(str(url)) for url in urls ]
+    finally:
+      self.lock.release()
+
+    median = {}
+    for key in ['latency', 'throughput']:
+      values = sorted([ s[key] for s in scores if s and s[key] is not None ])
+      median[key] = values and values[len(values)//2] or None
+
+    costs = []
+    for s in scores:
+      if s is None:
+        costs.append(0.0)
+        continue
+      w = self.weight(s, now)
+      cost = s['failures'] * w * mirror_params['failure_cost']
+      if s['latency'] is not None or s['throughput'] is not None:
+        est = {}
+        for key in ['latency', 'throughput']:
+          if s[key] is None: est[key] = median[key]
+          elif median[key] is None: est[key] = s[key]
+          else: est[key] = w * s[key] + (1 - w) * median[key]
+        cost += est['latency'] or 0.0
+        if est['throughput']:
+          cost += mirror_params['ranksize'] / est['throughput']
+      costs.append(cost)
+    return costs
+
+  def save(self):
+    "Save scores to file, keeping newer scores saved by other processes"
+    if not self.file or not self.dirty: return
+    self.lock.acquire()
+    try:
+      self.saved = time.time()
+      self.dirty = False
+      try:
+        with self.filelock:
+          scores = self._load()
+          for url, score in self.scores.items():
+            if url not in scores or scores[url]['time'] <= score['time']:
+              scores[url] = score
+          tmp = self.file.dirname / '%s.tmp' % self.file.basename
+          fo = open(tmp, 'wb')
+          try:
+            cPickle.dump(scores, fo, cPickle.HIGHEST_PROTOCOL)
+          finally:
+            fo.close()
+          tmp.rename(self.file)
+      except (EnvironmentError, PathError):
+        pass # scores are advisory; don't fail a run over them
+    finally:
+      self.lock.release()
+
+  def _load(self):
+    try:
+      fo = open(self.file, 'rb')
+      try:
+        return cPickle.load(fo)
+      finally:
+        fo.close()
+    except Exception:
+      return {} # missing or unreadable
+
+SCORES = {} # cache dir: MirrorScores
+_scores_lock = threading.Lock()
+
+def get_scores(cache_handler=None):
+  "Return the MirrorScores shared by groups using cache_handler"
+  key = cache_handler and str(cache_handler.cache_dir)
+  _scores_lock.acquire()
+  try:
+    if key not in SCORES:
+      if cache_handler:
+        file = cache_handler.cache_dir / SCORE_FILE
+        SCORES[key] = MirrorScores(file, cache_handler.lock(file))
+      else:
+        SCORES[key] = MirrorScores()
+    return SCORES[key]
+  finally:
+    _scores_lock.release()
+
+def save_scores():
+  for scores in SCORES.values():
+    scores.save()
+
+atexit.register(save_scores)
+
+
 def validate_mirrorlist(lines):
   # validate mirrorlist to ensure its in the correct format
 
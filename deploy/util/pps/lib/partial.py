@@ -0,0 +1,191 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+partial.py
+
+Resumable downloads of http files into the cache
+
+fill() downloads a file to a '.part' file next to its cache location.  A
+sidecar file, '<part>.info', records the url, ETag, Last-Modified and size
+of the download.  When a download is interrupted, the partial file and its
+sidecar are kept; the next fill of the same url, whether a retry in this run
+or in a later one, requests only the rest of the file using Range and
+If-Range headers.  If the file has changed on the server since, the server
+sends the whole file instead and the download starts over.  Mirror paths
+are downloaded from their http mirrors directly, bypassing the mirrors' own
+cache entries.
+"""
+
+import cPickle
+import errno
+import httplib
+
+from deploy.util.pps.lib.http import range_handlers
+from deploy.util.pps.lib.mirror import is_failure
+from deploy.util.pps.lib.segmented import http_sources
+from deploy.util.pps.Path.error import PathError
+from deploy.util.pps.Path.path_io import copyfileobj
+
+RETRIES = 3 # times an interrupted download is resumed within one fill()
+
+def partfile(csh):
+  "Return the partial file used while downloading the cached file csh"
+  return csh.dirname / '.%s.part' % csh.basename
+
+def infofile(part):
+  "Return the sidecar file describing the partial file part"
+  return part.dirname / '%s.info' % part.basename
+
+def load_info(part):
+  "Return the sidecar dict for part, or None if there is none"
+  try:
+    fo = open(infofile(part), 'rb')
+    try:
+      return cPickle.load(fo)
+    finally:
+      fo.close()
+  except Exception:
+    return None # missing or unreadable
+
+def save_info(part, info):
+  fo = open(infofile(part), 'wb')
+  try:
+    cPickle.dump(info, fo, cPickle.HIGHEST_PROTOCOL)
+  finally:
+    fo.close()
+
+def clear(part):
+  "Remove part and its sidecar"
+  part.rm(force=True)
+  infofile(part).rm(force=True)
+
+def validator(info):
+  """
+  Return the value for an If-Range header matching the download described by
+  info, or None if it has no usable validator.  Weak ETags may not be used
+  in If-Range, so fall back to Last-Modified.
+  """
+  etag = info.get('etag')
+  if etag and not etag.startswith('W/'):
+    return etag
+  return info.get('last-modified')
+
+def resumable(path, part):
+  "Return the offset at which a download of path to part can resume, or 0"
+  if not range_handlers or not part.exists():
+    return 0
+  info = load_info(part)
+  if not info or info.get('url') != str(path) or not validator(info):
+    return 0
+  offset = part.stat().st_size
+  if info.get('size') is not None and offset >= info['size']:
+    return 0 # nothing left to request; the file cannot be checked, refetch
+  return offset
+
+def fill(path, part, callback=None, digests=None):
+  """
+  Download path to part, resuming an earlier partial download of the same
+  url if the server supports it.  Returns False, having read nothing, if path
+  is neither an http location nor a mirror path with http mirrors; the caller
+  should copy it some other way.  Mirror paths are downloaded from their best
+  ranked http mirror, falling back to the others in turn.  On error, part and
+  its sidecar are left in place to be resumed later.  If digests, a Digests
+  object, is given, it is updated with the complete contents of part.
+  """
+  sources = http_sources(path)
+  if not sources:
+    return False
+  for i, (mi, src) in enumerate(sources):
+    try:
+      _fill_from(path, src, part, callback, digests)
+      return True
+    except (PathError, EnvironmentError, httplib.HTTPException), e:
+      if mi is not None and is_failure(e):
+        path.mirrorgroup.scores.record(mi, failure=True)
+      if i == len(sources) - 1:
+        raise
+
+def _fill_from(path, src, part, callback, digests):
+  "Download path to part from the http location src, resuming if possible"
+  retries = 0
+  while True:
+    offset = resumable(path, part)
+    try:
+      return _fill(path, src, part, offset, callback, digests)
+    except (EnvironmentError, httplib.HTTPException):
+      # resume right away if the attempt made progress
+      if retries >= RETRIES or not part.exists() or \
+         part.stat().st_size <= offset or not resumable(path, part):
+        raise
+      retries += 1
+
+def _fill(path, src, part, offset, callback, digests):
+  headers = []
+  if offset:
+    headers.append(('If-Range', validator(load_info(part))))
+  # open src itself rather than through a cache, which would download it
+  fsrc = src._open('rb', seek=offset or None, headers=headers)
+  try:
+    hdr = fsrc.hdr
+
+    crange = hdr.getheader('content-range')
+    if offset and not crange:
+      offset = 0 # the file has changed, or ranges are not supported
+
+    if crange and '/' in crange and not crange.endswith('*'):
+      size = int(crange.split('/')[-1])
+    elif hdr.getheader('content-length'):
+      size = offset + int(hdr.getheader('content-length'))
+    else:
+      size = None
+
+    save_info(part, { 'url':           str(path),
+                      'etag':          hdr.getheader('etag'),
+                      'last-modified': hdr.getheader('last-modified'),
+                      'size':          size })
+
+    if digests is not None:
+      digests.reset() # from an earlier attempt
+      if offset: # hash what was downloaded before
+        fo = open(part, 'rb')
+        try:
+          digests.updatefile(fo)
+        finally:
+          fo.close()
+
+    if callback: callback._cp_start(size, path.basename, seek=offset)
+    fdst = part._open(offset and 'ab' or 'wb')
+    try:
+      read = copyfileobj(fsrc, fdst, callback=callback, offset=offset,
+                         digests=digests)
+    finally:
+      fdst.close()
+    if callback: callback._cp_end(read)
+  finally:
+    fsrc.close()
+
+  if size is not None and part.stat().st_size < size:
+    # the connection closed early; the download can be resumed
+    raise httplib.IncompleteRead(part.stat().st_size, size)
+  if size is not None and part.stat().st_size > size:
+    clear(part)
+    raise PathError(errno.EIO, path,
+          strerror="Error copying file - downloaded size did not match "
+                   "source, partial file removed")
+
+  return True
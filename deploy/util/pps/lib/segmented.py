@@ -0,0 +1,252 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+segmented.py
+
+Downloads large files in byte ranges from several sources at once
+
+fill() splits a file into parts of segment_params['part_size'] bytes and
+downloads up to segment_params['jobs'] of them at a time.  For mirror paths,
+parts come from the group's enabled http mirrors, best ranked first, with at
+most segment_params['host_jobs'] parts from any one mirror; for http paths,
+parts come over several connections to the one server.  A part that fails is
+retried from another source, resuming from the last byte received, and a
+source that fails twice is not used again.  Parts are written in place into
+the partial cache file, which the caller verifies and renames.
+
+Segmented downloads are disabled unless segment_params['jobs'] is greater
+than one.
+"""
+
+import errno
+import Queue
+import re
+import sys
+import threading
+import time
+
+from collections import deque
+
+from deploy.util.pps.lib.http import range_handlers
+from deploy.util.pps.lib.mirror import is_failure
+from deploy.util.pps.Path.error import PathError
+
+# global settings for segmented downloads
+segment_params = dict(
+  jobs      = 1, # parts downloaded at once; 1 disables segmented downloads
+  host_jobs = 2, # parts downloaded at once from any one mirror
+  min_size  = 32*1024*1024, # smallest file downloaded in parts
+  part_size = 8*1024*1024,  # bytes per part
+)
+
+BUFSIZE = 256*1024 # bytes read from a source at a time
+MAX_FAILURES = 2 # failures after which a source is not used again
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+class SourceError(Exception):
+  "A source failed to provide a part; it may be retried from another"
+  def __init__(self, error):
+    Exception.__init__(self, error)
+    self.error = error
+
+def http_sources(path):
+  """
+  Return (root, path) pairs for the http locations path can be downloaded
+  from, best first.  root is the mirror that path is on, or None.
+  """
+  if path.protocol == 'mirror':
+    srcs = [ (mi, mi//path.path) for mi in path.mirrorgroup.ranked() ]
+  else:
+    srcs = [ (None, path) ]
+  return [ (mi, src) for mi, src in srcs
+           if src.protocol in ['http', 'https'] ]
+
+def segmentable(path):
+  """
+  Return the size of path and the sources to download it from if it should
+  be downloaded in parts, or (None, None)
+  """
+  if segment_params['jobs'] <= 1 or not range_handlers:
+    return None, None
+  try:
+    size = path.stat().st_size
+    if size < segment_params['min_size']:
+      return None, None
+    sources = http_sources(path)
+  except PathError:
+    return None, None # let the normal download report any errors
+  if not sources:
+    return None, None
+  return size, sources
+
+def fill(path, part, callback=None):
+  """
+  Download path to part in parts from several sources at once.  Returns
+  False, having done nothing, if path is not a large file on http servers
+  or segmented downloads are disabled; the caller should download it some
+  other way.
+  """
+  size, sources = segmentable(path)
+  if size is None:
+    return False
+
+  fo = open(part, 'wb')
+  try:
+    fo.truncate(size)
+  finally:
+    fo.close()
+
+  if callback: callback._cp_start(size, path.basename)
+  try:
+    _download(path, part, size, sources, callback)
+  except:
+    part.rm(force=True)
+    raise
+  if callback: callback._cp_end(size)
+  return True
+
+def _download(path, part, size, sources, callback):
+  psize = segment_params['part_size']
+  pending = deque([ (start, min(start+psize, size))
+                    for start in xrange(0, size, psize) ])
+  jobs = min(segment_params['jobs'], len(pending))
+  if len(sources) > 1: limit = segment_params['host_jobs']
+  else:                limit = jobs
+
+  active   = [0] * len(sources) # parts downloading from each source
+  failures = [0] * len(sources)
+  progress = {} # start: bytes of the part received so far
+  complete = [0] # bytes in completed parts
+
+  tasks   = Queue.Queue()
+  results = Queue.Queue()
+
+  def worker():
+    out = open(part, 'r+b')
+    try:
+      while True:
+        task = tasks.get()
+        if task is None: break
+        start, end, s = task
+        begin = time.time()
+        try:
+          _get_part(sources[s][1], out, start, end, size, progress)
+          results.put((start, end, s, None, time.time()-begin))
+        except BaseException:
+          results.put((start, end, s, sys.exc_info(), None))
+    finally:
+      out.close()
+
+  def pick():
+    "Return the index of the best usable source with capacity, or None"
+    for s in range(len(sources)):
+      if failures[s] < MAX_FAILURES and active[s] < limit:
+        return s
+    return None
+
+  workers = []
+  for n in range(jobs):
+    t = threading.Thread(target=worker, name='segment-%d' % n)
+    t.daemon = True
+    t.start()
+    workers.append(t)
+
+  running = 0
+  error = None
+  try:
+    while pending or running:
+      while pending and running < jobs:
+        s = pick()
+        if s is None: break
+        start, end = pending.popleft()
+        progress[start] = 0
+        tasks.put((start, end, s))
+        active[s] += 1
+        running += 1
+
+      if not running:
+        # every source has failed; raise the last error
+        e = error[1].error
+        if not isinstance(e, PathError):
+          e = PathError(errno.EIO, path, strerror=str(e))
+        raise e
+
+      # wait for a part to finish; poll so KeyboardInterrupt gets through
+      # and progress is reported
+      while True:
+        try:
+          start, end, s, exc_info, elapsed = results.get(True, 0.5)
+          break
+        except Queue.Empty:
+          if callback: callback._cp_update(complete[0] + sum(progress.values()))
+      running -= 1
+      active[s] -= 1
+      done = progress.pop(start)
+
+      mi = sources[s][0]
+      if exc_info is None:
+        complete[0] += end - start
+        if mi is not None and elapsed > 0:
+          path.mirrorgroup.scores.record(mi, throughput=(end-start)/elapsed)
+      elif isinstance(exc_info[1], SourceError):
+        error = exc_info
+        failures[s] += 1
+        if mi is not None and is_failure(exc_info[1].error):
+          path.mirrorgroup.scores.record(mi, failure=True)
+        # keep what was received; fetch the rest from another source
+        complete[0] += done
+        pending.appendleft((start+done, end))
+      else:
+        raise exc_info[0], exc_info[1], exc_info[2] # local error
+
+      if callback: callback._cp_update(complete[0] + sum(progress.values()))
+  finally:
+    for t in workers:
+      tasks.put(None)
+    for t in workers:
+      while t.isAlive(): t.join(0.5)
+
+def _get_part(src, out, start, end, size, progress):
+  "Download bytes start to end of the file src into out, at the same offset"
+  try:
+    fo = src._open('rb', seek=start, end=end)
+  except PathError, e:
+    raise SourceError(e)
+  try:
+    match = CONTENT_RANGE.match(fo.hdr.getheader('content-range') or '')
+    if not match or int(match.group(1)) != start or \
+       int(match.group(3)) != size:
+      raise SourceError(PathError(errno.EIO, src,
+        strerror="server did not return the requested byte range"))
+    pos = start
+    while pos < end:
+      try:
+        buf = fo.read(min(BUFSIZE, end-pos))
+      except Exception, e:
+        raise SourceError(e)
+      if not buf: # a dropped connection; counts against a mirror
+        raise SourceError(PathError(errno.ECONNRESET, src,
+          strerror="connection closed after %d of %d bytes" %
+                   (pos-start, end-start)))
+      out.seek(pos)
+      out.write(buf)
+      pos += len(buf)
+      progress[start] = pos - start
+  finally:
+    fo.close()
@@ -0,0 +1,172 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+validators.py
+
+Persistent cache of http validators, and the data they validate, by url
+
+Each time an http location is stat'd, its ETag, Last-Modified and stat
+fields are recorded in a Validators object shared by all paths using the
+same cache dir, and saved to a file in the cache dir at exit.  Later runs
+send the saved ETag and Last-Modified in If-None-Match and If-Modified-Since
+headers; if the server answers 304 Not Modified, the saved stat fields are
+used as they are.  In offline mode, saved stat fields answer stat() calls on
+locations that are not in the cache.  Directory listings are kept the same
+way, in a separate file; see Path/http/path_walk.py.
+
+Entries that have not been confirmed by a server for MAX_AGE seconds are
+dropped when the file is saved.
+"""
+
+import atexit
+import cPickle
+import threading
+import time
+
+from deploy.util.pps.Path.error import PathError
+
+VALIDATOR_FILE = '.http-validators'
+LISTING_FILE   = '.http-listings'
+MAX_AGE = 90*24*60*60 # 90 days
+
+class Validators(object):
+  """
+  Validators of http locations, with the data they validate, by url.  If
+  file is given, entries are loaded from it and saved back to it, merging
+  with those saved by other processes; filelock, a FileLock, serializes
+  access to file.
+  """
+  def __init__(self, file=None, filelock=None):
+    self.file = file
+    self.filelock = filelock
+    self.entries = {} # url: {'etag', 'last-modified', 'time', data...}
+    self.lock = threading.Lock()
+    self.dirty = False
+    if self.file:
+      self.entries.update(self._load())
+
+  def get(self, url):
+    "Return the entry for url, or None"
+    return self.entries.get(str(url))
+
+  def headers(self, url):
+    "Return a list of conditional request headers for url"
+    entry = self.get(url)
+    if not entry: return []
+    headers = []
+    if entry['etag']:
+      headers.append(('If-None-Match', entry['etag']))
+    if entry['last-modified']:
+      headers.append(('If-Modified-Since', entry['last-modified']))
+    return headers
+
+  def record(self, url, hdr, **data):
+    """
+    Record data about url, such as its stat fields, along with the
+    validators in hdr, the headers of the server response it came from.
+    Locations without validators are recorded too, for offline use.
+    """
+    entry = dict(data)
+    entry.update({'etag':          hdr.getheader('etag'),
+                  'last-modified': hdr.getheader('last-modified'),
+                  'time':          time.time()})
+    self.lock.acquire()
+    try:
+      self.entries[str(url)] = entry
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+  def confirm(self, url, **data):
+    """
+    Note that the server has confirmed the entry for url is current, and
+    update it with data
+    """
+    self.lock.acquire()
+    try:
+      if str(url) in self.entries:
+        self.entries[str(url)].update(data)
+        self.entries[str(url)]['time'] = time.time()
+        self.dirty = True
+    finally:
+      self.lock.release()
+
+  def save(self):
+    "Save entries to file, keeping newer entries saved by other processes"
+    if not self.file or not self.dirty: return
+    self.lock.acquire()
+    try:
+      self.dirty = False
+      try:
+        with self.filelock:
+          entries = self._load()
+          for url, entry in self.entries.items():
+            if url not in entries or entries[url]['time'] <= entry['time']:
+              entries[url] = entry
+          cutoff = time.time() - MAX_AGE
+          for url, entry in entries.items():
+            if entry['time'] < cutoff:
+              del entries[url]
+          tmp = self.file.dirname / '%s.tmp' % self.file.basename
+          fo = open(tmp, 'wb')
+          try:
+            cPickle.dump(entries, fo, cPickle.HIGHEST_PROTOCOL)
+          finally:
+            fo.close()
+          tmp.rename(self.file)
+      except (EnvironmentError, PathError):
+        pass # validators are advisory; don't fail a run over them
+    finally:
+      self.lock.release()
+
+  def _load(self):
+    try:
+      fo = open(self.file, 'rb')
+      try:
+        return cPickle.load(fo)
+      finally:
+        fo.close()
+    except Exception:
+      return {} # missing or unreadable
+
+VALIDATORS = {} # (cache dir, file): Validators
+_validators_lock = threading.Lock()
+
+def get_validators(cache_handler=None, file=VALIDATOR_FILE):
+  """
+  Return the Validators kept in file, e.g. LISTING_FILE, shared by paths
+  using cache_handler
+  """
+  key = (cache_handler and str(cache_handler.cache_dir), file)
+  _validators_lock.acquire()
+  try:
+    if key not in VALIDATORS:
+      if cache_handler:
+        file = cache_handler.cache_dir / file
+        VALIDATORS[key] = Validators(file, cache_handler.lock(file))
+      else:
+        VALIDATORS[key] = Validators()
+    return VALIDATORS[key]
+  finally:
+    _validators_lock.release()
+
+def save_validators():
+  for validators in VALIDATORS.values():
+    validators.save()
+
+atexit.register(save_validators)
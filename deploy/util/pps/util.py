@@ -19,6 +19,10 @@
 util.py - various utility functions
 """
 
+import Queue
+import sys
+import threading
+
 SUPPORTED_SCHEMES = ['ftp', 'http', 'https', 'file'] #!
 
 #------ URL PATH PROCESSING ------#
@@ -63,3 +67,52 @@ def _splitnetloc(url, start=0):
 def _normpart(part):
   if not part: return
   return '&'.join(sorted(part.split('&')))
+
+#------ CHECKSUMS ------#
+CHECKSUM_JOBS = 4 # default number of threads used by checksum_many()
+
+def checksum_many(paths, type='sha256', jobs=None, hex=True):
+  """
+  Return a dict of the checksums of each of paths, by path.  Files are read
+  and hashed by a pool of jobs threads (CHECKSUM_JOBS by default); since
+  hashlib and file reads release the GIL, large files are hashed
+  concurrently.  Checksums come from each path's checksum() method, so local
+  paths use the digest cache if it is enabled.  If any checksum fails, the
+  first error is raised once all threads have stopped.
+  """
+  from deploy.util import pps # pps imports this module
+
+  paths = list(paths)
+  jobs = min(jobs or CHECKSUM_JOBS, len(paths))
+  if jobs <= 1:
+    return dict([ (p, pps.path(p).checksum(type=type, hex=hex))
+                  for p in paths ])
+
+  tasks = Queue.Queue()
+  for p in paths: tasks.put(p)
+  csums = {}
+  errors = []
+
+  def worker():
+    while not errors:
+      try:
+        p = tasks.get_nowait()
+      except Queue.Empty:
+        break
+      try:
+        csums[p] = pps.path(p).checksum(type=type, hex=hex)
+      except BaseException:
+        errors.append(sys.exc_info())
+
+  workers = []
+  for i in range(jobs):
+    t = threading.Thread(target=worker, name='checksum-%d' % i)
+    t.daemon = True
+    t.start()
+    workers.append(t)
+  for t in workers:
+    while t.isAlive(): t.join(0.5) # poll so KeyboardInterrupt gets through
+
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+  return csums
@@ -298,7 +298,8 @@ class IORepo(BaseRepo):
         # prepopulate the mirrorgroup cache so we don't go trying to read
         # baseurl[0] like a mirrorlist (and so it reflects the additional
         # baseurl mirrors we want to add)
-        pps.Path.mirror.mgcache[self._url] = pps.lib.mirror.MirrorGroup(urls)
+        pps.Path.mirror.mgcache[self._url] = pps.lib.mirror.MirrorGroup(urls,
+          cache_handler=getattr(self._url, 'cache_handler', None))
 
     return self._url
 
@@ -412,6 +413,11 @@ from deploy.util import magic
 
 CSVORDER = ['file', 'size', 'mtime']
 
+# package lists read from primary metadata, keyed by the checksum recorded
+# for the file in repomd.xml
+CONTENT_CACHE = {}
+CONTENT_CACHE_SIZE = 32
+
 class _RepoContent(list):
   def __init__(self, *args, **kwargs):
     list.__init__(self, *args, **kwargs)
@@ -428,16 +434,7 @@ class _RepoContent(list):
     if clear: self.clear()
 
     for f in data:
-      fname = self.repo.localurl / f
-      ftype = magic.match(fname)
-      if ftype == magic.FILE_TYPE_GZIP:
-        get_package_tups = self._update_xml
-      elif ftype == magic.FILE_TYPE_BZIP2:
-        get_package_tups = self._update_sqlite
-      else:
-        raise ValueError(ftype)
-
-      for url,size,mtime in get_package_tups(fname):
+      for url,size,mtime in self._get_package_tups(f):
         self.append(dict(
           file  = pps.path(f.splitall()[:-2] or '')//url,
           size  = size,
@@ -446,6 +443,30 @@ class _RepoContent(list):
     self.sort()
     self._gen_pkgdict()
 
+  def _get_package_tups(self, f):
+    "Return (url, size, mtime) tuples for each package in the datafile f"
+    checksum = None
+    for datafile in self.repo.datafiles.values():
+      if datafile.href == f and datafile.checksum:
+        checksum = (datafile.checksum_type, datafile.checksum)
+    if checksum in CONTENT_CACHE:
+      return CONTENT_CACHE[checksum]
+
+    fname = self.repo.localurl / f
+    ftype = magic.match(fname)
+    if ftype == magic.FILE_TYPE_GZIP:
+      tups = self._update_xml(fname)
+    elif ftype == magic.FILE_TYPE_BZIP2:
+      tups = self._update_sqlite(fname)
+    else:
+      raise ValueError(ftype)
+
+    if checksum is not None:
+      if len(CONTENT_CACHE) >= CONTENT_CACHE_SIZE:
+        CONTENT_CACHE.pop(CONTENT_CACHE.keys()[0])
+      CONTENT_CACHE[checksum] = tups
+    return tups
+
   def _update_xml(self, f):
     fpxml = GzipFile(f, 'rt')
     handler = PrimaryXmlContentHandler()
@@ -16,8 +16,11 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>
 #
 import codecs
+import os
 import re
+import threading
 
+from collections import OrderedDict
 from copy import deepcopy
 from StringIO import StringIO
 
@@ -878,6 +881,54 @@ def uElement(name, attrib=None, nsmap=None, parent=None, text=None, **kwargs):
           del(elem.attrib[k])
   return elem
 
+# cache of parsed files, keyed by file name, parser and base_url, least
+# recently used first; disabled unless enable_parse_cache() is called
+PARSE_CACHE = None
+PARSE_CACHE_SIZE = 256 # files kept in PARSE_CACHE
+_parse_cache_lock = threading.Lock()
+
+def enable_parse_cache(size=None):
+  """
+  Keep the unprocessed documents read by parse() in memory, and reuse them
+  while the file's size and mtime are unchanged.  Useful for long-running
+  processes that parse the same configs and templates many times.  Includes
+  and macros are still processed for each call.  Only the size (default
+  PARSE_CACHE_SIZE) most recently used files are kept.
+  """
+  global PARSE_CACHE, PARSE_CACHE_SIZE
+  if size is not None: PARSE_CACHE_SIZE = size
+  if PARSE_CACHE is None: PARSE_CACHE = OrderedDict()
+
+def _parse(file, parser, base_url):
+  if PARSE_CACHE is None or not isinstance(file, basestring):
+    return etree.parse(file, parser, base_url=base_url)
+
+  try:
+    st = os.stat(file)
+  except OSError:
+    return etree.parse(file, parser, base_url=base_url)
+
+  key = (os.path.abspath(file), id(parser), base_url)
+  stat = (st.st_size, st.st_mtime)
+  _parse_cache_lock.acquire()
+  try:
+    cached = PARSE_CACHE.pop(key, None)
+    if cached is not None and cached[0] == stat:
+      PARSE_CACHE[key] = cached # now the most recently used
+      return deepcopy(cached[1])
+  finally:
+    _parse_cache_lock.release()
+
+  tree = etree.parse(file, parser, base_url=base_url)
+  _parse_cache_lock.acquire()
+  try:
+    PARSE_CACHE[key] = (stat, tree)
+    while len(PARSE_CACHE) > PARSE_CACHE_SIZE:
+      PARSE_CACHE.popitem(last=False)
+  finally:
+    _parse_cache_lock.release()
+  return deepcopy(tree)
+
 def parse(file, parser=PARSER, base_url=None, include=False, 
                 resolve_macros=False, macros={}, 
                 remove_macros=False, ignore_script_macros=False,
@@ -887,7 +938,7 @@ def parse(file, parser=PARSER, base_url=None, include=False,
     raise IOError("cannot read '%s': Is a directory" % file)
 
   try:
-    roottree = etree.parse(file, parser, base_url=base_url)
+    roottree = _parse(file, parser, base_url)
   except etree.XMLSyntaxError, e:
     raise errors.XmlSyntaxError(file, e)
 
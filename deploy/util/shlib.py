@@ -105,15 +105,18 @@ def call(cmd_args, **kwargs):
 
   return output, errors, both
 
-def execute(cmd, verbose=False):
+def execute(cmd, verbose=False, cwd=None):
   """
   Execute cmd, displaying output if verbose is true.  Raises a ShExecError
   if cmd returns a nonzero status code.  Otherwise, returns all the lines in
   stdout in a list. Similar to subprocess.check_output() in Python 2.7.
+
+  cwd, if given, is the directory to run cmd in.  Use it rather than
+  os.chdir(), which changes the directory of every thread in the process.
   """
 
   proc = Popen(cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE,
-               close_fds=True)
+               close_fds=True, cwd=cwd and str(cwd))
 
   stdout, stderr = proc.communicate()
 
@@ -0,0 +1,163 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+transfer.py
+
+Runs a list of sync transfers concurrently
+
+run() performs each transfer on a pool of worker threads, limiting the
+number of transfers from any one host.  Transfers report progress to a
+RecordingCallback rather than the real sync callback; recorded calls are
+replayed to the real callback in the order of the transfer list, so output
+looks the same as if the transfers ran one after another.
+"""
+
+import Queue
+import sys
+import threading
+
+from collections import deque
+
+class RecordingCallback(object):
+  "Records calls made to a sync callback so they can be replayed later"
+  def __init__(self, callback):
+    self._callback = callback
+    self._calls = []
+
+  def __getattr__(self, name):
+    attr = getattr(self._callback, name) # AttributeError if not supported
+    if not callable(attr):
+      return attr
+    def record(*args, **kwargs):
+      self._calls.append((name, args, kwargs))
+    return record
+
+  def replay(self):
+    "Make the recorded calls on the real callback"
+    calls, self._calls = self._calls, []
+    for i, (name, args, kwargs) in enumerate(calls):
+      # progress updates are cumulative; only the last of a run matters
+      if name == '_cp_update' and i+1 < len(calls) and \
+         calls[i+1][0] == '_cp_update':
+        continue
+      getattr(self._callback, name)(*args, **kwargs)
+
+
+def run(items, fn, callback, jobs=1, host=None, host_jobs=None):
+  """
+  Call fn(item, callback) for each of items using up to jobs threads.
+
+  host, if given, is a function returning the host an item is transferred
+  from; at most host_jobs items with the same host (other than None) are
+  transferred at once.
+
+  Each call gets a RecordingCallback wrapping callback; its calls are
+  replayed once the item and every item before it have completed.  If a call
+  raises an exception, no further items are started and, once the running
+  items complete, the exception of the first failing item is re-raised.
+  """
+  if jobs <= 1 or len(items) <= 1:
+    for item in items:
+      fn(item, callback)
+    return
+
+  # pending item indexes by host, in item order
+  queues = {}
+  for i, item in enumerate(items):
+    queues.setdefault(host and host(item), deque()).append(i)
+  active = {} # host: number of items running
+
+  def next_index():
+    "Return the first pending index whose host is below its limit, or None"
+    first = None
+    for h, q in queues.items():
+      if not q: continue
+      if h is not None and host_jobs and active.get(h, 0) >= host_jobs:
+        continue
+      if first is None or q[0] < first[0]:
+        first = q
+    if first is None: return None
+    return first.popleft()
+
+  tasks   = Queue.Queue()
+  results = Queue.Queue()
+
+  def worker():
+    while True:
+      task = tasks.get()
+      if task is None: break
+      i, recorder = task
+      try:
+        fn(items[i], recorder)
+        results.put((i, None))
+      except BaseException:
+        results.put((i, sys.exc_info()))
+
+  workers = []
+  for n in range(min(jobs, len(items))):
+    t = threading.Thread(target=worker, name='transfer-%d' % n)
+    t.daemon = True
+    t.start()
+    workers.append(t)
+
+  recorders = {} # index: RecordingCallback
+  done = set()
+  errors = {} # index: exc_info
+  reported = 0 # items before this index have been replayed
+  running = 0
+
+  try:
+    while True:
+      while not errors and running < jobs:
+        i = next_index()
+        if i is None: break
+        h = host and host(items[i])
+        active[h] = active.get(h, 0) + 1
+        recorders[i] = RecordingCallback(callback)
+        tasks.put((i, recorders[i]))
+        running += 1
+
+      if not running:
+        break
+
+      # wait for an item to finish; poll so KeyboardInterrupt gets through
+      while True:
+        try:
+          i, exc_info = results.get(True, 0.5)
+          break
+        except Queue.Empty:
+          continue
+      running -= 1
+      active[host and host(items[i])] -= 1
+      done.add(i)
+      if exc_info is not None:
+        errors[i] = exc_info
+
+      while reported in done and reported not in errors:
+        recorders.pop(reported).replay()
+        reported += 1
+  finally:
+    for t in workers:
+      tasks.put(None)
+
+  for t in workers:
+    while t.isAlive(): t.join(0.5)
+
+  if errors:
+    exc_info = errors[min(errors)]
+    raise exc_info[0], exc_info[1], exc_info[2]
@@ -0,0 +1,141 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+trace.py
+
+Timing trace export
+
+Records named, timed spans and writes them out in the Chrome trace event
+format, which can be loaded into chrome://tracing or compatible viewers.  If
+the output file name ends in '.jsonl', one JSON record is written per line
+instead, which is easier to process with line-oriented tools.
+
+Spans can be recorded either after the fact, from start and end times that
+have already been measured:
+
+  tracer.complete('setup', 'download', t_start, t_end)
+
+or around a block of code, optionally attaching extra values such as byte
+counts:
+
+  span = tracer.span('process_files', 'download')
+  span.begin()
+  ...
+  span.end(bytes=nbytes)
+
+NullTracer provides the same interface and records nothing; use it when
+tracing is disabled so callers need not test for it.
+"""
+
+import json
+import os
+import thread
+import threading
+import time
+
+class Tracer(object):
+  "Collects spans and writes them to a file in trace event format"
+  enabled = True
+
+  def __init__(self, file):
+    self.file = file
+    self.jsonl = str(file).endswith('.jsonl')
+    self.pid = os.getpid()
+    self.records = []
+    self.lock = threading.Lock()
+
+  def span(self, name, cat='', **args):
+    return Span(self, name, cat, args)
+
+  def complete(self, name, cat, start, end=None, **args):
+    "Record a span that started at start and ended at end (default now)"
+    if end is None: end = time.time()
+    record = {
+      'name': name,
+      'cat':  cat,
+      'ph':   'X',
+      'ts':   int(start * 1000000),
+      'dur':  int((end - start) * 1000000),
+      'pid':  self.pid,
+      'tid':  thread.get_ident(),
+    }
+    if args: record['args'] = args
+    self.lock.acquire()
+    try:
+      self.records.append(record)
+    finally:
+      self.lock.release()
+
+  def write(self):
+    self.lock.acquire()
+    try:
+      records = sorted(self.records, key=lambda r: r['ts'])
+    finally:
+      self.lock.release()
+
+    fo = open(self.file, 'w')
+    try:
+      if self.jsonl:
+        for record in records:
+          fo.write(json.dumps(record) + '\n')
+      else:
+        json.dump({'traceEvents': records, 'displayTimeUnit': 'ms'}, fo)
+    finally:
+      fo.close()
+
+
+class Span(object):
+  "A span of time measured around a block of code"
+  def __init__(self, tracer, name, cat, args):
+    self.tracer = tracer
+    self.name = name
+    self.cat = cat
+    self.args = args
+    self.start = None
+
+  def begin(self):
+    self.start = time.time()
+    return self
+
+  def end(self, **args):
+    if self.start is None: return
+    self.args.update(args)
+    self.tracer.complete(self.name, self.cat, self.start, **self.args)
+    self.start = None
+
+  def __enter__(self):
+    return self.begin()
+
+  def __exit__(self, *exc_info):
+    self.end()
+    return False
+
+
+class NullTracer(object):
+  "Tracer that records nothing"
+  enabled = False
+
+  def span(self, name, cat='', **args): return NullSpan()
+  def complete(self, *args, **kwargs): pass
+  def write(self): pass
+
+class NullSpan(object):
+  def begin(self): return self
+  def end(self, **args): pass
+  def __enter__(self): return self
+  def __exit__(self, *exc_info): return False
@@ -32,6 +32,10 @@ from deploy.dlogging import L0, L1
 
 NSMAP = {'rng': 'http://relaxng.org/ns/structure/1.0'}
 
+# compiled RelaxNG schemas, keyed by validator class, schema file and element;
+# reused while the schema file and the files it includes are unchanged
+SCHEMA_CACHE = {}
+
 class DeployValidationHandler:
   def validate_configs(self):
     try:
@@ -169,29 +173,40 @@ class BaseConfigValidator:
     if not file and not required:
       return 
     self.curr_schema = file
-    schema = self._read_schema()
     if tree is None:
-      self.check_required(schema, tag, required)
+      self.check_required(self._read_schema(), tag, required)
       return
-    schema_tree = self.massage_schema(schema, tag)
-    try:
-      cwd = os.getcwd()
-      os.chdir(self.curr_schema.dirname)
-      self.relaxng(schema_tree, tree)
-    finally:
-      os.chdir(cwd)
+
+    key = (self.__class__, str(file), tag)
+    deps, relaxng = SCHEMA_CACHE.get(key, (None, None))
+    if deps is None or deps != schema_stats(deps.keys()):
+      schema = self._read_schema()
+      deps = schema_stats(schema_files(file, schema))
+      schema_tree = self.massage_schema(schema, tag)
+      try:
+        cwd = os.getcwd()
+        os.chdir(self.curr_schema.dirname)
+        relaxng = self._compile(schema_tree)
+      finally:
+        os.chdir(cwd)
+      SCHEMA_CACHE[key] = (deps, relaxng)
+    self._validate(relaxng, tree)
 
   def relaxng(self, schema_tree, tree):
+    self._validate(self._compile(schema_tree), tree)
+
+  def _compile(self, schema_tree):
     try:
-      relaxng = etree.RelaxNG(schema_tree)
+      return etree.RelaxNG(schema_tree)
     except etree.RelaxNGParseError, e:
       raise InvalidSchemaError(self.curr_schema or '<string>', e.error_log)
-    else:
-      if not relaxng.validate(tree):
-        raise InvalidConfigError(self.config.base,
-                                 relaxng.error_log,
-                                 self.curr_schema or '<string>',
-                                 XmlTreeElement.tostring(tree, lineno=True))
+
+  def _validate(self, relaxng, tree):
+    if not relaxng.validate(tree):
+      raise InvalidConfigError(self.config.base,
+                               relaxng.error_log,
+                               self.curr_schema or '<string>',
+                               XmlTreeElement.tostring(tree, lineno=True))
 
   def _read_schema(self):
     cwd = os.getcwd()
@@ -243,6 +258,40 @@ class DefinitionValidator(BaseConfigValidator):
         raise InvalidConfigError(self.config.base,
                                  "Missing required element: '%s'" % tag)
  
+def schema_hrefs(schema):
+  "Return the files referenced by rng:include and rng:externalRef in schema"
+  return schema.xpath('//rng:include/@href|//rng:externalRef/@href', [],
+                      namespaces=NSMAP)
+
+def schema_files(file, schema):
+  """
+  Return file, whose parsed root element is schema, and every file it
+  includes, directly or through other included files
+  """
+  files = [file]
+  pending = [ (file.dirname/h).normpath() for h in schema_hrefs(schema) ]
+  while pending:
+    f = pending.pop()
+    if f in files: continue
+    files.append(f)
+    try:
+      included = rxml.tree.parse(f).getroot()
+    except (rxml.errors.XmlSyntaxError, EnvironmentError):
+      continue # missing or invalid; compiling the schema reports it
+    pending.extend([ (f.dirname/h).normpath() for h in schema_hrefs(included) ])
+  return files
+
+def schema_stats(files):
+  "Return a dict of schema file to (size, mtime), or None if missing"
+  stats = {}
+  for f in files:
+    try:
+      st = os.stat(f)
+      stats[str(f)] = (st.st_size, st.st_mtime)
+    except OSError:
+      stats[str(f)] = None
+  return stats
+
 #------ ERRORS ------#
 class InvalidXmlError(StandardError):
   def __str__(self):
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+Benchmark for difftest.filesdiff.diff
+
+Times diff() over synthetic old and new file lists in which a fraction of the
+entries have been added, removed or modified, and compares it against the
+previous list-based implementation.  The previous implementation is quadratic
+in the number of added and removed files, so by default it is only timed up
+to --legacy-limit entries.
+
+  python dtest/benchmarks/filesdiff.py [--entries N] [--changed FRACTION]
+"""
+
+import optparse
+import time
+
+from deploy.util.difftest.filesdiff import diff, DiffTuple
+
+def legacy_diff(oldstats, newstats):
+  "diff() as implemented before it was made linear, for comparison"
+  diffdict = {}
+  processed = []
+  for x in newstats:
+    if x not in oldstats:
+      diffdict[x] = (None, newstats[x])
+      processed.append(x)
+  for x in oldstats:
+    if x not in newstats:
+      diffdict[x] = (oldstats[x], None)
+      processed.append(x)
+  for file in oldstats:
+    if file in processed: continue
+    if legacy_ne(oldstats[file], newstats[file]):
+      diffdict[file] = (oldstats[file], newstats[file])
+  return diffdict
+
+def legacy_ne(a, b):
+  "DiffTuple.__ne__ as implemented before tuple comparison"
+  if a.keys() != b.keys(): return True
+  for k,v in a.items():
+    if getattr(a, k) != getattr(b, k):
+      return True
+  return False
+
+def make_stats(entries, changed):
+  """Return (oldstats, newstats); changed is the fraction of entries added,
+  removed and modified, in equal parts"""
+  step = changed and max(1, int(round(1 / changed)))
+  oldstats = {}
+  newstats = {}
+  for i in xrange(entries):
+    path = '/var/cache/deploy/files/%06d/file-%d.rpm' % (i % 1000, i)
+    values = (1024 + i, 1400000000 + i, 0100644)
+    old = DiffTuple().fromtuple(values, path)
+    new = DiffTuple().fromtuple(values, path)
+    if changed and i % step == 0:
+      change = (i // step) % 3
+      if change == 0:   old = None # added
+      elif change == 1: new = None # removed
+      else:             new.mtime += 1 # modified
+    if old is not None: oldstats[path] = old
+    if new is not None: newstats[path] = new
+  return oldstats, newstats
+
+def timeit(fn, *args):
+  start = time.time()
+  result = fn(*args)
+  return time.time() - start, result
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--entries', type='int', default=100000,
+    help='number of synthetic file entries (default %default)')
+  parser.add_option('--changed', type='float', default=0.1,
+    help='fraction of entries added, removed or modified (default %default)')
+  parser.add_option('--legacy-limit', type='int', default=20000,
+    help='largest number of entries to time the previous implementation '
+         'with (default %default)')
+  opts, args = parser.parse_args()
+
+  sizes = []
+  n = 1000
+  while n < opts.entries:
+    sizes.append(n)
+    n *= 10
+  sizes.append(opts.entries)
+
+  print '%10s %10s %12s %12s' % ('entries', 'changes', 'diff (s)', 'legacy (s)')
+  for size in sizes:
+    oldstats, newstats = make_stats(size, opts.changed)
+    elapsed, result = timeit(diff, oldstats, newstats)
+    if size <= opts.legacy_limit:
+      legacy, expected = timeit(legacy_diff, oldstats, newstats)
+      assert sorted(result.keys()) == sorted(expected.keys())
+      legacy = '%12.4f' % legacy
+    else:
+      legacy = '%12s' % 'skipped'
+    print '%10d %10d %12.4f %s' % (size, len(result), elapsed, legacy)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+Benchmark for HttpFileObject read throughput
+
+Starts an HTTP server on localhost that serves a synthetic file of --size
+bytes, then copies it with copyfileobj() through HttpFileObject, and
+through the previous string-slicing read buffer for comparison.  Data is
+discarded unless --dest is given, so the numbers reflect the cost of the
+read path rather than the disk.
+
+  python dtest/benchmarks/httpread.py [--size BYTES] [--dest FILE]
+"""
+
+import BaseHTTPServer
+import optparse
+import SocketServer
+import threading
+import time
+
+from deploy.util.pps.lib.http       import HttpFileObject
+from deploy.util.pps.Path.path_io   import copyfileobj
+
+BLOCK = 'deploy-benchmark' * (64*1024) # 1 MiB
+
+class LegacyHttpFileObject(HttpFileObject):
+  "HttpFileObject with the str buffer it used before bytearray buffering"
+  def __init__(self, *args, **kwargs):
+    HttpFileObject.__init__(self, *args, **kwargs)
+    self._rbuf = ''
+    self._rbufsize = 1024*8
+
+  def read(self, amt=None):
+    if amt and amt < 0: amt = None
+    self._retry(self._retry_fill_buffer, amt)
+    if amt is None:
+      s, self._rbuf = self._rbuf, ''
+    else:
+      s, self._rbuf = self._rbuf[:amt], self._rbuf[amt:]
+    return s
+
+  def _fill_buffer(self, amt=None):
+    if self._rbuf and amt is not None:
+      L = len(self._rbuf)
+      if amt > L: amt = amt - L
+      else: return
+    buf = [self._rbuf]
+    while amt is None or amt:
+      if amt is None: readamount = self._rbufsize
+      else:           readamount = min(amt, self._rbufsize)
+      new = self._read(readamount)
+      if not new: break
+      if amt: amt = amt - len(new)
+      buf.append(new)
+    self._rbuf = ''.join(buf)
+
+def make_server(size):
+  class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def log_message(self, *args): pass
+    def do_GET(self):
+      self.send_response(200)
+      self.send_header('Content-Length', str(size))
+      self.end_headers()
+      left = size
+      while left > 0:
+        n = min(left, len(BLOCK))
+        self.wfile.write(BLOCK[:n])
+        left -= n
+
+  class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+  server = Server(('127.0.0.1', 0), Handler)
+  t = threading.Thread(target=server.serve_forever)
+  t.daemon = True
+  t.start()
+  return server, 'http://127.0.0.1:%d/file.img' % server.server_address[1]
+
+class NullFile(object):
+  def write(self, buf): pass
+  def close(self): pass
+
+def timecopy(cls, url, dest, **kwargs):
+  fsrc = cls(url)
+  if dest: fdst = open(dest, 'wb')
+  else:    fdst = NullFile()
+  start = time.time()
+  try:
+    read = copyfileobj(fsrc, fdst, **kwargs)
+  finally:
+    fsrc.close()
+    fdst.close()
+  return time.time() - start, read
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--size', type='int', default=2*1024**3,
+    help='size of the served file in bytes (default %default)')
+  parser.add_option('--dest', metavar='FILE',
+    help='write the downloaded data to FILE instead of discarding it')
+  opts, args = parser.parse_args()
+
+  server, url = make_server(opts.size)
+  try:
+    print '%-10s %10s %12s %10s' % ('reader', 'bytes', 'time (s)', 'MiB/s')
+    for name, cls, kwargs in [
+      ('current', HttpFileObject, {}),
+      ('legacy',  LegacyHttpFileObject, {'buflen': 16*1024}),
+      ]:
+      elapsed, read = timecopy(cls, url, opts.dest, **kwargs)
+      assert read == opts.size, 'read %d of %d bytes' % (read, opts.size)
+      print '%-10s %10d %12.4f %10.1f' % (name, read, elapsed,
+                                          read / 1024.0**2 / elapsed)
+  finally:
+    server.shutdown()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,166 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+"""
+Behavior tests for deploy.util
+
+Unlike the tests in dtest/modules, these exercise library code directly and
+need no build, repositories or network access; http tests run against a
+TestServer on the loopback interface.  Each module provides make_suite(), so
+it can be run with runtest.py given its absolute path, or on its own from
+the top of the source tree:
+
+  python -m dtest.util.segmented
+"""
+
+import BaseHTTPServer
+import socket
+import SocketServer
+import tempfile
+import threading
+import unittest
+
+from deploy.util import pps
+
+LAST_MODIFIED = 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+class UtilTestCase(unittest.TestCase):
+  "A test case with a scratch directory, self.tmpdir"
+  eventid = 'util' # for EventTestResult
+
+  def __init__(self, *args, **kwargs):
+    unittest.TestCase.__init__(self, *args, **kwargs)
+    self._testMethodDoc = self.__class__.__doc__
+
+  def shortDescription(self):
+    return self._testMethodDoc
+
+  def setUp(self):
+    self.tmpdir = pps.path(tempfile.mkdtemp(prefix='dtest-'))
+
+  def tearDown(self):
+    self.tmpdir.rm(recursive=True, force=True)
+
+
+class TestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  """
+  An http server on the loopback interface serving files, a dict of
+  {path: (data, etag)}.  Range requests are honored unless an If-Range
+  header does not match the file's etag.  Each request is recorded in
+  requests as a (method, path, range, if-range) tuple.
+  """
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, files=None):
+    BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+    self.files = files or {}
+    self.requests = []
+    self._cuts = []
+    self._conns = []
+    self._lock = threading.Lock()
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+
+  url = property(lambda self: 'http://127.0.0.1:%d/' % self.server_address[1])
+
+  def cut(self, size, times=1, ranges_only=False):
+    """Close the connection after sending size bytes of the body of the next
+    times GET responses, or of all of them if times is None; if ranges_only
+    is True, only responses to Range requests are cut"""
+    self._cuts.append([size, times, ranges_only])
+
+  def _take_cut(self, ranged):
+    self._lock.acquire()
+    try:
+      for cut in self._cuts:
+        size, times, ranges_only = cut
+        if ranges_only and not ranged: continue
+        if times is not None:
+          cut[1] -= 1
+          if cut[1] == 0: self._cuts.remove(cut)
+        return size
+      return None
+    finally:
+      self._lock.release()
+
+  def process_request(self, request, client_address):
+    self._conns.append(request)
+    SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+  def handle_error(self, request, client_address):
+    pass # clients drop connections, e.g. to a cut off response
+
+  def close(self):
+    self.shutdown()
+    # end connections kept alive by clients, so their threads exit
+    for conn in self._conns:
+      try:
+        conn.shutdown(socket.SHUT_RDWR)
+      except socket.error:
+        pass
+    self.server_close()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self._reply(False)
+
+  def do_GET(self):
+    self._reply(True)
+
+  def _reply(self, body):
+    rng = self.headers.getheader('range')
+    ifr = self.headers.getheader('if-range')
+    self.server.requests.append((self.command, self.path, rng, ifr))
+
+    if self.path not in self.server.files:
+      self.send_error(404)
+      return
+    data, etag = self.server.files[self.path]
+
+    start, end = 0, len(data)
+    if rng and (ifr is None or ifr == etag):
+      first, last = rng.split('=', 1)[1].split('-')
+      start = int(first)
+      if last: end = min(int(last) + 1, len(data))
+      self.send_response(206)
+      self.send_header('Content-Range',
+                       'bytes %d-%d/%d' % (start, end-1, len(data)))
+    else:
+      rng = None
+      self.send_response(200)
+    self.send_header('Content-Length', str(end - start))
+    self.send_header('ETag', etag)
+    self.send_header('Last-Modified', LAST_MODIFIED)
+    self.end_headers()
+    if not body: return
+
+    cut = self.server._take_cut(rng is not None)
+    if cut is None:
+      self.wfile.write(data[start:end])
+    else:
+      self.wfile.write(data[start:min(start+cut, end)])
+      self.wfile.flush()
+      self.close_connection = 1
+      self.connection.shutdown(2)
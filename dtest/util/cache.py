@@ -0,0 +1,151 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import sys
+import time
+import unittest
+
+from deploy.util.pps.cache      import CacheHandler
+from deploy.util.pps.cacheindex import CacheIndex, INDEX_FILE
+
+from dtest.util import UtilTestCase
+
+class CacheIndexTestCase(UtilTestCase):
+  eventid = 'cacheindex'
+
+  def setUp(self):
+    UtilTestCase.setUp(self)
+    self.dir = self.tmpdir / 'cache'
+    self.dir.mkdirs()
+
+class Test_Rebuild(CacheIndexTestCase):
+  "a new index lists the regular files already in the cache dir"
+  def runTest(self):
+    (self.dir / 'aaaa').write_text('x' * 100)
+    (self.dir / 'bbbb').write_text('x' * 50)
+    (self.dir / '.aaaa.part').write_text('x' * 1000) # partial download
+    (self.dir / '.locks').mkdirs()
+    index = CacheIndex(self.dir)
+    self.failUnlessEqual(index.size(), 150)
+    self.failUnlessEqual(sorted(index.oldest(10)),
+                         [('aaaa', 100), ('bbbb', 50)])
+
+class Test_Totals(CacheIndexTestCase):
+  "the total size follows files as they are added, updated and removed"
+  def runTest(self):
+    index = CacheIndex(self.dir)
+    index.add('aaaa', 100)
+    index.add('bbbb', 50)
+    self.failUnlessEqual(index.size(), 150)
+    index.add('aaaa', 10) # replaced
+    self.failUnlessEqual(index.size(), 60)
+    index.remove('bbbb')
+    index.remove('cccc') # not in the index
+    self.failUnlessEqual(index.size(), 10)
+
+class Test_Oldest(CacheIndexTestCase):
+  "files are returned least recently accessed first"
+  def runTest(self):
+    index = CacheIndex(self.dir)
+    for hash in ['aaaa', 'bbbb', 'cccc']:
+      index.add(hash, 1)
+      time.sleep(0.01)
+    self.failUnless(index.touch('aaaa'))
+    self.failIf(index.touch('dddd')) # not in the index
+    self.failUnlessEqual([ h for h, _ in index.oldest(10) ],
+                         ['bbbb', 'cccc', 'aaaa'])
+    self.failUnlessEqual([ h for h, _ in index.oldest(1) ], ['bbbb'])
+
+class Test_Shared(CacheIndexTestCase):
+  "indexes opened on the same cache dir see each other's changes"
+  def runTest(self):
+    one = CacheIndex(self.dir)
+    two = CacheIndex(self.dir)
+    one.add('aaaa', 100)
+    self.failUnlessEqual(two.size(), 100)
+    self.failUnless(two.touch('aaaa'))
+    two.flush()
+    self.failUnlessEqual(one.oldest(10), [('aaaa', 100)])
+
+class Test_Damaged(CacheIndexTestCase):
+  "an unreadable index is rebuilt from the cache dir"
+  def runTest(self):
+    (self.dir / 'aaaa').write_text('x' * 100)
+    (self.dir / INDEX_FILE).write_text('garbage' * 100)
+    self.failUnlessEqual(CacheIndex(self.dir).size(), 100)
+
+class QuotaTestCase(CacheIndexTestCase):
+  "Fills a cache with 1000-byte files, oldest first"
+  eventid = 'cache'
+
+  def setUp(self):
+    CacheIndexTestCase.setUp(self)
+    self.handler = CacheHandler(cache_dir=self.dir, cache_max_size=2500)
+    self.files = []
+    for i in range(5):
+      cshfile = self.handler.cshfile('/repo/file-%d.rpm' % i)
+      cshfile.write_text('x' * 1000)
+      self.handler.lock(cshfile).acquire().release()
+      self.handler.add(cshfile)
+      self.files.append(cshfile)
+      time.sleep(0.01)
+
+  def tearDown(self):
+    self.handler.unwrap_path()
+    CacheIndexTestCase.tearDown(self)
+
+  def locks(self):
+    return sorted([ f.basename for f in (self.dir / '.locks').listdir() ])
+
+class Test_Evict(QuotaTestCase):
+  "the least recently used files and their lock files are removed"
+  def runTest(self):
+    self.handler._enforce_quota()
+    self.failUnlessEqual([ f.exists() for f in self.files ],
+                         [False, False, False, True, True])
+    self.failUnlessEqual(self.handler.cache_size, 2000)
+    self.failUnlessEqual(self.locks(),
+                         sorted([ f.basename for f in self.files[3:] ]))
+
+class Test_EvictSkipsLocked(QuotaTestCase):
+  "files whose lock is held are not evicted"
+  def runTest(self):
+    lock = self.handler.lock(self.files[0]).acquire()
+    try:
+      self.handler._enforce_quota()
+    finally:
+      lock.release()
+    self.failUnlessEqual([ f.exists() for f in self.files ],
+                         [True, False, False, False, True])
+    self.failUnlessEqual(self.handler.cache_size, 2000)
+
+    # quota cannot be met without evicting a locked file; give up on it
+    self.handler.cache_max_size = 0
+    lock = self.handler.lock(self.files[4]).acquire()
+    try:
+      self.handler._enforce_quota()
+    finally:
+      lock.release()
+    self.failUnlessEqual([ f.exists() for f in self.files ],
+                         [False, False, False, False, True])
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())
@@ -0,0 +1,83 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import sys
+import unittest
+
+from deploy.util.difftest.filesdiff import diff, DiffTuple, ChecksumDiffTuple
+
+from dtest.benchmarks.filesdiff import legacy_diff, make_stats
+from dtest.util                 import UtilTestCase
+
+class FilesDiffTestCase(UtilTestCase):
+  "Compares diff() with the previous, list-based implementation"
+  eventid = 'filesdiff'
+
+  def failUnlessSameDiff(self, oldstats, newstats):
+    result = diff(oldstats, newstats)
+    self.failUnlessEqual(result, legacy_diff(oldstats, newstats))
+    return result
+
+class Test_NoChanges(FilesDiffTestCase):
+  "identical lists have no differences"
+  def runTest(self):
+    oldstats, newstats = make_stats(1000, 0)
+    self.failUnlessEqual(self.failUnlessSameDiff(oldstats, newstats), {})
+
+class Test_Changes(FilesDiffTestCase):
+  "added, removed and modified files are reported as before"
+  def runTest(self):
+    for changed in [0.01, 0.1, 0.5, 1]:
+      oldstats, newstats = make_stats(1000, changed)
+      self.failUnless(self.failUnlessSameDiff(oldstats, newstats))
+
+class Test_Empty(FilesDiffTestCase):
+  "every file is added or removed when one side is empty"
+  def runTest(self):
+    oldstats, newstats = make_stats(100, 0)
+    self.failUnlessEqual(len(self.failUnlessSameDiff({}, newstats)), 100)
+    self.failUnlessEqual(len(self.failUnlessSameDiff(oldstats, {})), 100)
+    self.failUnlessEqual(self.failUnlessSameDiff({}, {}), {})
+
+class Test_Missing(FilesDiffTestCase):
+  "files that no longer exist differ from files that do"
+  def runTest(self):
+    path = '/var/cache/deploy/file.rpm'
+    old = DiffTuple().fromtuple((1024, 1400000000, 0100644), path)
+    gone = DiffTuple().fromtuple((None, None, None), path)
+    self.failUnlessEqual(self.failUnlessSameDiff({path: old}, {path: gone}),
+                         {path: (old, gone)})
+    self.failUnlessEqual(self.failUnlessSameDiff({path: gone}, {path: gone}),
+                         {})
+
+class Test_ChecksumTuples(FilesDiffTestCase):
+  "checksum tuples differ from plain tuples, and by checksum"
+  def runTest(self):
+    path = '/var/cache/deploy/file.rpm'
+    plain = DiffTuple().fromtuple((1024, 1400000000, 0100644), path)
+    csum1 = ChecksumDiffTuple().fromtuple((None, None, 0100644, 'aaaa'), path)
+    csum2 = ChecksumDiffTuple().fromtuple((None, None, 0100644, 'bbbb'), path)
+    self.failUnless(self.failUnlessSameDiff({path: plain}, {path: csum1}))
+    self.failUnless(self.failUnlessSameDiff({path: csum1}, {path: csum2}))
+    self.failIf(self.failUnlessSameDiff({path: csum1}, {path: csum1}))
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())
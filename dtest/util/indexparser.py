@@ -0,0 +1,87 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import sys
+import unittest
+
+from deploy.util.pps.Path.http.path_walk import IndexParser
+
+from dtest.util import UtilTestCase
+
+APACHE = """\
+<html><body><h1>Index of /centos/7/os/x86_64</h1>
+<table>
+<tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th><th><a href="?C=S;O=A">Size</a></th></tr>
+<tr><td><a href="/centos/7/os/">Parent Directory</a></td><td>&nbsp;</td><td align="right">  - </td></tr>
+<tr><td><a href="Packages/">Packages/</a></td><td align="right">2015-10-21 07:28  </td><td align="right">  - </td></tr>
+<tr><td><a href="RPM-GPG-KEY-CentOS-7">RPM-GPG-KEY-CentOS-7</a></td><td align="right">2015-10-21 07:28  </td><td align="right">1.7K</td></tr>
+</table></body></html>
+"""
+
+NGINX = """\
+<html><head><title>Index of /repo/</title></head><body>
+<h1>Index of /repo/</h1><hr><pre><a href="../">../</a>
+<a href="repodata/">repodata/</a>                                          21-Oct-2015 07:28                   -
+<a href="package1-1.0-1.noarch.rpm">package1-1.0-1.noarch.rpm</a>          21-Oct-2015 07:28:31              2345
+<a href="package2-1.0-1.noarch.rpm">package2-1.0-1.noarch.rpm</a>
+</pre><hr></body></html>
+"""
+
+class IndexParserTestCase(UtilTestCase):
+  eventid = 'indexparser'
+
+  def parse(self, html, chunk=None):
+    "Return the entries of html, fed to an IndexParser chunk bytes at a time"
+    parser = IndexParser()
+    chunk = chunk or len(html)
+    for i in range(0, len(html), chunk):
+      parser.feed(html[i:i+chunk])
+    parser.close()
+    return parser.entries
+
+class Test_Apache(IndexParserTestCase):
+  "links, times and sizes are read from an apache table listing"
+  def runTest(self):
+    entries = dict([ (e[0], e[1:]) for e in self.parse(APACHE) ])
+    self.failUnlessEqual(entries['Packages/'], (None, '2015-10-21 07:28 -'))
+    self.failUnlessEqual(entries['RPM-GPG-KEY-CentOS-7'],
+                         (None, '2015-10-21 07:28 1.7K'))
+    self.failUnlessEqual(entries['/centos/7/os/'], (None, None))
+    self.failUnlessEqual(entries['?C=N;O=D'], (None, None))
+
+class Test_Nginx(IndexParserTestCase):
+  "links, times and sizes in bytes are read from an nginx pre listing"
+  def runTest(self):
+    self.failUnlessEqual(self.parse(NGINX), [
+      ('../', None, None),
+      ('repodata/', None, '21-Oct-2015 07:28 -'),
+      ('package1-1.0-1.noarch.rpm', 2345, '21-Oct-2015 07:28:31 2345'),
+      ('package2-1.0-1.noarch.rpm', None, None),
+    ])
+
+class Test_Streaming(IndexParserTestCase):
+  "a listing fed in small pieces is parsed the same as a whole one"
+  def runTest(self):
+    for html in [APACHE, NGINX]:
+      self.failUnlessEqual(self.parse(html, chunk=7), self.parse(html))
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())
@@ -0,0 +1,128 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import sys
+import unittest
+
+from deploy.util import pps
+
+from deploy.util.pps.lib import partial
+
+from dtest.util import UtilTestCase, TestServer
+
+DATA = os.urandom(512*1024 + 17)
+
+class PartialTestCase(UtilTestCase):
+  "Downloads DATA, served with ETag \"v1\", to a partial file"
+  eventid = 'partial'
+
+  def setUp(self):
+    UtilTestCase.setUp(self)
+    self.server = TestServer({'/boot.iso': (DATA, '"v1"')})
+    self.path = pps.path(self.server.url + 'boot.iso')
+    self.part = self.tmpdir / '.boot.iso.part'
+
+  def tearDown(self):
+    self.server.close()
+    UtilTestCase.tearDown(self)
+
+  def leave_partial(self, size, etag='"v1"', url=None):
+    "Leave the first size bytes of DATA as if from an interrupted download"
+    self.part.write_text(DATA[:size])
+    partial.save_info(self.part, { 'url':           url or str(self.path),
+                                   'etag':          etag,
+                                   'last-modified': None,
+                                   'size':          len(DATA) })
+
+  def gets(self):
+    "Return the (range, if-range) headers of the GET requests received"
+    return [ (r[2], r[3]) for r in self.server.requests if r[0] == 'GET' ]
+
+class Test_Download(PartialTestCase):
+  "a download with nothing to resume requests the whole file"
+  def runTest(self):
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(), [(None, None)])
+    self.failUnlessEqual(partial.load_info(self.part)['etag'], '"v1"')
+
+class Test_ResumeInRun(PartialTestCase):
+  "an interrupted download is resumed within the same fill()"
+  def runTest(self):
+    self.server.cut(100000)
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(),
+                         [(None, None), ('bytes=100000-', '"v1"')])
+
+class Test_ResumeNextRun(PartialTestCase):
+  "a partial file left by an earlier run is resumed"
+  def runTest(self):
+    self.leave_partial(200000)
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(), [('bytes=200000-', '"v1"')])
+
+class Test_ChangedValidator(PartialTestCase):
+  "a partial file of an older version of the file is started over"
+  def runTest(self):
+    self.leave_partial(200000, etag='"v0"')
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    # the server ignores the range, as If-Range does not match
+    self.failUnlessEqual(self.gets(), [('bytes=200000-', '"v0"')])
+    self.failUnlessEqual(partial.load_info(self.part)['etag'], '"v1"')
+
+class Test_WeakValidator(PartialTestCase):
+  "a partial file with only a weak ETag is not resumed"
+  def runTest(self):
+    self.leave_partial(200000, etag='W/"v1"')
+    self.failUnlessEqual(partial.resumable(self.path, self.part), 0)
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(), [(None, None)])
+
+class Test_OtherUrl(PartialTestCase):
+  "a partial file of a different url is not resumed"
+  def runTest(self):
+    self.leave_partial(200000, url=self.server.url + 'other.iso')
+    self.failUnlessEqual(partial.resumable(self.path, self.part), 0)
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(), [(None, None)])
+
+class Test_InterruptedLeavesPartial(PartialTestCase):
+  "a download that keeps failing leaves its partial file to resume later"
+  def runTest(self):
+    # cut off the first attempt and every retry
+    self.server.cut(1000, times=partial.RETRIES+1)
+    self.failUnlessRaises(Exception, partial.fill, self.path, self.part)
+    self.failUnless(partial.resumable(self.path, self.part) > 0)
+
+    self.server.requests = []
+    offset = partial.resumable(self.path, self.part)
+    self.failUnless(partial.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+    self.failUnlessEqual(self.gets(), [('bytes=%d-' % offset, '"v1"')])
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())
@@ -0,0 +1,120 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import os
+import sys
+import unittest
+
+from deploy.util import pps
+
+from deploy.util.pps.cache       import CacheHandler
+from deploy.util.pps.lib         import mirror, segmented
+from deploy.util.pps.Path.error  import PathError
+
+from dtest.util import UtilTestCase, TestServer
+
+PART_SIZE = 64*1024
+DATA = os.urandom(PART_SIZE*16 + 123)
+
+class SegmentedTestCase(UtilTestCase):
+  "Downloads DATA in parts from mirrors, the first of them broken"
+  eventid = 'segmented'
+  broken = 1 # number of mirrors, first in the group, that cut off ranges
+
+  def setUp(self):
+    UtilTestCase.setUp(self)
+    self.params = segmented.segment_params.copy()
+    segmented.segment_params.update(jobs=4, host_jobs=2,
+                                    min_size=PART_SIZE, part_size=PART_SIZE)
+
+    self.servers = []
+    for i in range(3):
+      server = TestServer({'/images/install.img': (DATA, '"v1"')})
+      if i < self.broken:
+        server.cut(1000, times=None, ranges_only=True)
+      self.servers.append(server)
+
+    self.cache_handler = CacheHandler(cache_dir=self.tmpdir / 'cache')
+    self.mirrorgroup = mirror.MirrorGroup([ s.url for s in self.servers ],
+                                          self.cache_handler)
+    self.path = pps.path('mirror:%s::/images/install.img' % self.servers[0].url)
+    pps.Path.mirror.mgcache[pps.path('mirror:%s::/' % self.servers[0].url)] = \
+      self.mirrorgroup
+    self.part = self.tmpdir / 'install.img.part'
+
+  def tearDown(self):
+    pps.Path.mirror.mgcache.clear()
+    self.cache_handler.unwrap_path()
+    for server in self.servers:
+      server.close()
+    segmented.segment_params.clear()
+    segmented.segment_params.update(self.params)
+    UtilTestCase.tearDown(self)
+
+  def ranges(self, server):
+    "Return the start offsets of the range requests server received"
+    return [ int(r[2].split('=')[1].split('-')[0])
+             for r in server.requests if r[0] == 'GET' and r[2] ]
+
+class Test_Failover(SegmentedTestCase):
+  "parts cut off by a broken mirror are completed from the others"
+  def runTest(self):
+    self.failUnless(segmented.fill(self.path, self.part))
+    self.failUnlessEqual(self.part.read_text(), DATA)
+
+    broken, good = self.servers[0], self.servers[1:]
+    # the broken mirror is dropped once it has failed MAX_FAILURES times
+    cutoff = self.ranges(broken)
+    self.failUnless(segmented.MAX_FAILURES <= len(cutoff) <
+                    segmented.MAX_FAILURES + segmented.segment_params['host_jobs'])
+    self.failUnless(self.mirrorgroup.scores.scores[str(pps.path(broken.url))]
+                    ['failures'] > 0)
+    # parts resume from the last byte received rather than starting over
+    resumed = [ start for s in good for start in self.ranges(s)
+                if start % PART_SIZE ]
+    self.failUnless(resumed)
+    for start in resumed:
+      self.failUnless(start - 1000 in cutoff)
+
+class Test_AllSourcesFail(SegmentedTestCase):
+  "the download fails, and the partial file is removed, if every mirror does"
+  broken = 3
+
+  def runTest(self):
+    self.failUnlessRaises(PathError, segmented.fill, self.path, self.part)
+    self.failIf(self.part.exists())
+
+class Test_Disabled(SegmentedTestCase):
+  "nothing is downloaded when segmented downloads are disabled"
+  def runTest(self):
+    segmented.segment_params['jobs'] = 1
+    self.failIf(segmented.fill(self.path, self.part))
+    self.failIf(self.part.exists())
+
+class Test_SmallFile(SegmentedTestCase):
+  "files smaller than min_size are left to the normal download"
+  def runTest(self):
+    segmented.segment_params['min_size'] = len(DATA) + 1
+    self.failIf(segmented.fill(self.path, self.part))
+    self.failIf(self.part.exists())
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())
@@ -0,0 +1,130 @@
+#
+# Copyright (c) 2015
+# Deploy Foundation. All rights reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>
+#
+import sys
+import unittest
+
+from deploy.util import rxml
+
+from deploy.util.difftest          import DiffTest
+from deploy.util.difftest          import store
+from deploy.util.difftest.handlers import DiffHandler, InputHandler
+
+from dtest.util import UtilTestCase
+
+class NotesHandler(DiffHandler):
+  "A handler that only implements mdread() and mdwrite()"
+  def __init__(self, notes=None):
+    DiffHandler.__init__(self)
+    self.name = 'notes'
+    self.notes = notes
+    self.oldnotes = None
+
+  def clear(self):
+    self.oldnotes = None
+
+  def mdread(self, metadata, *args, **kwargs):
+    self.oldnotes = metadata.getxpath('/metadata/notes/text()', None)
+
+  def mdwrite(self, root, *args, **kwargs):
+    rxml.config.Element('notes', parent=root, text=self.notes)
+
+  def diff(self):
+    if self.oldnotes != self.notes:
+      self.diffdict = {'notes': (self.oldnotes, self.notes)}
+    else:
+      self.diffdict = {}
+    return self.diffdict
+
+class StoreTestCase(UtilTestCase):
+  "Tracks the files in tmpdir/input with a DiffTest"
+  eventid = 'store'
+
+  def setUp(self):
+    UtilTestCase.setUp(self)
+    self.input = self.tmpdir / 'input'
+    self.input.mkdirs()
+    for name in ['a', 'b', 'c']:
+      (self.input / name).write_text('%s\n' % name)
+    self.mdfile = self.tmpdir / 'test.md'
+
+  def difftest(self, backend, notes='v1'):
+    "Return a DiffTest for mdfile in the format backend, with its metadata read"
+    dt = DiffTest(self.mdfile, backend=backend)
+    dt.addHandler(InputHandler([self.input]))
+    dt.addHandler(NotesHandler(notes))
+    dt.read_metadata()
+    return dt
+
+class Test_SqliteRoundTrip(StoreTestCase):
+  "metadata written in sqlite format is read back unchanged"
+  def runTest(self):
+    self.failUnless(self.difftest('sqlite').test())
+    self.failUnless(store.is_sqlite(self.mdfile))
+
+    dt = self.difftest('sqlite')
+    self.failIf(dt.changed())
+
+    (self.input / 'a').write_text('changed\n')
+    dt = self.difftest('sqlite', notes='v2')
+    self.failUnless(dt.changed())
+    self.failUnlessEqual(dt.handlers[0].diffdict.keys(), [self.input / 'a'])
+    self.failUnlessEqual(dt.handlers[1].diffdict,
+                         {'notes': ('v1', 'v2')})
+
+class Test_XmlToSqlite(StoreTestCase):
+  "metadata in xml format is read, and converted when written, by sqlite"
+  def runTest(self):
+    self.difftest('xml').test()
+    self.failIf(store.is_sqlite(self.mdfile))
+    self.failUnlessEqual(store.open_store(self.mdfile).format, 'xml')
+
+    dt = self.difftest('sqlite')
+    self.failIf(dt.changed())
+    dt.write_metadata()
+    self.failUnless(store.is_sqlite(self.mdfile))
+    self.failUnlessEqual(store.open_store(self.mdfile).format, 'sqlite')
+    self.failIf(self.difftest('sqlite').changed())
+
+class Test_SqliteToXml(StoreTestCase):
+  "metadata in sqlite format is read, and converted when written, by xml"
+  def runTest(self):
+    self.difftest('sqlite').test()
+
+    dt = self.difftest('xml')
+    self.failIf(dt.changed())
+    dt.write_metadata()
+    self.failIf(store.is_sqlite(self.mdfile))
+    self.failIf(self.difftest('xml').changed())
+
+class Test_Unreadable(StoreTestCase):
+  "an unreadable metadata file is treated as if there were no metadata"
+  def runTest(self):
+    self.difftest('sqlite').test()
+    self.mdfile.write_text(store.SQLITE_MAGIC + 'garbage' * 100)
+
+    dt = self.difftest('sqlite')
+    self.failUnless(dt.changed())
+    dt.write_metadata()
+    self.failIf(self.difftest('sqlite').changed())
+
+def make_suite(os=None, version=None, arch=None):
+  return unittest.defaultTestLoader.loadTestsFromModule(
+           sys.modules[__name__])
+
+if __name__ == '__main__':
+  unittest.TextTestRunner(verbosity=2).run(make_suite())